@@ -10,7 +10,11 @@ manage (i.e., list, created, import, delete) GPG keys.
 
 from __future__ import absolute_import
 # stdlib, alphabetical
+import codecs
 import logging
+import os
+import subprocess
+import threading
 
 # Third party dependencies, alphabetical
 import gnupg
@@ -34,11 +38,22 @@ IMPORT_ERROR = 'import error'
 ENCR_WORKS = 'yes'
 ENCR_FAILS = 'no'
 
+# Bytes read at a time from GPG's decrypted output
+DECRYPT_BUFFER_SIZE = 1024 * 1024
+
+# Files in the GnuPG home directory that change when keys are added or
+# deleted, for GnuPG 1 and 2
+KEYRING_FILES = ('pubring.gpg', 'secring.gpg', 'pubring.kbx',
+                 'private-keys-v1.d')
+
 
 class GPG(object):
 
     def __init__(self):
         self._gpg = None
+        self._private_keys = None
+        self._keyring_state = None
+        self._lock = threading.Lock()
 
     def __call__(self):
         if not self._gpg:
@@ -52,6 +67,35 @@ class GPG(object):
             self._gpg = gnupg.GPG(gnupghome=gnupg_home_path)
         return self._gpg
 
+    def _get_keyring_state(self):
+        state = []
+        for name in KEYRING_FILES:
+            try:
+                stat_result = os.stat(os.path.join(self().gnupghome, name))
+                state.append((stat_result.st_mtime, stat_result.st_size))
+            except OSError:
+                state.append(None)
+        return state
+
+    def list_private_keys(self):
+        """Return the private keys in the keyring, like ``list_keys(True)``.
+
+        The list is kept until keys are added or deleted, here or by another
+        process, so callers must not modify it.
+        """
+        state = self._get_keyring_state()
+        with self._lock:
+            if self._private_keys is None or state != self._keyring_state:
+                self._private_keys = self().list_keys(True)
+                self._keyring_state = state
+            return self._private_keys
+
+    def forget_keys(self):
+        """Forget the keys listed by ``list_private_keys``, after changing the
+        keyring."""
+        with self._lock:
+            self._private_keys = None
+
 
 gpg = GPG()
 
@@ -60,7 +104,7 @@ def get_gpg_key(fingerprint):
     """Return the GPG key with fingerprint ``fingerprint`` or None if there is
     no such key in the SS's GPG keyring.
     """
-    key_map = gpg().list_keys(True).key_map  # ``True`` means return private keys
+    key_map = gpg.list_private_keys().key_map
     return key_map.get(fingerprint)
 
 
@@ -68,11 +112,11 @@ def get_gpg_key_list():
     """Return a list of all GPG keys as dicts. If the Storage Service default
     key does not exist, we create it here before returning the list.
     """
-    keys = gpg().list_keys(True)
+    keys = gpg.list_private_keys()
     default_key = get_default_gpg_key(keys)
     if not default_key:
         generate_default_gpg_key()
-        keys = gpg().list_keys(True)
+        keys = gpg.list_private_keys()
     return keys
 
 
@@ -104,6 +148,7 @@ def generate_default_gpg_key():
     )
     LOGGER.info('Creating default AM SS key with name %s', DFLT_KEY_REAL_NAME)
     gpg().gen_key(input_data)
+    gpg.forget_keys()
     LOGGER.info('Finished creating default AM SS key with name %s',
                 DFLT_KEY_REAL_NAME)
 
@@ -117,7 +162,10 @@ def generate_gpg_key(name_real, name_email):
         name_email=name_email,
         passphrase=DFLT_KEY_PASSPHRASE
     )
-    return gpg().gen_key(input_data)
+    try:
+        return gpg().gen_key(input_data)
+    finally:
+        gpg.forget_keys()
 
 
 def import_gpg_key(ascii_armor):
@@ -126,6 +174,7 @@ def import_gpg_key(ascii_armor):
     indicating why and delete any key created in the process.
     """
     import_result = gpg().import_keys(ascii_armor)
+    gpg.forget_keys()
     if import_result.count == 1:
         fingerprint = import_result.fingerprints[0]
         it_works = encryption_works(fingerprint)
@@ -177,6 +226,7 @@ def export_gpg_key(fingerprint):
 def delete_gpg_key(fingerprint):
     """Delete the GPG key with fingerprint ``fingerprint``.  """
     result = gpg().delete_keys(fingerprint, True)
+    gpg.forget_keys()
     try:
         assert str(result) == 'ok'
         return True
@@ -192,6 +242,79 @@ def gpg_decrypt_file(path, decr_path):
         return gpg().decrypt_file(stream, output=decr_path)
 
 
+def gpg_decrypt_file_to_consumer(path, consume):
+    """Use GPG to decrypt the file at ``path`` and pass the decrypted data to
+    ``consume`` as it is decrypted, instead of saving it to a file.
+
+    ``consume`` is called with GPG's output pipe to read the decrypted data
+    from, so it is never written to disk. GPG is run directly rather than by
+    Python-GnuPG, which only collects the output in memory; only its status
+    output is read in another thread. Under gevent workers both are greenlets
+    reading cooperative pipes, so nothing blocks the worker. Returns the
+    Python-GnuPG decryption result <gnupg.Crypt> object; if ``consume``
+    raises, its exception is re-raised once GPG is done.
+    """
+    gnupg_gpg = gpg()
+    result = gnupg_gpg.result_map['crypt'](gnupg_gpg)
+    process = subprocess.Popen(
+        gnupg_gpg.make_args(['--decrypt', '--', path], False),
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    process.stdin.close()
+    # Python-GnuPG parses the status lines into the result, as it does for
+    # its own GPG processes (python-gnupg is pinned, see requirements)
+    status_reader = threading.Thread(
+        target=gnupg_gpg._read_response,
+        args=(codecs.getreader(gnupg_gpg.encoding)(process.stderr), result))
+    status_reader.daemon = True
+    status_reader.start()
+    try:
+        consume(process.stdout)
+    finally:
+        # Don't leave GPG blocked writing to the pipe
+        while process.stdout.read(DECRYPT_BUFFER_SIZE):
+            pass
+        process.stdout.close()
+        status_reader.join()
+        process.wait()
+        process.stderr.close()
+    return result
+
+
+def gpg_encrypt_stream(stream, encr_path, recipient_fingerprint):
+    """Use GPG to encrypt everything read from the file object ``stream``
+    to the file at ``encr_path`` and make it decryptable only with the key
+    with fingerprint ``recipient_fingerprint``. Returns the Python-GnuPG
+    encryption result <gnupg.Crypt> object.
+    """
+    return gpg().encrypt_file(
+        stream,
+        [recipient_fingerprint],
+        armor=False,
+        always_trust=True,  # so we can use imported keys
+        output=encr_path)
+
+
+def gpg_encrypt_data(data, recipient_fingerprint):
+    """Use GPG to encrypt the string ``data`` so that it is decryptable only
+    with the key with fingerprint ``recipient_fingerprint``. Returns the
+    Python-GnuPG encryption result <gnupg.Crypt> object, whose ``data`` is the
+    ASCII armored encrypted string.
+    """
+    return gpg().encrypt(
+        data,
+        [recipient_fingerprint],
+        armor=True,
+        always_trust=True)  # so we can use imported keys
+
+
+def gpg_decrypt_data(data):
+    """Use GPG to decrypt the string ``data``, encrypted with
+    ``gpg_encrypt_data``. Returns the Python-GnuPG decryption result
+    <gnupg.Crypt> object, whose ``data`` is the decrypted string.
+    """
+    return gpg().decrypt(data)
+
+
 def gpg_encrypt_file(path, recipient_fingerprint):
     """Use GPG to encrypt the file at ``path`` and make it decryptable only
     with the key with fingerprint ``recipient_fingerprint``. The encrypted file
@@ -200,10 +323,5 @@ def gpg_encrypt_file(path, recipient_fingerprint):
     """
     encr_path = path + '.gpg'
     with open(path, 'rb') as stream:
-        result = gpg().encrypt_file(
-            stream,
-            [recipient_fingerprint],
-            armor=False,
-            always_trust=True,  # so we can use imported keys
-            output=encr_path)
+        result = gpg_encrypt_stream(stream, encr_path, recipient_fingerprint)
     return encr_path, result
@@ -1,6 +1,7 @@
 import ast
-from collections import namedtuple
+from collections import deque, namedtuple
 import datetime
+import errno
 import hashlib
 import logging
 from lxml import etree
@@ -8,10 +9,19 @@ from lxml.builder import ElementMaker
 import mimetypes
 import os
 import shutil
+import stat
+import subprocess
+import sys
+import tarfile
+import threading
+import time
 import uuid
+import zipfile
 
+from concurrent import futures
 from metsrw.plugins import premisrw
 
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django import http
 from django.utils.translation import ugettext as _
@@ -275,17 +285,393 @@ def get_compression(pointer_path):
 
 # ########### OTHER ############
 
+# Large reads keep network filesystems busy and amortise per-call overhead
+CHECKSUM_BLOCK_SIZE = 1024 * 1024
+
+
+class ReadBudget(object):
+    """Limit the average rate at which data is read, across threads."""
+
+    def __init__(self, rate):
+        """:param rate: Bytes per second. 0 or None for no limit."""
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._available_at = time.time()
+
+    def reserve(self, size):
+        """Reserve `size` bytes of reads and return how many seconds to wait before reading them."""
+        if not self.rate:
+            return 0
+        with self._lock:
+            now = time.time()
+            start = max(now, self._available_at)
+            self._available_at = start + size / float(self.rate)
+            return start - now
+
+    def spend(self, size):
+        """Wait until `size` bytes, just read, fit in the budget.
+
+        Called after every block read, so that a long read is spread out
+        rather than done at full speed after a single wait."""
+        wait = self.reserve(size)
+        if wait > 0:
+            time.sleep(wait)
+
+
 def generate_checksum(file_path, checksum_type='md5'):
     """
     Returns checksum object for `file_path` using `checksum_type`.
 
     If checksum_type is not a valid checksum, ValueError raised by hashlib.
     """
-    checksum = hashlib.new(checksum_type)
+    return generate_checksums(file_path, (checksum_type,))[checksum_type]
+
+
+def generate_checksums(file_path, checksum_types=('md5',)):
+    """
+    Returns a dict of checksum type -> checksum object for `file_path`,
+    reading the file only once for all of `checksum_types`.
+
+    If a checksum type is not valid, ValueError raised by hashlib.
+    """
+    checksums = dict((checksum_type, hashlib.new(checksum_type))
+                     for checksum_type in checksum_types)
     with open(file_path, 'rb') as f:
-        for chunk in iter(lambda: f.read(128 * checksum.block_size), b''):
-            checksum.update(chunk)
-    return checksum
+        for chunk in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), b''):
+            for checksum in checksums.values():
+                checksum.update(chunk)
+    return checksums
+
+
+def _gevent_patched_threading():
+    """Return True if gevent has monkey-patched ``threading``, in which case
+    ``threading.Thread`` runs greenlets on a single OS thread."""
+    if 'gevent.monkey' not in sys.modules:
+        return False
+    return sys.modules['gevent.monkey'].is_module_patched('threading')
+
+
+def start_native_thread(target, *args):
+    """
+    Call ``target(*args)`` in a native daemon thread and return immediately.
+
+    Under gevent workers the thread comes from the hub's threadpool, since a
+    patched ``threading.Thread`` is a greenlet, and blocking I/O in it would
+    block every other request of the worker.
+    """
+    if _gevent_patched_threading():
+        import gevent
+        gevent.get_hub().threadpool.spawn(target, *args)
+    else:
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+
+
+def map_in_threads(func, iterable, workers):
+    """
+    Yields ``func(item)`` for each item in ``iterable``, in order, calling it
+    in up to ``workers`` native threads.
+
+    Meant for work that releases the GIL, like hashing (hashlib does for large
+    buffers) and file I/O. Under gevent workers the threads come from gevent's
+    threadpool, since patched threads would all share the hub's OS thread.
+    ``iterable`` is consumed as results are taken, a few items ahead of them,
+    so it can be a lazy iterator over many items.
+    """
+    if workers <= 1:
+        for item in iterable:
+            yield func(item)
+    elif _gevent_patched_threading():
+        from gevent.threadpool import ThreadPool
+        pool = ThreadPool(workers)
+        try:
+            for result in pool.imap(func, iterable, maxsize=workers):
+                yield result
+        finally:
+            pool.kill()
+    else:
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for item in iterable:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+
+# Output of commands run with cached_check_output, by command
+_CHECK_OUTPUT_CACHE = {}
+_CHECK_OUTPUT_CACHE_LOCK = threading.Lock()
+
+
+def cached_check_output(command):
+    """
+    Return the output of ``subprocess.check_output(command)``, running it only
+    once per process.
+
+    Meant for probes whose output doesn't change while the storage service
+    runs, like the versions of command line tools recorded in PREMIS events.
+    Failures are not cached.
+    """
+    key = tuple(command) if isinstance(command, list) else command
+    with _CHECK_OUTPUT_CACHE_LOCK:
+        if key in _CHECK_OUTPUT_CACHE:
+            return _CHECK_OUTPUT_CACHE[key]
+    output = subprocess.check_output(command)
+    with _CHECK_OUTPUT_CACHE_LOCK:
+        _CHECK_OUTPUT_CACHE[key] = output
+    return output
+
+
+def clear_cached_check_output():
+    """Forget the output of every command run with cached_check_output,
+    e.g., after upgrading a tool."""
+    with _CHECK_OUTPUT_CACHE_LOCK:
+        _CHECK_OUTPUT_CACHE.clear()
+
+
+SEVENZIP_SIGNATURE = b"7z\xbc\xaf'\x1c"
+
+# Kinds of archive members that are neither files nor directories
+MEMBER_SYMLINK = 'symlink'
+MEMBER_HARDLINK = 'hardlink'
+MEMBER_OTHER = 'other'
+
+# A member of an archive that is neither a file nor a directory, yielded by
+# `iter_archive_members` in place of a stream. ``target`` is what a link
+# points to (the name of another member for hard links), or None.
+SpecialMember = namedtuple('SpecialMember', ['kind', 'target'])
+
+
+def is_streamable_archive(path):
+    """Return True if ``path`` is an archive `iter_archive_members` can read."""
+    return os.path.isfile(path) and (
+        zipfile.is_zipfile(path) or is_7z_archive(path) or
+        tarfile.is_tarfile(path))
+
+
+def is_indexed_archive(path):
+    """Return True if ``path`` is an archive whose members can be listed
+    without reading all of it, i.e. a ZIP or 7z archive."""
+    return os.path.isfile(path) and (
+        zipfile.is_zipfile(path) or is_7z_archive(path))
+
+
+class _BoundedReader(object):
+    """Read at most ``size`` bytes from the file-like object ``stream``."""
+
+    def __init__(self, stream, size):
+        self.stream = stream
+        self.remaining = size
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.read(size) if size else b''
+        if len(data) < size:
+            raise IOError(errno.EIO, 'Unexpected end of archive stream')
+        self.remaining -= len(data)
+        return data
+
+    def drain(self):
+        """Skip whatever has not been read yet."""
+        while self.remaining:
+            self.read(min(self.remaining, CHECKSUM_BLOCK_SIZE))
+
+
+def _iter_7z_members(path):
+    """Yield the members of the 7z archive at ``path`` like
+    `iter_archive_members`. The whole archive is extracted to stdout by one
+    ``7z x -so`` process, in the order ``7z l`` lists the members, and split
+    using the listed sizes."""
+    members = _list_7z_entries(path)
+    process = subprocess.Popen(['7z', 'x', '-so', path], stdout=subprocess.PIPE)
+    try:
+        for name, size, mtime, kind in members:
+            if kind == 'dir':
+                yield name, mtime, None
+                continue
+            stream = _BoundedReader(process.stdout, size)
+            try:
+                if kind == MEMBER_SYMLINK:
+                    # The data of a symlink is its target
+                    yield name, mtime, SpecialMember(kind, stream.read())
+                else:
+                    yield name, mtime, stream
+            finally:
+                stream.drain()
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, ['7z', 'x', '-so', path])
+
+
+def iter_archive_members(path, special=False):
+    """
+    Yield the members of the ZIP, 7z or tar archive at ``path`` in archive
+    order.
+
+    Each member is a tuple ``(name, mtime, stream)``. ``stream`` is a readable
+    file-like object for regular files and None for directories; it is only
+    valid until the next member is requested. Tar and 7z archives are read as a
+    stream, so the archive is read front to back exactly once.
+
+    Members that are neither files nor directories (e.g. links) are skipped,
+    unless ``special`` is True: then they are yielded with a `SpecialMember`
+    in place of ``stream``, so that callers copying the archive can keep them
+    or refuse to.
+    """
+    if is_7z_archive(path):
+        members = _iter_7z_members(path)
+    elif zipfile.is_zipfile(path):
+        members = _iter_zip_members(path)
+    else:
+        members = _iter_tar_members(path)
+    for name, mtime, stream in members:
+        if isinstance(stream, SpecialMember) and not special:
+            LOGGER.warning('Skipping %s in %s: not a file or directory',
+                           name, path)
+            continue
+        yield name, mtime, stream
+
+
+def _iter_zip_members(path):
+    """Yield the members of the ZIP archive at ``path`` like
+    `iter_archive_members`, from its central directory."""
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            if info.filename.endswith('/'):
+                yield info.filename, mtime, None
+                continue
+            # Unix modes are only recorded by archivers on Unix
+            mode = info.external_attr >> 16 if info.create_system == 3 else 0
+            if stat.S_ISLNK(mode):
+                yield info.filename, mtime, SpecialMember(
+                    MEMBER_SYMLINK, archive.read(info))
+                continue
+            if stat.S_IFMT(mode) not in (0, stat.S_IFREG):
+                yield info.filename, mtime, SpecialMember(MEMBER_OTHER, None)
+                continue
+            stream = archive.open(info)
+            try:
+                yield info.filename, mtime, stream
+            finally:
+                stream.close()
+
+
+def _iter_tar_members(path):
+    """Yield the members of the tar archive at ``path`` like
+    `iter_archive_members`, reading it as a stream."""
+    with tarfile.open(path, 'r|*') as archive:
+        for member in archive:
+            if member.isdir():
+                yield member.name, member.mtime, None
+            elif member.isfile():
+                yield member.name, member.mtime, archive.extractfile(member)
+            elif member.issym():
+                yield member.name, member.mtime, SpecialMember(
+                    MEMBER_SYMLINK, member.linkname)
+            elif member.islnk():
+                yield member.name, member.mtime, SpecialMember(
+                    MEMBER_HARDLINK, member.linkname)
+            else:
+                yield member.name, member.mtime, SpecialMember(
+                    MEMBER_OTHER, None)
+
+
+def is_7z_archive(path):
+    """Return True if ``path`` is a 7z archive."""
+    with open(path, 'rb') as f:
+        return f.read(len(SEVENZIP_SIGNATURE)) == SEVENZIP_SIGNATURE
+
+
+def _list_7z_entries(path):
+    """Return a list of (name, size, mtime, kind) for the members of the 7z
+    archive at ``path`` in archive order, from the technical listing printed
+    by ``7z l -slt``. ``kind`` is 'dir', 'file' or ``MEMBER_SYMLINK``."""
+    output = subprocess.check_output(['7z', 'l', '-slt', path])
+    entries = []
+    # Member blocks follow the dashed line and are separated by blank lines
+    listing = output.split('\n----------\n', 1)[-1]
+    for block in listing.split('\n\n'):
+        fields = dict(line.split(' = ', 1) for line in block.splitlines()
+                      if ' = ' in line)
+        if 'Path' not in fields:
+            continue
+        attributes = fields.get('Attributes', '')
+        # Archivers on Unix append the Unix mode, e.g. 'A_ lrwxrwxrwx'
+        unix_mode = attributes.split()[-1] if attributes.split() else ''
+        if fields.get('Folder') == '+' or attributes.startswith('D'):
+            kind = 'dir'
+        elif len(unix_mode) == 10 and unix_mode.startswith('l'):
+            kind = MEMBER_SYMLINK
+        else:
+            kind = 'file'
+        try:
+            mtime = time.mktime(time.strptime(
+                fields.get('Modified', '')[:19], '%Y-%m-%d %H:%M:%S'))
+        except ValueError:
+            mtime = None
+        entries.append((fields['Path'], int(fields.get('Size') or 0), mtime, kind))
+    return entries
+
+
+def _list_7z_members(path):
+    """Return a dict of name -> size for the files in the 7z archive at
+    ``path``."""
+    return dict((name, size) for name, size, __, kind in _list_7z_entries(path)
+                if kind == 'file')
+
+
+def list_archive_members(path):
+    """Return a dict of name -> size for the files in the archive at ``path``.
+
+    Only the archive's index is read for ZIP and 7z archives; tar archives are
+    read as a stream without extracting anything.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            return dict((info.filename, info.file_size)
+                        for info in archive.infolist()
+                        if not info.filename.endswith('/'))
+    if is_7z_archive(path):
+        return _list_7z_members(path)
+    with tarfile.open(path, 'r|*') as archive:
+        return dict((member.name, member.size) for member in archive
+                    if member.isfile())
+
+
+def read_archive_files(path, wanted):
+    """
+    Return a dict of name -> contents for the files in the archive at ``path``
+    whose name satisfies the ``wanted`` predicate.
+
+    ZIP members are read directly from the central directory and 7z members
+    are extracted one at a time to stdout; tar archives are read as a stream,
+    skipping over the data of any member that is not wanted.
+    """
+    found = {}
+    if is_7z_archive(path):
+        for name in _list_7z_members(path):
+            if wanted(name):
+                found[name] = subprocess.check_output(
+                    ['7z', 'x', '-so', path, name])
+        return found
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.filename.endswith('/') and wanted(info.filename):
+                    found[info.filename] = archive.read(info)
+        return found
+    with tarfile.open(path, 'r|*') as archive:
+        for member in archive:
+            if member.isfile() and wanted(member.name):
+                found[member.name] = archive.extractfile(member).read()
+    return found
 
 
 def uuid_to_path(uuid):
@@ -321,6 +707,44 @@ def removedirs(relative_path, base=None):
         head, tail = os.path.split(head)
 
 
+def ssh_options():
+    """ Return ssh options that share one master connection per remote user,
+    host and port, kept open for settings.SSH_CONTROL_PERSIST seconds.
+
+    Later ssh and rsync commands to the same host reuse the connection instead
+    of paying for a new handshake. Empty if connection sharing is disabled, or
+    if settings.SSH_CONTROL_DIR is not a directory private to this user: its
+    sockets give access to the remote hosts. """
+    if settings.SSH_CONTROL_PERSIST <= 0:
+        return []
+    control_dir = settings.SSH_CONTROL_DIR
+    try:
+        os.makedirs(control_dir, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    control_stat = os.lstat(control_dir)
+    if (not stat.S_ISDIR(control_stat.st_mode) or
+            control_stat.st_uid != os.getuid() or
+            stat.S_IMODE(control_stat.st_mode) & 0o077):
+        LOGGER.warning('Not sharing ssh connections: %s must be a directory'
+                       ' owned by this user with mode 0700', control_dir)
+        return []
+    return ['-o', 'ControlMaster=auto',
+            # %C is a hash of the local host, remote user, host and port
+            '-o', 'ControlPath=' + os.path.join(settings.SSH_CONTROL_DIR, '%C'),
+            '-o', 'ControlPersist={}'.format(settings.SSH_CONTROL_PERSIST)]
+
+
+def rsync_rsh(ssh_key=None):
+    """ Return the remote shell command rsync should run (its --rsh), using
+    ``ssh_key`` if given, and sharing ssh connections (see ssh_options). """
+    command = ['ssh']
+    if ssh_key:
+        command += ['-i', ssh_key]
+    return ' '.join(command + ssh_options())
+
+
 def coerce_str(string):
     """ Return string as a str, not a unicode, encoded in utf-8.
 
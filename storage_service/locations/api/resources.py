@@ -14,7 +14,7 @@ from django.conf import settings
 from django.conf.urls import url
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 from django.core.urlresolvers import reverse
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, StreamingHttpResponse
 from django.forms.models import model_to_dict
 from django.utils.translation import ugettext as _
 
@@ -36,9 +36,10 @@ from common import utils
 from locations.api.sword import views as sword_views
 
 from ..models import (Callback, CallbackError, Event, File, Package, Location, Space, Pipeline, StorageException)
+from ..models.space import BROWSE_SORT_KEYS
 from ..forms import SpaceForm
 from ..constants import PROTOCOL
-from locations import signals
+from locations import fixity, signals
 
 LOGGER = logging.getLogger(__name__)
 
@@ -101,6 +102,37 @@ def _custom_endpoint(expected_methods=['get'], required_fields=[]):
     return decorator
 
 
+def _browse_options(request, decode_path=lambda path: path):
+    """
+    Return the filter, sort and page options of a browse request, as keyword
+    arguments of Space.browse. Raises ValueError if any are invalid.
+
+    GET parameters: ``prefix`` and ``glob`` filter entries by name and are
+    decoded with ``decode_path`` like the path, to str like the names of
+    browse entries; ``order_by`` is one of BROWSE_SORT_KEYS, with a leading
+    '-' for descending order; ``offset`` and ``limit`` select a page of
+    entries.
+    """
+    options = {}
+    for name in ('prefix', 'glob'):
+        if request.GET.get(name):
+            options[name] = utils.coerce_str(decode_path(request.GET[name]))
+    order_by = request.GET.get('order_by', 'name')
+    options['reverse'] = order_by.startswith('-')
+    options['sort'] = order_by.lstrip('-')
+    if options['sort'] not in BROWSE_SORT_KEYS:
+        raise ValueError(_('order_by must be one of: %(keys)s') % {'keys': ', '.join(BROWSE_SORT_KEYS)})
+    try:
+        options['offset'] = int(request.GET.get('offset', 0))
+        if request.GET.get('limit'):
+            options['limit'] = int(request.GET['limit'])
+    except ValueError:
+        raise ValueError(_('offset and limit must be numbers'))
+    if options['offset'] < 0 or options.get('limit', 0) < 0:
+        raise ValueError(_('offset and limit must not be negative'))
+    return options
+
+
 class PipelineResource(ModelResource):
     # Attributes used for POST, exclude from GET
     create_default_locations = fields.BooleanField(use_in=lambda x: False)
@@ -207,7 +239,7 @@ class SpaceResource(ModelResource):
         obj.save()
         return bundle
 
-    def get_objects(self, space, path):
+    def get_objects(self, space, path, **options):
         message = _('This method should be accessed via a versioned subclass')
         raise NotImplementedError(message)
 
@@ -221,14 +253,20 @@ class SpaceResource(ModelResource):
         Directories is a subset of entries, all are just the name.
 
         If a path=<path> parameter is provided, will look in that path inside
-        the Space. """
+        the Space. Entries can be filtered, sorted and paginated with the
+        prefix, glob, order_by, offset and limit parameters, see
+        _browse_options. """
 
         space = bundle.obj
         path = request.GET.get('path', '')
         if not path.startswith(space.path):
             path = os.path.join(space.path, path)
+        try:
+            options = _browse_options(request)
+        except ValueError as err:
+            return http.HttpBadRequest(unicode(err))
 
-        objects = self.get_objects(space, path)
+        objects = self.get_objects(space, path, **options)
 
         return self.create_response(request, objects)
 
@@ -272,7 +310,7 @@ class LocationResource(ModelResource):
     def decode_path(self, path):
         return path
 
-    def get_objects(self, space, path):
+    def get_objects(self, space, path, **options):
         message = _('This method should be accessed via a versioned subclass')
         raise NotImplementedError(message)
 
@@ -310,7 +348,9 @@ class LocationResource(ModelResource):
         Directories is a subset of entries, all are just the name.
 
         If a path=<path> parameter is provided, will look in that path inside
-        the Location. """
+        the Location. Entries can be filtered, sorted and paginated with the
+        prefix, glob, order_by, offset and limit parameters, see
+        _browse_options. """
 
         location = bundle.obj
         path = request.GET.get('path', '')
@@ -320,8 +360,12 @@ class LocationResource(ModelResource):
             location_path = location_path.encode('utf8')
         if not path.startswith(location_path):
             path = os.path.join(location_path, path)
+        try:
+            options = _browse_options(request, self.decode_path)
+        except ValueError as err:
+            return http.HttpBadRequest(unicode(err))
 
-        objects = self.get_objects(location.space, path)
+        objects = self.get_objects(location.space, path, **options)
 
         return self.create_response(request, objects)
 
@@ -431,6 +475,9 @@ class PackageResource(ModelResource):
 
     Validate fixity (api/v1/file/<uuid>/check_fixity/) supports:
     GET: Scan package for fixity
+
+    Bulk validate fixity (api/v1/file/check_fixity/) supports:
+    GET: Scan all packages matching some filters for fixity
     """
     origin_pipeline = fields.ForeignKey(PipelineResource, 'origin_pipeline')
     origin_location = fields.ForeignKey(LocationResource, None, use_in=lambda x: False)
@@ -477,6 +524,7 @@ class PackageResource(ModelResource):
 
     def prepend_urls(self):
         return [
+            url(r"^(?P<resource_name>%s)/check_fixity%s$" % (self._meta.resource_name, trailing_slash()), self.wrap_view('bulk_check_fixity_request'), name="bulk_check_fixity_request"),
             url(r"^(?P<resource_name>%s)/(?P<%s>\w[\w/-]*)/delete_aip%s$" % (self._meta.resource_name, self._meta.detail_uri_name, trailing_slash()), self.wrap_view('delete_aip_request'), name="delete_aip_request"),
             url(r"^(?P<resource_name>%s)/(?P<%s>\w[\w/-]*)/recover_aip%s$" % (self._meta.resource_name, self._meta.detail_uri_name, trailing_slash()), self.wrap_view('recover_aip_request'), name="recover_aip_request"),
             url(r"^(?P<resource_name>%s)/(?P<%s>\w[\w/-]*)/extract_file%s$" % (self._meta.resource_name, self._meta.detail_uri_name, trailing_slash()), self.wrap_view('extract_file_request'), name="extract_file_request"),
@@ -749,6 +797,10 @@ class PackageResource(ModelResource):
             if not os.path.exists(extracted_file_path):
                 return http.HttpResponse(status=404, content=_('Requested file, %(filename)s, not found in AIP') % {'filename': relative_path_to_file})
         elif package.package_type in Package.PACKAGE_TYPE_CAN_EXTRACT:
+            # Don't read through the package for a file its manifest index
+            # shows it doesn't have
+            if not package.lists_file(relative_path_to_file):
+                return http.HttpResponse(status=404, content=_('Requested file, %(filename)s, not found in AIP') % {'filename': relative_path_to_file})
             # If file doesn't exist, try to extract it
             (extracted_file_path, temp_dir) = package.extract_file(relative_path_to_file)
         else:
@@ -804,18 +856,63 @@ class PackageResource(ModelResource):
         Check a package's bagit/fixity.
 
         :param force_local: GET parameter. If True, will ignore any space-specific bagit checks and run it locally.
+        :param quick: GET parameter. If True, will only check file presence, sizes and Payload-Oxum, unless that check fails.
         """
         force_local = False
         if request.GET.get('force_local') in ('True', 'true', '1'):
             force_local = True
+        quick = request.GET.get('quick') in ('True', 'true', '1')
         report_json, report_dict = (
             bundle.obj.get_fixity_check_report_send_signals(
-                force_local=force_local))
+                force_local=force_local, quick=quick))
         return http.HttpResponse(
             report_json,
             content_type="application/json"
         )
 
+    def bulk_check_fixity_request(self, request, **kwargs):
+        """
+        Check the fixity of all AIPs and AICs matching some filters.
+
+        The report is streamed as packages are checked, so clients can follow
+        progress; results are also recorded like single fixity checks.
+
+        :param location: GET parameter. UUID of the packages' location.
+        :param space: GET parameter. UUID of the packages' space.
+        :param status: GET parameter. Package status; can be repeated. Default: all stored packages.
+        :param min_age: GET parameter. Only check packages not checked in this many days.
+        :param workers: GET parameter. Packages checked at once, up to settings.FIXITY_BULK_MAX_WORKERS.
+        :param quick: GET parameter. If True, will only check file presence, sizes and Payload-Oxum, unless that check fails.
+        :param force_local: GET parameter. If True, will ignore any space-specific bagit checks and run it locally.
+        :param format: GET parameter. 'json' (default) or 'csv'.
+        """
+        self.method_check(request, allowed=['get'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+        self.log_throttled_access(request)
+
+        report_format = request.GET.get('format', 'json')
+        if report_format not in fixity.REPORT_FORMATS:
+            return http.HttpBadRequest(_('Report format must be one of: %(formats)s') % {'formats': ', '.join(sorted(fixity.REPORT_FORMATS))})
+        try:
+            min_age = fixity.parse_min_age(request.GET.get('min_age'))
+            workers = int(request.GET.get('workers', 1))
+        except ValueError:
+            return http.HttpBadRequest(_('min_age and workers must be numbers'))
+        workers = max(1, min(workers, settings.FIXITY_BULK_MAX_WORKERS))
+
+        packages = fixity.filter_packages(
+            location=request.GET.get('location'),
+            space=request.GET.get('space'),
+            min_age=min_age,
+            status=request.GET.getlist('status')).iterator()
+        rows = fixity.check_packages(
+            packages, workers=workers,
+            force_local=request.GET.get('force_local') in ('True', 'true', '1'),
+            quick=request.GET.get('quick') in ('True', 'true', '1'))
+        iter_report, content_type = fixity.REPORT_FORMATS[report_format]
+        return StreamingHttpResponse(iter_report(rows), content_type=content_type)
+
     @_custom_endpoint(expected_methods=['get'])
     def aip_store_callback_request(self, request, bundle, **kwargs):
         package = bundle.obj
@@ -826,7 +923,13 @@ class PackageResource(ModelResource):
 
         fail = 0
 
-        if package.is_compressed:
+        # Use the sha512 checksums recorded when the AIP was stored, if any,
+        # rather than reading the manifest out of the package.
+        checksums = list(package.manifest_entries.filter(
+            algorithm='sha512').values_list('checksum', flat=True))
+        if checksums:
+            package_dir = tmpdir = None
+        elif package.is_compressed:
             # Don't extract the entire AIP, which could take forever;
             # instead, just extract bagit.txt and manifest-sha512.txt,
             # which is enough to get bag.entries with the
@@ -848,17 +951,18 @@ class PackageResource(ModelResource):
 
         safe_files = ('bag-info.txt', 'manifest-sha512.txt', 'bagit.txt')
 
-        bag = bagit.Bag(package_dir)
-        for f, checksums in bag.entries.items():
-            try:
-                cksum = checksums['sha512']
-            except KeyError:
-                # These files do not typically have an sha512 hash, so it's
-                # fine for these to be missing that key; every other file should.
-                if f not in safe_files:
-                    LOGGER.warning("Post-store callback: sha512 missing for file %s", f)
-                continue
+        if package_dir is not None:
+            bag = bagit.Bag(package_dir)
+            for f, entry_checksums in bag.entries.items():
+                try:
+                    checksums.append(entry_checksums['sha512'])
+                except KeyError:
+                    # These files do not typically have an sha512 hash, so it's
+                    # fine for these to be missing that key; every other file should.
+                    if f not in safe_files:
+                        LOGGER.warning("Post-store callback: sha512 missing for file %s", f)
 
+        for cksum in checksums:
             files = File.objects.filter(checksum=cksum, stored=False)
             if len(files) > 1:
                 LOGGER.warning("Multiple File entries found for sha512 %s", cksum)
@@ -21,7 +21,7 @@ import requests
 
 # This project, alphabetical
 from locations import models
-from common.utils import generate_checksum
+from common.utils import generate_checksums
 
 LOGGER = logging.getLogger(__name__)
 
@@ -194,7 +194,9 @@ def _fetch_content(deposit_uuid, objects, subdirs=None):
 
             temp_filename = os.path.join(temp_dir, filename)
 
-            if item['checksum'] is not None and item['checksum'] != generate_checksum(temp_filename, 'md5').hexdigest():
+            # Read the file once for both the download check and the record
+            checksums = generate_checksums(temp_filename, ('md5', 'sha512'))
+            if item['checksum'] is not None and item['checksum'] != checksums['md5'].hexdigest():
                 os.unlink(temp_filename)
                 raise Exception(_("Incorrect checksum"))
 
@@ -220,7 +222,7 @@ def _fetch_content(deposit_uuid, objects, subdirs=None):
             file_record = models.File(
                 name=item['filename'],
                 source_id=item['object_id'],
-                checksum=generate_checksum(new_path, 'sha512').hexdigest()
+                checksum=checksums['sha512'].hexdigest()
             )
             file_record.save()
         except Exception as e:
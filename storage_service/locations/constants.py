@@ -39,7 +39,7 @@ PROTOCOL = {
     models.Space.GPG: {
         'model': models.GPG,
         'form': forms.GPGForm,
-        'fields': ['key']
+        'fields': ['key', 'per_file_encryption']
     },
     # BUG: fields: [] works for obj_create, but includes everything in model_to_dict
     models.Space.LOCAL_FILESYSTEM: {
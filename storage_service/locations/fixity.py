@@ -0,0 +1,167 @@
+"""
+Check the fixity of many packages in one operation.
+
+Used by the bulk fixity API endpoint and the ``check_fixity`` management
+command, e.g. for an auditor's "verify everything in location X". Each package
+is checked with Package.get_fixity_check_report_send_signals, so results are
+recorded like single fixity checks, and a bounded pool of workers checks
+several packages at once.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import csv
+import datetime
+import io
+import json
+import logging
+
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from common import utils
+
+from .models import Package
+
+LOGGER = logging.getLogger(__name__)
+
+# Statuses of packages that are not (yet, or any more) in storage
+NOT_STORED = (Package.PENDING, Package.STAGING, Package.DELETED, Package.FAIL)
+
+# Columns of a bulk fixity report, in order
+REPORT_FIELDS = ('uuid', 'location', 'path', 'check_level', 'success',
+                 'message', 'missing', 'changed', 'untracked', 'error')
+
+
+def filter_packages(location=None, space=None, min_age=None, status=None):
+    """
+    Return the AIPs and AICs whose fixity can be checked, filtered.
+
+    Packages are ordered least recently checked first (never checked packages
+    first of all).
+
+    :param location: UUID of the packages' current location.
+    :param space: UUID of the packages' space.
+    :param datetime.timedelta min_age: Only packages not checked in this long.
+    :param status: List of package statuses. Default: all stored statuses.
+    """
+    packages = Package.objects.filter(package_type__in=(Package.AIP, Package.AIC))
+    if status:
+        packages = packages.filter(status__in=status)
+    else:
+        packages = packages.exclude(status__in=NOT_STORED)
+    if location:
+        packages = packages.filter(current_location_id=location)
+    if space:
+        packages = packages.filter(current_location__space_id=space)
+    if min_age is not None:
+        cutoff = timezone.now() - min_age
+        packages = packages.filter(
+            Q(latest_fixity_check_datetime__isnull=True) |
+            Q(latest_fixity_check_datetime__lt=cutoff))
+    return packages.select_related('current_location__space').order_by(
+        'latest_fixity_check_datetime', 'pk')
+
+
+def check_package(package, force_local=False, quick=False):
+    """
+    Check the fixity of ``package`` and return a row of the report.
+
+    Errors are logged and reported in the row's ``error`` instead of raised, so
+    one bad package does not stop a bulk check.
+    """
+    row = dict.fromkeys(REPORT_FIELDS)
+    row.update(uuid=package.uuid, location=package.current_location_id,
+               path=package.current_path)
+    try:
+        _, report = package.get_fixity_check_report_send_signals(
+            force_local=force_local, quick=quick)
+    except Exception as err:
+        LOGGER.exception('Error checking fixity of package %s', package.uuid)
+        row['error'] = str(err)
+        return row
+    files = report['failures']['files']
+    row.update(
+        check_level=report['check_level'],
+        success=report['success'],
+        message=report['message'],
+        missing=len(files['missing']),
+        changed=len(files['changed']),
+        untracked=len(files['untracked']),
+    )
+    return row
+
+
+def check_packages(packages, workers=1, force_local=False, quick=False):
+    """
+    Check the fixity of each of ``packages`` in up to ``workers`` threads.
+
+    Yields the report row of each package (see ``check_package``) in the
+    order of ``packages``, as soon as it and those before it are checked.
+    """
+    def check(package):
+        try:
+            return check_package(package, force_local=force_local, quick=quick)
+        finally:
+            if workers > 1:
+                # Worker threads each have their own database connection
+                connection.close()
+
+    return utils.map_in_threads(check, packages, workers)
+
+
+def summarize(rows, summary=None):
+    """Return counts of packages that passed, failed or were not checked,
+    added to those in ``summary`` if given."""
+    if summary is None:
+        summary = {'total': 0, 'passed': 0, 'failed': 0, 'not_checked': 0}
+    for row in rows:
+        summary['total'] += 1
+        if row['success'] is True:
+            summary['passed'] += 1
+        elif row['success'] is False:
+            summary['failed'] += 1
+        else:
+            summary['not_checked'] += 1
+    return summary
+
+
+def iter_json_report(rows):
+    """Yield a JSON report of ``rows`` in pieces, as each row comes in.
+
+    The report is an object with a ``packages`` list of rows and a ``summary``
+    (see ``summarize``). Rows are counted as they go, not kept."""
+    summary = summarize([])
+    yield '{"packages": ['
+    for row in rows:
+        yield (',\n' if summary['total'] else '\n') + json.dumps(row)
+        summarize([row], summary)
+    yield '\n], "summary": %s}\n' % json.dumps(summary)
+
+
+def iter_csv_report(rows):
+    """Yield a CSV report of ``rows``, one line at a time."""
+    def line(values):
+        buf = io.BytesIO()
+        csv.writer(buf).writerow([utils.coerce_str(value) for value in values])
+        return buf.getvalue()
+
+    yield line(REPORT_FIELDS)
+    for row in rows:
+        yield line(['' if row[field] is None else row[field]
+                    for field in REPORT_FIELDS])
+
+
+REPORT_FORMATS = {
+    'json': (iter_json_report, 'application/json'),
+    'csv': (iter_csv_report, 'text/csv'),
+}
+
+
+def parse_min_age(days):
+    """Return ``days`` (a number of days, as a string or number) as a
+    timedelta, or None if it is empty. Raises ValueError if invalid."""
+    if days in (None, ''):
+        return None
+    return datetime.timedelta(days=float(days))
@@ -140,7 +140,7 @@ class GPGForm(forms.ModelForm):
 
     class Meta:
         model = models.GPG
-        fields = ('key',)
+        fields = ('key', 'per_file_encryption')
 
 
 class LocalFilesystemForm(forms.ModelForm):
@@ -159,7 +159,7 @@ class PipelineLocalFSForm(forms.ModelForm):
     # TODO SpaceForm.path help text should say path to space on local machine
     class Meta:
         model = models.PipelineLocalFS
-        fields = ('remote_user', 'remote_name', 'assume_rsync_daemon', 'rsync_password')
+        fields = ('remote_user', 'remote_name', 'assume_rsync_daemon', 'rsync_password', 'remote_fixity')
 
 
 class LockssomaticForm(forms.ModelForm):
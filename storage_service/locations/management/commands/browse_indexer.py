@@ -0,0 +1,151 @@
+"""
+Keep the browse index of local transfer source and backlog locations up to date.
+
+Each location is walked with DirectoryStats.refresh, which only lists the
+directories that changed since the last walk and records every directory's
+entries and recursive object counts. Browsing those locations then reads the
+index (see path2browse_dict) instead of listing directories and counting their
+objects live, which matters most for NFS-mounted sources.
+
+Locations are walked again every --interval seconds. Where pyinotify is
+installed, files and directories created, deleted or renamed on this host
+also trigger a walk of the changed location once the changes settle. Changes
+made by other hosts on a network filesystem are only picked up by the
+periodic walks.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from locations.models import DirectoryStats, Location, Space
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+LOGGER = logging.getLogger(__name__)
+
+# Spaces whose locations are browsed with Space.browse_local
+LOCAL_PROTOCOLS = (Space.LOCAL_FILESYSTEM, Space.NFS)
+INDEXED_PURPOSES = (Location.TRANSFER_SOURCE, Location.BACKLOG)
+
+
+def indexed_locations(uuids=None):
+    """Return the enabled local transfer source and backlog locations,
+    optionally only those in ``uuids``."""
+    locations = Location.active.filter(
+        purpose__in=INDEXED_PURPOSES,
+        space__access_protocol__in=LOCAL_PROTOCOLS,
+    ).select_related('space')
+    if uuids:
+        locations = locations.filter(uuid__in=uuids)
+    return list(locations)
+
+
+def index_location(location):
+    """Bring the browse index of ``location`` up to date."""
+    start = time.time()
+    file_count = DirectoryStats.refresh(location.full_path)
+    LOGGER.info('Indexed %s: %d files in %.1fs', location.full_path,
+                file_count, time.time() - start)
+
+
+def is_under(path, directory):
+    """Return True if ``path`` is ``directory`` or inside it."""
+    return (path + os.sep).startswith(os.path.join(directory, ''))
+
+
+class ChangeWatcher(object):
+    """Wait for changes under some directories with inotify.
+
+    Only entries being created, deleted or renamed are watched: those are the
+    changes that update a directory's mtime and the index. Writes to existing
+    files (IN_CLOSE_WRITE) aren't, since file sizes aren't indexed and a walk
+    would not list the unchanged directory again anyway.
+    """
+
+    MASK = (pyinotify.IN_CREATE | pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM |
+            pyinotify.IN_MOVED_TO) if pyinotify else 0
+
+    def __init__(self):
+        self.watch_manager = pyinotify.WatchManager()
+        self.notifier = pyinotify.Notifier(self.watch_manager, self._changed)
+        self.watched = set()
+        self.changed = set()
+
+    def _changed(self, event):
+        self.changed.add(event.path)
+
+    def watch(self, paths):
+        """Watch the trees of ``paths``, and any directories created in them."""
+        for path in set(paths) - self.watched:
+            self.watch_manager.add_watch(path, self.MASK, rec=True, auto_add=True)
+            self.watched.add(path)
+
+    def wait(self, timeout):
+        """Wait up to ``timeout`` seconds for changes and return the set of
+        directories that changed."""
+        if self.notifier.check_events(max(0, timeout) * 1000):
+            self.notifier.read_events()
+            self.notifier.process_events()
+        changed, self.changed = self.changed, set()
+        return changed
+
+
+class Command(BaseCommand):
+    help = 'Keep the browse index of local transfer source and backlog locations up to date.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--location', action='append', dest='locations', default=[],
+                            help='UUID of a location to index. Can be repeated.'
+                                 ' Default: all local transfer source and backlog locations.')
+        parser.add_argument('--interval', type=int, default=300,
+                            help='Seconds between walks of every location.')
+        parser.add_argument('--settle', type=int, default=5,
+                            help='Seconds to wait for more changes after inotify reports one.')
+        parser.add_argument('--no-inotify', action='store_true', default=False,
+                            help='Only walk locations periodically, even if pyinotify is installed.')
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='Walk every location once and exit.')
+
+    def handle(self, *args, **options):
+        self.options = options
+        if not indexed_locations(options['locations']):
+            raise CommandError('No local transfer source or backlog locations to index')
+        watcher = None
+        if not options['once'] and not options['no_inotify']:
+            if pyinotify is None:
+                LOGGER.info('pyinotify is not installed; only walking locations every %d seconds',
+                            options['interval'])
+            else:
+                watcher = ChangeWatcher()
+        while True:
+            # Locations added since the last walk are indexed too
+            locations = indexed_locations(options['locations'])
+            for location in locations:
+                index_location(location)
+            if options['once']:
+                break
+            if watcher is None:
+                time.sleep(options['interval'])
+                continue
+            watcher.watch(location.full_path for location in locations)
+            self.index_changes(watcher, locations, time.time() + options['interval'])
+
+    def index_changes(self, watcher, locations, until):
+        """Index locations as inotify reports changes in them, until ``until``."""
+        while time.time() < until:
+            changed = watcher.wait(until - time.time())
+            if not changed:
+                continue
+            time.sleep(self.options['settle'])
+            changed |= watcher.wait(0)
+            for location in locations:
+                if any(is_under(path, location.full_path) for path in changed):
+                    index_location(location)
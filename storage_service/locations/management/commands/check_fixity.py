@@ -0,0 +1,74 @@
+"""
+Check the fixity of every AIP and AIC matching some filters, once.
+
+For audits, e.g. "verify everything in location X": packages can be selected
+by location, space, status and time since their last fixity check, are checked
+by a bounded pool of workers, and a JSON or CSV report of every package and a
+summary is written to stdout or a file. Progress is logged to stderr as each
+package is checked. Results are also recorded like API fixity checks.
+
+Unlike schedule_fixity this does not budget reads or wait for quiet hours.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+
+from locations import fixity
+
+
+class Command(BaseCommand):
+    help = 'Check the fixity of the AIPs and AICs matching some filters and report the results.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--location', default=None,
+                            help='UUID of the location of the packages to check.')
+        parser.add_argument('--space', default=None,
+                            help='UUID of the space of the packages to check.')
+        parser.add_argument('--status', action='append', dest='statuses', default=[],
+                            help='Only check packages with this status. Can be repeated.'
+                                 ' Default: all stored packages.')
+        parser.add_argument('--min-age', default=None,
+                            help='Only check packages not checked in this many days.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Packages checked at the same time.')
+        parser.add_argument('--quick', action='store_true', default=False,
+                            help='Only check file presence, sizes and Payload-Oxum, unless that check fails.')
+        parser.add_argument('--force-local', action='store_true', default=False,
+                            help="Always run fixity locally, ignoring spaces' own fixity checks.")
+        parser.add_argument('--format', choices=sorted(fixity.REPORT_FORMATS), default='json',
+                            help='Format of the report.')
+        parser.add_argument('--output', default=None,
+                            help='File to write the report to. Default: stdout.')
+
+    def handle(self, *args, **options):
+        try:
+            min_age = fixity.parse_min_age(options['min_age'])
+        except ValueError:
+            raise CommandError('--min-age must be a number of days')
+        packages = fixity.filter_packages(
+            location=options['location'], space=options['space'],
+            min_age=min_age, status=options['statuses'])
+        total = packages.count()
+        rows = fixity.check_packages(
+            packages.iterator(), workers=max(1, options['workers']),
+            force_local=options['force_local'], quick=options['quick'])
+        iter_report = fixity.REPORT_FORMATS[options['format']][0]
+
+        report = iter_report(self.log_progress(rows, total))
+        if options['output']:
+            with open(options['output'], 'wb') as f:
+                for chunk in report:
+                    f.write(chunk)
+                    f.flush()
+        else:
+            for chunk in report:
+                self.stdout.write(chunk, ending='')
+
+    def log_progress(self, rows, total):
+        """Pass on ``rows``, logging each one to stderr."""
+        for count, row in enumerate(rows, 1):
+            self.stderr.write('[{}/{}] {}\t{}\t{}'.format(
+                count, total, row['uuid'], row['success'],
+                row['error'] or row['message']))
+            yield row
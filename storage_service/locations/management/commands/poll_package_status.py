@@ -0,0 +1,167 @@
+"""
+Poll asynchronous spaces for the status of packages stored in them.
+
+LOCKSS-o-matic and Arkivum store packages in the background; a package stays
+in the STAGING status until its space reports it as safely stored. This
+command polls every such package, in batches and with a cap on concurrent
+requests, so they converge to UPLOADED without anyone clicking "Update status"
+in the package list.
+
+Packages that are still not stored after a poll are retried with an
+exponential backoff, recorded in the package's misc_attributes.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import defaultdict
+from concurrent import futures
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from locations.models import Package, Space
+
+LOGGER = logging.getLogger(__name__)
+
+# Spaces that set package status asynchronously
+ASYNC_PROTOCOLS = (Space.LOM, Space.ARKIVUM)
+# Backoff bookkeeping keys in Package.misc_attributes
+ATTEMPTS_KEY = 'status_poll_attempts'
+NEXT_POLL_KEY = 'status_poll_next'
+
+
+class Command(BaseCommand):
+    help = 'Poll LOCKSS-o-matic and Arkivum spaces for the status of packages not yet stored.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--space', action='append', dest='spaces', default=[],
+                            help='UUID of a space to poll. Can be repeated. Default: all asynchronous spaces.')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of packages loaded and polled per batch.')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Maximum number of packages polled at the same time.')
+        parser.add_argument('--backoff', type=int, default=60,
+                            help='Seconds to wait before polling a package again after its first unsuccessful poll. Doubles with each further attempt.')
+        parser.add_argument('--max-backoff', type=int, default=24 * 60 * 60,
+                            help='Maximum number of seconds between polls of a package.')
+        parser.add_argument('--force', action='store_true', default=False,
+                            help='Poll every package, ignoring its backoff.')
+        parser.add_argument('--loop', action='store_true', default=False,
+                            help='Keep polling until interrupted.')
+        parser.add_argument('--interval', type=int, default=300,
+                            help='Seconds to sleep between passes when using --loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            counts = self.poll(**options)
+            print('Polled {polled} packages: {stored} stored, {pending} pending, {errors} errors, {skipped} backing off.'.format(**counts))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def poll(self, spaces=(), batch_size=100, concurrency=4, backoff=60,
+             max_backoff=24 * 60 * 60, force=False, **kwargs):
+        """
+        Poll every pending package once, in batches of `batch_size`.
+
+        :return: Dict of counts of polled, stored, pending, errors and skipped packages.
+        """
+        counts = dict.fromkeys(('polled', 'stored', 'pending', 'errors', 'skipped'), 0)
+        pending = Package.objects.filter(
+            status=Package.STAGING,
+            current_location__space__access_protocol__in=ASYNC_PROTOCOLS,
+        ).select_related('current_location__space').order_by('pk')
+        if spaces:
+            pending = pending.filter(current_location__space__uuid__in=spaces)
+
+        last_pk = 0
+        while True:
+            batch = list(pending.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            now = time.time()
+            due = [p for p in batch if force or p.misc_attributes.get(NEXT_POLL_KEY, 0) <= now]
+            counts['skipped'] += len(batch) - len(due)
+            results = self._poll_batch(due, concurrency)
+            self._save_results(results, backoff, max_backoff, counts)
+        return counts
+
+    def _poll_batch(self, packages, concurrency):
+        """
+        Poll `packages`, running at most `concurrency` polls at once.
+
+        Packages are grouped by space and each group is polled by one worker
+        with a single child space instance, so service documents and
+        connections are reused between packages.
+
+        :return: List of (package, new status, error message)
+        """
+        by_space = defaultdict(list)
+        for package in packages:
+            by_space[package.current_location.space].append(package)
+        work = []
+        for space, space_packages in by_space.items():
+            # Split large groups so every worker has something to do
+            slices = max(1, min(concurrency, len(space_packages)))
+            work.extend((space, space_packages[i::slices]) for i in range(slices))
+
+        if concurrency <= 1:
+            return [r for space, group in work for r in _poll_packages(space, group)]
+        results = []
+        with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            jobs = [executor.submit(_poll_packages, space, group, True) for space, group in work]
+            for job in futures.as_completed(jobs):
+                results.extend(job.result())
+        return results
+
+    def _save_results(self, results, backoff, max_backoff, counts):
+        """Update the backoff of the polled packages in one transaction."""
+        now = time.time()
+        with transaction.atomic():
+            for package, status, error in results:
+                counts['polled'] += 1
+                if status == Package.UPLOADED:
+                    counts['stored'] += 1
+                    package.misc_attributes.pop(ATTEMPTS_KEY, None)
+                    package.misc_attributes.pop(NEXT_POLL_KEY, None)
+                else:
+                    if status is None:
+                        counts['errors'] += 1
+                        LOGGER.warning('Error polling status of package %s: %s', package.uuid, error)
+                    else:
+                        counts['pending'] += 1
+                    attempts = package.misc_attributes.get(ATTEMPTS_KEY, 0) + 1
+                    package.misc_attributes[ATTEMPTS_KEY] = attempts
+                    package.misc_attributes[NEXT_POLL_KEY] = now + min(
+                        backoff * 2 ** (attempts - 1), max_backoff)
+                package.save(update_fields=['misc_attributes'])
+
+
+def _poll_packages(space, packages, close_connection=False):
+    """
+    Update the status of `packages`, all stored in `space`.
+
+    :param bool close_connection: Close this thread's database connection when done.
+    :return: List of (package, new status, error message)
+    """
+    results = []
+    try:
+        child_space = space.get_child_space()
+        for package in packages:
+            try:
+                status, error = child_space.update_package_status(package)
+            except Exception as e:
+                LOGGER.exception('Error updating status of package %s', package.uuid)
+                status, error = None, str(e)
+            results.append((package, status, error))
+    except Exception as e:
+        LOGGER.exception('Error polling space %s', space.uuid)
+        polled = set(r[0] for r in results)
+        results.extend((p, None, str(e)) for p in packages if p not in polled)
+    finally:
+        if close_connection:
+            connection.close()
+    return results
@@ -0,0 +1,229 @@
+"""
+Check the fixity of every stored AIP and AIC on a fixed cycle.
+
+Packages are checked least recently checked first (never checked packages
+first of all) and results are recorded through
+Package.get_fixity_check_report_send_signals, like fixity checks requested
+through the API. Reads are budgeted per space: each space gets its own
+workers and a read rate that every block read while hashing is paced by, so a
+scheduled sweep of the collection does not starve production I/O, even while
+a single large package is read. Checks are also paused outside the allowed
+hours and while more than --max-ingests packages are being stored.
+
+With --full-every, most checks are quick checks (file presence, sizes and
+Payload-Oxum, see Package.check_fixity_quick) and each package only has its
+checksums verified once per --full-every days, or whenever a quick check
+fails. With --sample-runs N, each of those checksum validations only covers
+a rotating 1/N of a package's files (see Package.check_fixity_sample), so
+very large packages are spread over N short checks instead of one long one;
+quick checks resume once all N have run.
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+from collections import OrderedDict
+import datetime
+import logging
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from django.utils.six.moves import queue
+
+from common.utils import ReadBudget
+from locations.fixity import filter_packages
+from locations.models import FixityLog, Package, Space
+
+LOGGER = logging.getLogger(__name__)
+
+# Spaces where packages stay STAGING until stored by an external system
+ASYNC_PROTOCOLS = (Space.LOM, Space.ARKIVUM)
+
+
+def due_packages(min_age):
+    """
+    Return stored AIPs and AICs not checked in `min_age`, oldest check first.
+
+    :param datetime.timedelta min_age: Minimum time since the last fixity check.
+    """
+    return filter_packages(min_age=min_age)
+
+
+def full_check_due(package, max_age):
+    """
+    Return True if `package` has not had a full fixity check in `max_age`.
+    A rotation of sampled checks that has verified every file counts as a
+    full check.
+
+    :param datetime.timedelta max_age: Maximum time between full checks.
+    """
+    since = timezone.now() - max_age
+    covered = package.fixity_sample_covered()
+    if covered is not None and covered >= since:
+        return False
+    return not FixityLog.objects.filter(
+        package=package,
+        check_level=FixityLog.FULL,
+        datetime_reported__gte=since,
+    ).exists()
+
+
+def parse_hours(value):
+    """Parse 'START-END' (hours, 0-24) into a tuple of ints."""
+    try:
+        start, end = [int(h) for h in value.split('-')]
+    except ValueError:
+        raise CommandError('Hours must be given as START-END, e.g. 22-6')
+    if not (0 <= start <= 24 and 0 <= end <= 24):
+        raise CommandError('Hours must be between 0 and 24')
+    return start, end
+
+
+def in_hours(hours, now=None):
+    """Return True if `now` (default: current local time) is within `hours`."""
+    if hours is None:
+        return True
+    hour = (now or datetime.datetime.now()).hour
+    start, end = hours
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end  # Window wraps past midnight
+
+
+def ingests_in_progress(timeout):
+    """
+    Return the number of packages currently being stored.
+
+    A package whose storage failed may stay PENDING or STAGING, so only
+    packages modified within `timeout` are counted.
+
+    :param datetime.timedelta timeout: Time after which a package still
+        being stored is assumed to have failed.
+    """
+    return Package.objects.filter(
+        status__in=(Package.PENDING, Package.STAGING),
+        modified__gte=timezone.now() - timeout,
+    ).exclude(
+        current_location__space__access_protocol__in=ASYNC_PROTOCOLS,
+    ).count()
+
+
+class Command(BaseCommand):
+    help = 'Check the fixity of all stored AIPs and AICs, least recently checked first.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=float, default=30,
+                            help='Days since the last fixity check before a package is checked again.')
+        parser.add_argument('--rate', type=float, default=50,
+                            help='Average MB/s read per space. 0 for no limit.')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Packages checked at the same time per space.')
+        parser.add_argument('--hours', type=parse_hours, default=None,
+                            help='Only start checks between these local hours, e.g. 22-6.')
+        parser.add_argument('--max-ingests', type=int, default=0,
+                            help='Pause while more than this many packages are being stored.'
+                                 ' Default: pause while any is.')
+        parser.add_argument('--ingest-timeout', type=float, default=24,
+                            help='Hours after which a package still being stored is assumed'
+                                 ' to have failed, and no longer pauses checks.')
+        parser.add_argument('--sleep', type=int, default=60,
+                            help='Seconds to wait while paused or when no package is due.')
+        parser.add_argument('--full-every', type=float, default=0,
+                            help='Days between full checksum validations of a package; quick'
+                                 ' checks are run in between. 0 to always run full checks.')
+        parser.add_argument('--sample-runs', type=int, default=0,
+                            help="Verify the checksums of 1/N of a package's files per check, so"
+                                 ' every file is verified once every N checks. 0 to verify all.')
+        parser.add_argument('--force-local', action='store_true', default=False,
+                            help="Always run fixity locally, ignoring spaces' own fixity checks.")
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='Check the packages that are due once and exit.')
+
+    def handle(self, *args, **options):
+        self.options = options
+        min_age = datetime.timedelta(days=options['min_age'])
+        rate = options['rate'] * 1000 * 1000
+        while True:
+            self.wait_until_allowed()
+            by_space = OrderedDict()
+            for package in due_packages(min_age):
+                by_space.setdefault(package.current_location.space, []).append(package)
+            if by_space:
+                self.check_spaces(by_space, rate)
+            if options['once']:
+                break
+            if not by_space:
+                time.sleep(options['sleep'])
+
+    def paused(self):
+        """Return the reason checks should not start now, or None."""
+        if not in_hours(self.options['hours']):
+            return 'outside of allowed hours'
+        max_ingests = self.options.get('max_ingests')
+        if max_ingests is None:
+            return None
+        ingests = ingests_in_progress(
+            datetime.timedelta(hours=self.options.get('ingest_timeout', 24)))
+        if ingests > max_ingests:
+            return '{} packages being stored'.format(ingests)
+        return None
+
+    def wait_until_allowed(self):
+        """Block while checks are paused."""
+        reason = self.paused()
+        while reason:
+            LOGGER.info('Fixity checks paused: %s', reason)
+            time.sleep(self.options['sleep'])
+            reason = self.paused()
+
+    def check_spaces(self, by_space, rate):
+        """Check the packages of every space, each space with its own workers & budget."""
+        threads = []
+        for space, packages in by_space.items():
+            budget = ReadBudget(rate)
+            todo = queue.Queue()
+            for package in packages:
+                todo.put(package)
+            for _ in range(max(1, self.options['concurrency'])):
+                thread = threading.Thread(target=self.worker, args=(todo, budget))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+    def worker(self, todo, budget):
+        """Check packages from `todo` until it is empty."""
+        try:
+            while True:
+                try:
+                    package = todo.get_nowait()
+                except queue.Empty:
+                    return
+                self.wait_until_allowed()
+                self.check(package, budget)
+        finally:
+            connection.close()
+
+    def check(self, package, budget):
+        """Check the fixity of `package`, reading it at the pace of `budget`."""
+        full_every = self.options.get('full_every')
+        quick = bool(full_every) and not full_check_due(
+            package, datetime.timedelta(days=full_every))
+        sample_runs = None if quick else self.options.get('sample_runs') or None
+        start = time.time()
+        try:
+            _, report = package.get_fixity_check_report_send_signals(
+                force_local=self.options['force_local'], quick=quick,
+                sample_runs=sample_runs, read_budget=budget)
+        except Exception:
+            LOGGER.exception('Error checking fixity of package %s', package.uuid)
+            return None
+        LOGGER.info('Fixity of package %s: %s (%.1fs)', package.uuid,
+                    report['success'], time.time() - start)
+        print('{}\t{}\t{}\t{}'.format(package.uuid, report['check_level'],
+                                     report['success'], report['message']))
+        return report
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0017_gpg_space_minor_migration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ManifestEntry',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('path', models.TextField(help_text='Path of the file relative to the root of the bag')),
+                ('size', models.BigIntegerField(help_text='Size in bytes of the file, if known', null=True)),
+                ('algorithm', models.CharField(max_length=16)),
+                ('checksum', models.CharField(max_length=128, db_index=True)),
+                ('package', models.ForeignKey(related_name='manifest_entries', to='locations.Package', to_field='uuid')),
+            ],
+            options={
+                'verbose_name': 'Manifest entry',
+                'verbose_name_plural': 'Manifest entries',
+            },
+        ),
+    ]
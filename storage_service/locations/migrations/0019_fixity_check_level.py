@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0018_manifestentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fixitylog',
+            name='check_level',
+            field=models.CharField(default='full', max_length=8, choices=[('quick', 'Quick: file presence, sizes and Payload-Oxum'), ('full', 'Full: checksums of every file')]),
+        ),
+        migrations.AddField(
+            model_name='manifestentry',
+            name='mtime',
+            field=models.BigIntegerField(help_text='Modification time of the file in seconds since the epoch, if stored uncompressed', null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0019_fixity_check_level'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='fixitylog',
+            name='check_level',
+            field=models.CharField(default='full', max_length=8, choices=[('quick', 'Quick: file presence, sizes and Payload-Oxum'), ('sample', 'Sample: quick check plus checksums of a share of files'), ('full', 'Full: checksums of every file')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0020_fixity_sample_check_level'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pipelinelocalfs',
+            name='remote_fixity',
+            field=models.BooleanField(default=False, verbose_name='Check fixity on remote host', help_text='If checked, fixity checks hash packages on the remote machine over ssh instead of copying them to the Storage Service. Requires the sha*sum/md5sum tools on the remote machine; not available with rsync daemon.'),
+        ),
+    ]
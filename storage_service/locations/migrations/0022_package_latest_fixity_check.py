@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def populate_latest_fixity_check(apps, schema_editor):
+    """Copy the latest FixityLog of each package onto the package."""
+    FixityLog = apps.get_model('locations', 'FixityLog')
+    Package = apps.get_model('locations', 'Package')
+    latest = {}
+    for log in FixityLog.objects.order_by('datetime_reported', 'pk').iterator():
+        latest[log.package_id] = log
+    for package_id, log in latest.items():
+        Package.objects.filter(uuid=package_id).update(
+            latest_fixity_check_datetime=log.datetime_reported,
+            latest_fixity_check_result=log.success)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0021_pipelinelocalfs_remote_fixity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='package',
+            name='latest_fixity_check_datetime',
+            field=models.DateTimeField(db_index=True, verbose_name='Latest fixity check', null=True, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='package',
+            name='latest_fixity_check_result',
+            field=models.NullBooleanField(verbose_name='Latest fixity check result', editable=False),
+        ),
+        migrations.RunPython(populate_latest_fixity_check, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0022_package_latest_fixity_check'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectoryStats',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('path', models.TextField()),
+                ('path_hash', models.CharField(unique=True, max_length=40, editable=False)),
+                ('inode', models.BigIntegerField()),
+                ('mtime', models.FloatField(help_text='Modification time of the directory in seconds since the epoch')),
+                ('file_count', models.BigIntegerField(help_text='Number of files directly in the directory')),
+                ('size', models.BigIntegerField(help_text='Total size in bytes of the files directly in the directory')),
+                ('subdirectories', jsonfield.fields.JSONField(default=[], help_text='Names of the subdirectories of the directory')),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Directory statistics',
+                'verbose_name_plural': 'Directory statistics',
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0023_directorystats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='directorystats',
+            name='entries',
+            field=jsonfield.fields.JSONField(help_text='Size, modification time and type of each entry in the directory', null=True),
+        ),
+        migrations.AddField(
+            model_name='directorystats',
+            name='total_file_count',
+            field=models.BigIntegerField(help_text='Number of files in the directory and all its subdirectories, as of the last refresh', null=True),
+        ),
+        migrations.AddField(
+            model_name='directorystats',
+            name='total_size',
+            field=models.BigIntegerField(help_text='Total size in bytes of the files in the directory and all its subdirectories, as of the last refresh', null=True),
+        ),
+    ]
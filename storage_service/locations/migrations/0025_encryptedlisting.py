@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0024_directorystats_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EncryptedListing',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('path', models.TextField(help_text='Path of the encrypted package')),
+                ('path_hash', models.CharField(unique=True, max_length=40, editable=False)),
+                ('size', models.BigIntegerField(help_text='Size of the encrypted file')),
+                ('mtime', models.FloatField(help_text='Modification time of the encrypted file in seconds since the epoch')),
+                ('entries', jsonfield.fields.JSONField(help_text='Size and object count of every entry of every directory in the package')),
+            ],
+            options={
+                'verbose_name': 'Encrypted package listing',
+            },
+        ),
+    ]
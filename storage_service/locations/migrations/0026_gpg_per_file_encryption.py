@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0025_encryptedlisting'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gpg',
+            name='per_file_encryption',
+            field=models.BooleanField(default=False, help_text='Encrypt each file of uncompressed packages separately, so that single files can be retrieved without decrypting the whole package. Compressed packages are always encrypted as a single file.', verbose_name='Encrypt files separately'),
+        ),
+    ]
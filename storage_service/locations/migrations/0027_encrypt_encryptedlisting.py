@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def delete_plaintext_listings(apps, schema_editor):
+    """Listings recorded so far are plaintext; they are recorded again,
+    encrypted, the next time their packages are encrypted."""
+    EncryptedListing = apps.get_model('locations', 'EncryptedListing')
+    EncryptedListing.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0026_gpg_per_file_encryption'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_plaintext_listings, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='encryptedlisting',
+            name='entries',
+        ),
+        migrations.AddField(
+            model_name='encryptedlisting',
+            name='encrypted_entries',
+            field=models.TextField(default='', help_text='Encrypted size and object count of every entry of every directory in the package'),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def clear_modified(apps, schema_editor):
+    """Adding the column set it to now for every package; when they were
+    last modified is unknown."""
+    Package = apps.get_model('locations', 'Package')
+    Package.objects.update(modified=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0027_encrypt_encryptedlisting'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='package',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, null=True, verbose_name='Last modified', db_index=True),
+        ),
+        migrations.RunPython(clear_modified, migrations.RunPython.noop),
+    ]
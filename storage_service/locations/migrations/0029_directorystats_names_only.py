@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import jsonfield.fields
+
+
+def clear_directory_stats(apps, schema_editor):
+    """The cached listings are in the old format, and have no scan time to
+    check them against; the browse indexer lists the directories again."""
+    DirectoryStats = apps.get_model('locations', 'DirectoryStats')
+    DirectoryStats.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0028_package_modified'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_directory_stats, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='directorystats',
+            name='size',
+        ),
+        migrations.RemoveField(
+            model_name='directorystats',
+            name='total_size',
+        ),
+        migrations.AddField(
+            model_name='directorystats',
+            name='scanned',
+            field=models.FloatField(help_text='Time the directory was listed in seconds since the epoch', null=True),
+        ),
+        migrations.AlterField(
+            model_name='directorystats',
+            name='entries',
+            field=jsonfield.fields.JSONField(help_text='Names of the entries in the directory, and whether each is a browsable directory', null=True),
+        ),
+    ]
@@ -20,6 +20,8 @@ from .package import *
 from .pipeline import *
 from .space import *
 from .fixity_log import *
+from .manifest_entry import *
+from .directory_stats import *
 # not importing managers as that is internal
 
 # Protocol Spaces
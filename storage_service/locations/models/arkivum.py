@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 # stdlib, alphabetical
+import hashlib
 import json
 import logging
 from lxml import etree
@@ -9,6 +10,7 @@ import urllib
 
 # Core Django, alphabetical
 from django.conf import settings
+from django.core.cache import cache
 import django.core.mail
 from django.contrib.auth import get_user_model
 from django.db import models
@@ -55,6 +57,15 @@ class Arkivum(models.Model):
         Location.AIP_STORAGE,
     ]
 
+    # HTTP session, so repeated status requests reuse the connection
+    _session = None
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = requests.Session()
+            self._session.verify = VERIFY
+        return self._session
+
     def browse(self, path):
         # Support browse so that the Location select works
         if self.remote_user and self.remote_name:
@@ -158,9 +169,18 @@ class Arkivum(models.Model):
         package.misc_attributes.update({'arkivum_identifier': request_id})
         package.save()
 
-    def _get_package_info(self, package):
+    def _cache_key(self, kind, value):
+        """Return the cache key for `kind` of information about `value`."""
+        digest = hashlib.md5(utils.coerce_str(value)).hexdigest()
+        return 'arkivum:{}:{}:{}'.format(self.space_id, kind, digest)
+
+    def _get_package_info(self, package, use_cache=True):
         """
         Return status and file info for a package in Arkivum.
+
+        Successful responses are cached for settings.ARKIVUM_CACHE_TTL seconds.
+
+        :param bool use_cache: If False, always ask Arkivum and refresh the cache.
         """
         # If no request ID, try POSTing to Arkivum again
         if 'arkivum_identifier' not in package.misc_attributes:
@@ -173,6 +193,12 @@ class Arkivum(models.Model):
             LOGGER.warning(msg)
             return {'error': True, 'error_message': msg}
 
+        cache_key = self._cache_key('info', package.misc_attributes['arkivum_identifier'])
+        if use_cache:
+            response_json = cache.get(cache_key)
+            if response_json is not None:
+                return response_json
+
         # Ask Arkivum for replication status
         if package.is_compressed:
             url = 'https://' + self.host + '/api/2/files/release/' + package.misc_attributes['arkivum_identifier']
@@ -181,7 +207,7 @@ class Arkivum(models.Model):
 
         LOGGER.info('URL: %s', url)
         try:
-            response = requests.get(url, verify=VERIFY)
+            response = self._get_session().get(url)
         except Exception:
             msg = _('Error fetching package status')
             LOGGER.warning(msg, exc_info=True)
@@ -198,11 +224,12 @@ class Arkivum(models.Model):
             msg = _('JSON could not be parsed from package info')
             LOGGER.warning(msg)
             return {'error': True, 'error_message': msg}
+        cache.set(cache_key, response_json, settings.ARKIVUM_CACHE_TTL)
         return response_json
 
     def update_package_status(self, package):
         LOGGER.info('Package status: %s', package.status)
-        response_json = self._get_package_info(package)
+        response_json = self._get_package_info(package, use_cache=False)
         if response_json.get('error'):
             return (None, response_json['error_message'])
         if package.is_compressed:
@@ -238,22 +265,26 @@ class Arkivum(models.Model):
             if path:
                 url_path = package.current_location.relative_path + '/' + package.current_path + '/' + path
                 url_path = urllib.quote_plus(url_path, safe='/')
-                url = 'https://' + self.host + '/api/2/files/fileInfo/' + url_path
-                LOGGER.info('URL: %s', url)
-                try:
-                    response = requests.get(url, verify=VERIFY)
-                except Exception:
-                    LOGGER.warning('Error fetching file information', exc_info=True)
-                    return None
-                LOGGER.info('Response: %s, Response text: %s', response.status_code, response.text)
-                if response.status_code != 200:
-                    LOGGER.warning('Response from Arkivum server was %s', response)
-                    return None
-                try:
-                    package_info = response.json()
-                except ValueError:
-                    LOGGER.warning('JSON could not be parsed from package info')
-                    return None
+                cache_key = self._cache_key('file', url_path)
+                package_info = cache.get(cache_key)
+                if package_info is None:
+                    url = 'https://' + self.host + '/api/2/files/fileInfo/' + url_path
+                    LOGGER.info('URL: %s', url)
+                    try:
+                        response = self._get_session().get(url)
+                    except Exception:
+                        LOGGER.warning('Error fetching file information', exc_info=True)
+                        return None
+                    LOGGER.info('Response: %s, Response text: %s', response.status_code, response.text)
+                    if response.status_code != 200:
+                        LOGGER.warning('Response from Arkivum server was %s', response)
+                        return None
+                    try:
+                        package_info = response.json()
+                    except ValueError:
+                        LOGGER.warning('JSON could not be parsed from package info')
+                        return None
+                    cache.set(cache_key, package_info, settings.ARKIVUM_CACHE_TTL)
             else:
                 # TODO Implement checking all files in an uncompressed package
                 # TODO This may be available from _get_package_info in future
@@ -264,11 +295,15 @@ class Arkivum(models.Model):
                     LOGGER.warning("Cannot determine if uncompressed package is locally available! Checking single file.")
                     # Pick a random file and check the locality of it.
                     # WARNING assumes the package is local/not local as a unit.
-                    for dirpath, dirs, files in os.walk(package.full_path):
-                        if files:
-                            file_path = os.path.join(dirpath, files[0])
-                            break
-                    file_path = os.path.relpath(file_path, package.full_path)
+                    sample_key = self._cache_key('sample', package.uuid)
+                    file_path = cache.get(sample_key)
+                    if file_path is None:
+                        for dirpath, dirs, files in os.walk(package.full_path):
+                            if files:
+                                file_path = os.path.join(dirpath, files[0])
+                                break
+                        file_path = os.path.relpath(file_path, package.full_path)
+                        cache.set(sample_key, file_path, settings.ARKIVUM_CACHE_TTL)
                     return self.is_file_local(package, file_path, email_nonlocal)
         LOGGER.debug('File info local: %s', package_info.get('local'))
         if package_info.get('local'):
@@ -303,7 +338,7 @@ class Arkivum(models.Model):
         """
         if package.is_compressed:
             raise NotImplementedError("Arkivum does not implement fixity for compressed packages")
-        package_info = self._get_package_info(package)
+        package_info = self._get_package_info(package, use_cache=False)
         if package_info.get('error'):
             return (False, [], package_info['error_message'], None)
 
@@ -0,0 +1,311 @@
+# stdlib, alphabetical
+import hashlib
+import logging
+import os
+import threading
+import time
+
+# Core Django, alphabetical
+from django.db import connection, models
+from django.db.models import Q
+from django.utils.translation import ugettext as _, ugettext_lazy as _l
+
+# Third party dependencies, alphabetical
+import jsonfield
+try:
+    from os import scandir  # Python 3.5+
+except ImportError:
+    from scandir import scandir
+
+# This project, alphabetical
+from common import utils
+
+# This module, alphabetical
+
+__all__ = ('DirectoryStats', )
+
+LOGGER = logging.getLogger(__name__)
+
+# Paths being refreshed by background threads
+_REFRESHING = set()
+_REFRESHING_LOCK = threading.Lock()
+
+# Most directories get_file_count checks before giving up on the cached counts
+MAX_CHECKED_DIRECTORIES = 1000
+
+# Most path hashes looked up in one query, within SQLite's variable limit
+_LOOKUP_BATCH_SIZE = 500
+
+# Listings of directories modified less than this many seconds before they
+# were listed aren't trusted: a change made in the same mtime tick, which is
+# coarse on some filesystems, or hidden by clock skew with an NFS server, would
+# leave the directory's mtime unchanged
+RECENT_CHANGE_SECONDS = 5
+
+
+def _unicode_path(path):
+    """Return ``path`` as a unicode, as paths are stored and compared."""
+    if isinstance(path, bytes):
+        return path.decode('utf-8')
+    return path
+
+
+def _path_hash(path):
+    return hashlib.sha1(utils.coerce_str(path)).hexdigest()
+
+
+class DirectoryStats(models.Model):
+    """
+    Cached listing and file counts of one local directory.
+
+    Each entry is only valid while the directory's inode and mtime are those
+    recorded: adding, removing or renaming a file or subdirectory changes its
+    directory's mtime. Writing to a file doesn't, so file sizes aren't cached.
+    Recursive counts are summed from the entries of a directory and all its
+    subdirectories, so when something changes only the directories that
+    changed have to be listed again.
+
+    Together the entries are an index of the browse metadata of a directory
+    tree, kept up to date by the browse_indexer command, which path2browse_dict
+    reads instead of listing directories.
+    """
+
+    path = models.TextField()
+    # Paths can be longer than an indexable column, so look them up by hash
+    path_hash = models.CharField(max_length=40, unique=True, editable=False)
+    inode = models.BigIntegerField()
+    mtime = models.FloatField(
+        help_text=_l('Modification time of the directory in seconds since the epoch'))
+    scanned = models.FloatField(
+        null=True, help_text=_l('Time the directory was listed in seconds since the epoch'))
+    file_count = models.BigIntegerField(
+        help_text=_l('Number of files directly in the directory'))
+    subdirectories = jsonfield.JSONField(
+        default=[], help_text=_l('Names of the subdirectories of the directory'))
+    # Compact for directories of many files: name: is_browsable_dir
+    entries = jsonfield.JSONField(
+        null=True, help_text=_l('Names of the entries in the directory, and whether each is a browsable directory'))
+    total_file_count = models.BigIntegerField(
+        null=True, help_text=_l('Number of files in the directory and all its subdirectories, as of the last refresh'))
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _l("Directory statistics")
+        verbose_name_plural = _l("Directory statistics")
+        app_label = 'locations'
+
+    def __unicode__(self):
+        return _('%(path)s: %(count)s files') % {
+            'path': self.path, 'count': self.file_count}
+
+    def save(self, *args, **kwargs):
+        self.path_hash = _path_hash(self.path)
+        super(DirectoryStats, self).save(*args, **kwargs)
+
+    def is_valid(self, stat_result):
+        """Return True if the directory with ``stat_result`` hasn't changed
+        since it was listed. See RECENT_CHANGE_SECONDS."""
+        return (self.inode == stat_result.st_ino and
+                self.mtime == stat_result.st_mtime and
+                self.scanned is not None and
+                self.scanned - self.mtime >= RECENT_CHANGE_SECONDS)
+
+    @classmethod
+    def _cached_tree(cls, path):
+        """Return the cached entries of ``path`` and everything below it, by path."""
+        subtree_prefix = os.path.join(path, '')
+        return {
+            stats.path: stats for stats in cls.objects.filter(
+                Q(path_hash=_path_hash(path)) | Q(path__startswith=subtree_prefix))
+        }
+
+    @classmethod
+    def _get_many(cls, paths):
+        """Return the entries of ``paths``, without their listings, by path."""
+        found = {}
+        for start in range(0, len(paths), _LOOKUP_BATCH_SIZE):
+            hashes = [_path_hash(path)
+                      for path in paths[start:start + _LOOKUP_BATCH_SIZE]]
+            found.update((stats.path, stats) for stats in cls.objects.filter(
+                path_hash__in=hashes).defer('entries'))
+        return found
+
+    @classmethod
+    def _get_subtree_file_counts(cls, paths, max_directories):
+        """
+        Return the number of files in each of ``paths`` and all its
+        subdirectories, by path, for those whose cached entries are all up to
+        date.
+
+        Only stats each directory, without listing any of them, and looks up
+        their entries by path hash, one level of all the trees at a time. Trees
+        not fully checked after ``max_directories`` directories are left out.
+        """
+        totals = dict((path, 0) for path in paths)
+        # Directories to check, with the path whose totals they count towards
+        level = [(path, _unicode_path(path)) for path in paths]
+        checked = 0
+        while level:
+            level = [(root, directory) for root, directory in level
+                     if root in totals]
+            checked += len(level)
+            if checked > max_directories:
+                for root, __ in level:
+                    totals.pop(root, None)
+                break
+            cached = cls._get_many([directory for __, directory in level])
+            next_level = []
+            for root, directory in level:
+                if root not in totals:
+                    continue
+                stats = cached.get(directory)
+                try:
+                    valid = stats is not None and stats.is_valid(os.stat(directory))
+                except OSError:
+                    valid = False
+                if not valid:
+                    del totals[root]
+                    continue
+                totals[root] += stats.file_count
+                next_level.extend((root, os.path.join(directory, name))
+                                  for name in stats.subdirectories)
+            level = next_level
+        return totals
+
+    @classmethod
+    def get_file_count(cls, path, max_directories=MAX_CHECKED_DIRECTORIES):
+        """
+        Return the number of files in ``path`` and all its subdirectories,
+        from the cache, or None if any of it is out of date or there are more
+        than ``max_directories`` directories to check.
+        """
+        return cls._get_subtree_file_counts([path], max_directories).get(path)
+
+    @classmethod
+    def get_listing(cls, path):
+        """
+        Return the indexed entries of directory ``path`` (see ``entries``),
+        or None if it isn't indexed or may have changed since.
+        """
+        path = _unicode_path(path)
+        try:
+            stats = cls.objects.get(path_hash=_path_hash(path))
+            if stats.entries is not None and stats.is_valid(os.stat(path)):
+                return stats.entries
+        except (cls.DoesNotExist, OSError):
+            pass
+        return None
+
+    @classmethod
+    def get_indexed_file_counts(cls, paths, max_directories=MAX_CHECKED_DIRECTORIES):
+        """
+        Return the recursive file counts of the directories ``paths`` whose
+        cached entries, and those of all their subdirectories, are up to date,
+        by path. Like ``get_file_count``, but the subtrees of all ``paths`` are
+        checked together, within one budget of ``max_directories``.
+        """
+        return cls._get_subtree_file_counts(list(paths), max_directories)
+
+    @classmethod
+    def refresh(cls, path):
+        """
+        Bring the cached entries of ``path`` and its subdirectories up to
+        date and return the number of files in them.
+
+        Directories whose inode and mtime haven't changed are not listed
+        again, unless they changed shortly before they were last listed. Entries of directories that no longer exist are deleted, and
+        the recursive totals of every directory are updated.
+        """
+        path = _unicode_path(path)
+        cached = cls._cached_tree(path)
+        # Directories in the order visited, so parents before their children
+        visited = []
+        pending = [path]
+        while pending:
+            directory = pending.pop()
+            try:
+                stat_result = os.stat(directory)
+            except OSError:
+                LOGGER.debug('Could not stat %s', directory, exc_info=True)
+                continue
+            stats = cached.get(directory)
+            if stats is None or not stats.is_valid(stat_result) or stats.entries is None:
+                try:
+                    stats = cls._scan(directory, stat_result, stats)
+                except OSError:
+                    LOGGER.debug('Could not list %s', directory, exc_info=True)
+                    continue
+            visited.append(stats)
+            pending.extend(os.path.join(directory, name)
+                           for name in stats.subdirectories)
+
+        totals = {}
+        for stats in reversed(visited):
+            file_count = stats.file_count + sum(
+                totals.get(os.path.join(stats.path, name), 0)
+                for name in stats.subdirectories)
+            totals[stats.path] = file_count
+            if stats.total_file_count != file_count:
+                cls.objects.filter(pk=stats.pk).update(
+                    total_file_count=file_count)
+
+        stale = [stats.pk for p, stats in cached.items() if p not in totals]
+        if stale:
+            cls.objects.filter(pk__in=stale).delete()
+        return totals.get(path, 0)
+
+    @classmethod
+    def _scan(cls, directory, stat_result, stats=None):
+        """List ``directory`` and save its entry, updating ``stats`` if given."""
+        if stats is None:
+            stats = cls(path=directory)
+        # Before listing, so changes made while listing are within
+        # RECENT_CHANGE_SECONDS
+        scanned = time.time()
+        file_count = 0
+        subdirectories = []
+        entries = {}
+        for entry in scandir(directory):
+            is_dir = entry.is_dir()
+            # Browsing lists directories it can read
+            entries[entry.name] = is_dir and os.access(entry.path, os.R_OK)
+            # Count like os.walk: symlinks to directories are neither
+            # counted as files nor followed
+            if is_dir:
+                if not entry.is_symlink():
+                    subdirectories.append(entry.name)
+                continue
+            file_count += 1
+        stats.inode = stat_result.st_ino
+        stats.mtime = stat_result.st_mtime
+        stats.scanned = scanned
+        stats.file_count = file_count
+        stats.subdirectories = subdirectories
+        stats.entries = entries
+        stats.save()
+        return stats
+
+    @classmethod
+    def refresh_in_background(cls, path):
+        """Refresh the entries of ``path`` in a native thread, unless that
+        is already happening. Returns immediately."""
+        with _REFRESHING_LOCK:
+            if path in _REFRESHING:
+                return
+            _REFRESHING.add(path)
+        utils.start_native_thread(cls._background_refresh, path)
+
+    @classmethod
+    def _background_refresh(cls, path):
+        try:
+            cls.refresh(path)
+        except Exception:
+            LOGGER.warning('Error refreshing directory statistics of %s', path,
+                           exc_info=True)
+        finally:
+            # Not under _REFRESHING_LOCK, which is a gevent lock under gevent
+            # workers and can't be taken from native threads; discard is
+            # atomic anyway
+            _REFRESHING.discard(path)
+            # This thread has its own database connection
+            connection.close()
@@ -12,8 +12,11 @@ import os
 import re
 import shutil
 import subprocess
+import tempfile
+import time
 import urlparse
 import urllib
+import zipfile
 
 # Core Django, alphabetical
 from django.db import models
@@ -29,6 +32,7 @@ import jsonfield
 
 # This module, alphabetical
 from common import utils
+from . import StorageException
 from .location import Location
 
 LOGGER = logging.getLogger(__name__)
@@ -193,13 +197,23 @@ class DSpace(models.Model):
             src,  # Source
         ])
 
+    # Directories in data/objects that belong with the metadata, not objects
+    SPLIT_METADATA_DIRS = ('metadata', 'submissionDocumentation')
+
     def _split_package(self, input_path):
         """
         Splits the input package into objects and metadata & logs.
 
+        ZIP, 7z and tar packages are repacked in a single pass over the source
+        archive, see `_repack_package`. Other formats are fully extracted
+        first.
+
         :param str input_path: Path to the input AIP
         :return: List of packages to be stored
         """
+        if utils.is_streamable_archive(input_path):
+            return self._repack_package(input_path)
+
         # TODO Should output dir be a temp dir?
         output_dir = os.path.dirname(input_path) + '/'
         dirname = os.path.splitext(os.path.basename(input_path))[0]
@@ -215,7 +229,7 @@ class DSpace(models.Model):
         metadata_dir = os.path.join(output_dir, dirname)
         os.mkdir(objects_dir)
         for item in os.listdir(os.path.join(metadata_dir, 'data', 'objects')):
-            if item in ('metadata', 'submissionDocumentation'):
+            if item in self.SPLIT_METADATA_DIRS:
                 continue
 
             src = os.path.join(metadata_dir, 'data', 'objects', item)
@@ -235,6 +249,127 @@ class DSpace(models.Model):
 
         return [objects_zip, metadata_zip]
 
+    def _split_member_name(self, name):
+        """
+        Return the split archive a package member belongs in and its new name.
+
+        Payload in data/objects goes to the 'objects' archive under objects/,
+        everything else keeps its path in the 'metadata' archive.
+        """
+        parts = [p for p in name.split('/') if p]
+        if not parts or '..' in parts:
+            raise ValueError(_('Unsafe path in package: %(name)s') % {'name': name})
+        if (len(parts) > 3 and parts[1:3] == ['data', 'objects'] and
+                parts[3] not in self.SPLIT_METADATA_DIRS):
+            return 'objects', '/'.join(['objects'] + parts[3:])
+        return 'metadata', '/'.join(parts)
+
+    def _repack_package(self, input_path):
+        """
+        Split a ZIP or tar package while reading it only once.
+
+        Each member is routed to the objects or metadata archive as it is read.
+        ZIP output is written straight into the two archives, so at most one
+        member is on disk uncompressed at a time.  7z output needs directories
+        to compress, so members are extracted into their final layout and each
+        half is compressed once.  Symlinks are kept as symlinks; a package with
+        hard links or other special members raises a StorageException rather
+        than being stored without them.
+
+        :param str input_path: Path to the input AIP
+        :return: List of packages to be stored
+        """
+        output_dir = os.path.dirname(input_path)
+        if self.archive_format == self.ARCHIVE_FORMAT_ZIP:
+            return self._repack_zip(input_path, output_dir)
+        elif self.archive_format == self.ARCHIVE_FORMAT_7Z:
+            return self._repack_7z(input_path, output_dir)
+        raise ValueError('Archive format not supported')
+
+    def _repack_zip(self, input_path, output_dir):
+        """Route the members of `input_path` into objects.zip and metadata.zip."""
+        objects_path = os.path.join(output_dir, 'objects.zip')
+        metadata_path = os.path.join(output_dir, 'metadata.zip')
+        # ZIP timestamps cannot predate 1980
+        zip_epoch = time.mktime((1980, 1, 1, 0, 0, 0, 0, 0, -1))
+        with zipfile.ZipFile(objects_path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as objects_zip, \
+                zipfile.ZipFile(metadata_path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as metadata_zip:
+            archives = {'objects': objects_zip, 'metadata': metadata_zip}
+            self._zip_add_dir(objects_zip, 'objects', time.time())
+            for name, mtime, stream in utils.iter_archive_members(input_path, special=True):
+                target, arcname = self._split_member_name(name)
+                mtime = max(mtime, zip_epoch)
+                if stream is None:
+                    if arcname != 'objects':
+                        self._zip_add_dir(archives[target], arcname, mtime)
+                    continue
+                if isinstance(stream, utils.SpecialMember):
+                    self._check_special_member(input_path, name, stream)
+                    info = zipfile.ZipInfo(arcname, time.localtime(mtime)[:6])
+                    info.create_system = 3  # Unix, so the mode is read
+                    info.external_attr = 0o120777 << 16  # Symlink
+                    archives[target].writestr(info, stream.target)
+                    continue
+                # Python 2 zipfile can only add members from disk
+                fd, tmp_path = tempfile.mkstemp(dir=output_dir)
+                try:
+                    with os.fdopen(fd, 'wb') as tmp:
+                        shutil.copyfileobj(stream, tmp)
+                    os.utime(tmp_path, (mtime, mtime))
+                    archives[target].write(tmp_path, arcname)
+                finally:
+                    os.remove(tmp_path)
+        return [objects_path, metadata_path]
+
+    def _check_special_member(self, input_path, name, member):
+        """Raise a StorageException unless the member `name` of `input_path`,
+        which is neither a file nor a directory, is a symlink: the only such
+        member the split archives can hold."""
+        if member.kind != utils.MEMBER_SYMLINK:
+            raise StorageException(
+                _('Unable to split %(path)s: %(name)s is a %(kind)s, which'
+                  ' cannot be stored in the split package') %
+                {'path': input_path, 'name': name, 'kind': member.kind})
+
+    def _zip_add_dir(self, archive, arcname, mtime):
+        """Add a directory entry `arcname` to the open ZIP `archive`."""
+        info = zipfile.ZipInfo(arcname + '/', time.localtime(mtime)[:6])
+        info.external_attr = (0o40755 << 16) | 0x10  # Unix mode & MS-DOS dir flag
+        archive.writestr(info, b'')
+
+    def _repack_7z(self, input_path, output_dir):
+        """Extract `input_path` pre-split, then compress objects & metadata."""
+        staging_dir = tempfile.mkdtemp(dir=output_dir)
+        try:
+            objects_dir = os.path.join(staging_dir, 'objects')
+            os.mkdir(objects_dir)
+            metadata_dir = None
+            for name, mtime, stream in utils.iter_archive_members(input_path, special=True):
+                target, arcname = self._split_member_name(name)
+                if target == 'metadata' and metadata_dir is None:
+                    metadata_dir = os.path.join(staging_dir, arcname.split('/')[0])
+                path = os.path.join(staging_dir, arcname)
+                if stream is None:
+                    if not os.path.isdir(path):
+                        os.makedirs(path)
+                    continue
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                if isinstance(stream, utils.SpecialMember):
+                    # 7z stores symlinks as symlinks
+                    self._check_special_member(input_path, name, stream)
+                    os.symlink(stream.target, path)
+                    continue
+                with open(path, 'wb') as f:
+                    shutil.copyfileobj(stream, f)
+                os.utime(path, (mtime, mtime))
+
+            objects_archive = self._archive(objects_dir, os.path.join(output_dir, 'objects'))
+            metadata_archive = self._archive(metadata_dir, os.path.join(output_dir, 'metadata'))
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        return [objects_archive, metadata_archive]
+
     def move_from_storage_service(self, source_path, destination_path, package=None):
         LOGGER.info('source_path: %s, destination_path: %s, package: %s', source_path, destination_path, package)
         if package is None:
@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 # stdlib, alphabetical
+import hashlib
 import logging
 from lxml import etree
 import os
@@ -12,6 +13,7 @@ from django.db import models
 from django.utils.translation import ugettext as _, ugettext_lazy as _l
 
 # Third party dependencies, alphabetical
+import bagit
 import requests
 
 # This project, alphabetical
@@ -172,6 +174,75 @@ class Duracloud(models.Model):
                 url = self.duraspace_url + urllib.quote(d)
                 response = self.session.delete(url)
 
+    def _get_remote_md5(self, path):
+        """
+        Return the MD5 and size DuraCloud reports for `path`, and a list of
+        bagit errors found in its chunks if it was stored chunked.
+
+        For chunked files, the MD5 and size are those in the .dura-manifest and
+        each chunk's MD5 is checked against the manifest. Only HEAD requests and
+        the manifest are fetched.
+
+        :returns: Tuple of ((md5, size), [errors]), or (None, []) if `path`
+            does not exist.
+        :raises: StorageException if the response code is not 200 or 404
+        """
+        url = self.duraspace_url + urllib.quote(path)
+        LOGGER.debug('HEAD URL: %s', url)
+        response = self.session.head(url)
+        LOGGER.debug('Response: %s', response)
+        if response.status_code == 200:
+            size = response.headers.get('Content-Length')
+            md5 = response.headers.get('Content-MD5') or response.headers.get('ETag')
+            return (md5, int(size) if size else None), []
+        if response.status_code != 404:
+            LOGGER.warning('Response: %s when fetching %s', response, url)
+            raise StorageException('Unable to fetch %s' % url)
+
+        manifest_url = url + self.MANIFEST_SUFFIX
+        LOGGER.debug('Manifest URL: %s', manifest_url)
+        response = self.session.get(manifest_url)
+        if not response.ok:
+            return None, []
+        root = etree.fromstring(response.content)
+        errors = []
+        for e in root.findall('chunks/chunk'):
+            chunk = e.attrib['chunkId']
+            md5 = e.findtext('md5')
+            found, __ = self._get_remote_md5(chunk)
+            if found is None:
+                errors.append(bagit.FileMissing(chunk))
+            elif (found[0] or '').lower() != md5:
+                errors.append(bagit.ChecksumMismatch(chunk, 'md5', md5, found[0]))
+        md5 = root.findtext('header/sourceContent/md5')
+        size = int(root.findtext('header/sourceContent/byteSize'))
+        return (md5, size), errors
+
+    def check_package_fixity(self, package):
+        """
+        Check fixity of `package` against the MD5s DuraCloud keeps for every
+        file, without downloading it. See Package.check_remote_md5s.
+
+        Raises NotImplementedError if no MD5s were recorded for the package,
+        so fixity is checked locally instead.
+        """
+        package.get_recorded_md5s()  # Fall back before listing anything
+        path = utils.coerce_str(package.full_path)
+        remote = {}
+        errors = []
+        if package.stored_md5:
+            found, errors = self._get_remote_md5(path)
+            if found is not None:
+                remote[os.path.basename(path)] = found
+        else:
+            prefix = os.path.join(path, '')
+            for entry in self._get_files_list(prefix, show_split_files=False):
+                found, chunk_errors = self._get_remote_md5(entry)
+                errors.extend(chunk_errors)
+                if found is not None:
+                    remote[entry[len(prefix):]] = found
+        return package.check_remote_md5s(remote, errors)
+
     def _download_file(self, url, download_path, expected_size=0, checksum=None):
         """
         Helper to download files from DuraCloud.
@@ -267,14 +338,19 @@ class Duracloud(models.Model):
                 dest = entry.replace(src_path, dest_path, 1)
                 self._download_file(url, dest)
 
-    def _process_chunk(self, f, chunk_path):
+    def _process_chunk(self, f, chunk_path, checksums=()):
+        """Writes the next chunk of `f` to `chunk_path`, updating each of
+        `checksums` with it."""
         bytes_read = 0
-        bytes_to_read = 1024 * 1024  # 1MB
 
         with open(chunk_path, 'w') as fchunk:
             while bytes_read < self.CHUNK_SIZE:
+                # Read at most 1MB, without running past the end of the chunk
+                bytes_to_read = min(1024 * 1024, self.CHUNK_SIZE - bytes_read)
                 data = f.read(bytes_to_read)
                 fchunk.write(data)
+                for checksum in checksums:
+                    checksum.update(data)
 
                 length = len(data)
 
@@ -291,7 +367,7 @@ class Duracloud(models.Model):
 
         :param url: URL to upload the file to.
         :param upload_file: Absolute path to the file to upload.
-        :returns: None
+        :returns: MD5 of the file if it was chunked, None otherwise
         :raises: StorageException if error storing file
         """
         LOGGER.debug('Upload %s to %s', upload_file, url)
@@ -308,14 +384,14 @@ class Duracloud(models.Model):
             # </header>
             relative_path = urllib.unquote(url.replace(self.duraspace_url, '', 1))
             LOGGER.debug('File name: %s', relative_path)
-            checksum = utils.generate_checksum(upload_file, 'md5')
-            LOGGER.debug('Checksum for %s: %s', upload_file, checksum.hexdigest())
+            # The file's MD5 is computed while it is split, so it is only read once
+            file_checksum = hashlib.md5()
             root = etree.Element('{duracloud.org}chunksManifest', nsmap={'dur': 'duracloud.org'})
             header = etree.SubElement(root, 'header', schemaVersion="0.2")
             content = etree.SubElement(header, 'sourceContent', contentId=relative_path)
             etree.SubElement(content, 'mimetype').text = 'application/octet-stream'
             etree.SubElement(content, 'byteSize').text = str(filesize)
-            etree.SubElement(content, 'md5').text = checksum.hexdigest()
+            file_md5_e = etree.SubElement(content, 'md5')
             chunks = etree.SubElement(root, 'chunks')
             # Split file into chunks
             with open(upload_file, 'rb') as f:
@@ -334,8 +410,9 @@ class Duracloud(models.Model):
                     LOGGER.debug('Chunk URL: %s', chunk_url)
                     chunkid = relative_path + chunk_suffix
                     LOGGER.debug('Chunk ID: %s', chunkid)
+                    checksum = hashlib.md5()
                     try:
-                        self._process_chunk(f, chunk_path)
+                        self._process_chunk(f, chunk_path, (file_checksum, checksum))
                     except StopIteration:
                         file_complete = True
                     # Make chunk element
@@ -343,7 +420,6 @@ class Duracloud(models.Model):
                     #   <byteSize>2097152</byteSize>
                     #   <md5>ddbb227beaac5a9dc34eb49608997abf</md5>
                     # </chunk>
-                    checksum = utils.generate_checksum(chunk_path)
                     chunk_e = etree.SubElement(chunks, 'chunk', chunkId=chunkid)
                     etree.SubElement(chunk_e, 'byteSize').text = str(os.path.getsize(chunk_path))
                     etree.SubElement(chunk_e, 'md5').text = checksum.hexdigest()
@@ -356,6 +432,9 @@ class Duracloud(models.Model):
                     # Delete chunk
                     os.remove(chunk_path)
                     i += 1
+            file_md5 = file_checksum.hexdigest()
+            LOGGER.debug('Checksum for %s: %s', upload_file, file_md5)
+            file_md5_e.text = file_md5
             # Write .dura-manifest
             manifest_path = upload_file + self.MANIFEST_SUFFIX
             manifest_url = url + self.MANIFEST_SUFFIX
@@ -365,6 +444,7 @@ class Duracloud(models.Model):
             self._upload_chunk(manifest_url, manifest_path)
             os.remove(manifest_path)
             # TODO what if .dura-manifest over chunksize?
+            return file_md5
         else:
             # Example URL: https://trial.duracloud.org/durastore/trial261//ts/test.txt
             self._upload_chunk(url, upload_file)
@@ -411,6 +491,8 @@ class Duracloud(models.Model):
         if os.path.isdir(source_path):
             # Both source and destination paths should end with /
             destination_path = os.path.join(destination_path, '')
+            if package is not None:
+                package.clear_stored_md5()
             # Duracloud does not accept folders, so upload each file individually
             for path, dirs, files in os.walk(source_path):
                 for basename in files:
@@ -420,7 +502,10 @@ class Duracloud(models.Model):
                     self._upload_file(url, entry, resume=resume)
         elif os.path.isfile(source_path):
             url = self.duraspace_url + urllib.quote(destination_path)
-            self._upload_file(url, source_path, resume=resume)
+            md5 = self._upload_file(url, source_path, resume=resume)
+            if package is not None:
+                package.record_stored_md5(
+                    md5 or utils.generate_checksum(source_path, 'md5').hexdigest())
         elif not os.path.exists(source_path):
             raise StorageException(_('%(path)s does not exist.') % {'path': source_path})
         else:
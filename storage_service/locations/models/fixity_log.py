@@ -14,10 +14,21 @@ from django.utils.translation import ugettext as _, ugettext_lazy as _l
 class FixityLog(models.Model):
     """ Stores fixity check success/failure and error details """
 
+    QUICK = 'quick'
+    SAMPLE = 'sample'
+    FULL = 'full'
+    CHECK_LEVEL_CHOICES = (
+        (QUICK, _l('Quick: file presence, sizes and Payload-Oxum')),
+        (SAMPLE, _l('Sample: quick check plus checksums of a share of files')),
+        (FULL, _l('Full: checksums of every file')),
+    )
+
     package = models.ForeignKey('Package', to_field='uuid')
     success = models.NullBooleanField(default=False)
     error_details = models.TextField(null=True)
     datetime_reported = models.DateTimeField(auto_now=True)
+    check_level = models.CharField(max_length=8, choices=CHECK_LEVEL_CHOICES,
+                                   default=FULL)
 
     class Meta:
         verbose_name = _l("Fixity Log")
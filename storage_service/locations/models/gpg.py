@@ -1,8 +1,13 @@
 from __future__ import absolute_import
 # stdlib, alphabetical
 import datetime
+import errno
+import functools
+import io
+import json
 import logging
 import os
+import re
 import shutil
 import subprocess
 import tarfile
@@ -22,6 +27,7 @@ from common import utils
 from common import gpgutils
 
 # This module, alphabetical
+from .directory_stats import _path_hash
 from .location import Location
 from .package import Package
 from . import space
@@ -30,6 +36,13 @@ from . import space
 LOGGER = logging.getLogger(__name__)
 
 
+UUID_RE = re.compile(
+    r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', re.I)
+UUID_QUAD_RE = re.compile(r'^[0-9a-f]{4}$', re.I)
+
+# Name of the encrypted index of a package encrypted file by file
+ENCRYPTED_INDEX = 'index.gpg'
+
 METS_BNS = '{' + utils.NSMAP['mets'] + '}'
 PREMIS_BNS = '{' + utils.NSMAP['premis'] + '}'
 
@@ -38,6 +51,42 @@ class GPGException(Exception):
     pass
 
 
+class EncryptedListing(models.Model):
+    """Listing of the plaintext directory tree of a package encrypted in a GPG
+    space, recorded when it is encrypted so that it can be browsed without
+    decrypting it.
+
+    It is only valid while the encrypted file has the size and modification
+    time recorded. The listing is kept in the database, like manifest
+    entries, rather than next to the encrypted file, since encrypted packages
+    may be copied to storage that the storage service does not control. It
+    names the files of the package, so it is encrypted with the package's
+    key like the package itself.
+    """
+
+    path = models.TextField(help_text=_l('Path of the encrypted package'))
+    # Paths can be longer than an indexable column, so look them up by hash
+    path_hash = models.CharField(max_length=40, unique=True, editable=False)
+    size = models.BigIntegerField(help_text=_l('Size of the encrypted file'))
+    mtime = models.FloatField(
+        help_text=_l('Modification time of the encrypted file in seconds since the epoch'))
+    # GPG encrypted JSON of {directory relative to the package: {name: [size,
+    # object count]}}, where the object count of files is None
+    encrypted_entries = models.TextField(
+        help_text=_l('Encrypted size and object count of every entry of every directory in the package'))
+
+    class Meta:
+        verbose_name = _l("Encrypted package listing")
+        app_label = 'locations'
+
+    def __unicode__(self):
+        return self.path
+
+    def save(self, *args, **kwargs):
+        self.path_hash = _path_hash(self.path)
+        super(EncryptedListing, self).save(*args, **kwargs)
+
+
 class GPG(models.Model):
     """Space for storing packages as files encrypted via GnuPG.
     When an AIP is moved to a GPG space, it is encrypted with a
@@ -58,6 +107,13 @@ class GPG(models.Model):
 
     Note: this space has does not (currently) implement the ``delete_path``
     method.
+
+    With ``per_file_encryption``, uncompressed packages are stored as a
+    directory holding every file encrypted separately, under random names,
+    and an encrypted index (``ENCRYPTED_INDEX``) of their paths. Moving a
+    single file or directory out of such a package, e.g., to extract one file
+    or for partial re-ingest, then only decrypts the files needed, and files
+    are encrypted and decrypted in parallel.
     """
 
     # package.py looks up this class attribute to determine if a package is
@@ -75,6 +131,13 @@ class GPG(models.Model):
         verbose_name=_l('GnuPG Private Key'),
         help_text=_l('The GnuPG private key that will be able to'
                      ' decrypt packages stored in this space.'))
+    per_file_encryption = models.BooleanField(
+        default=False,
+        verbose_name=_l('Encrypt files separately'),
+        help_text=_l('Encrypt each file of uncompressed packages separately,'
+                     ' so that single files can be retrieved without'
+                     ' decrypting the whole package. Compressed packages are'
+                     ' always encrypted as a single file.'))
 
     class Meta:
         verbose_name = _l("GPG encryption on Local Filesystem")
@@ -96,10 +159,16 @@ class GPG(models.Model):
         LOGGER.info('GPG move_to_storage_service encrypted dst_path: %s',
                     dst_path)
         self.space.create_local_directory(dst_path)
+        # Files of packages encrypted file by file are decrypted straight to
+        # the destination, and only those in ``src_path``.
+        per_file_path = _get_per_file_package(src_path)
+        if per_file_path:
+            _gpg_decrypt_files(
+                per_file_path, src_path[len(per_file_path):], dst_path)
         # When the source path exists, we are moving the entire package to
         # somewhere on the storage service. In this case, we decrypt at the
         # destination.
-        if os.path.exists(src_path):
+        elif os.path.exists(src_path):
             self.space.move_rsync(src_path, dst_path)
             _gpg_decrypt(dst_path)
         # When the source path does NOT exist, we are copying a single file or
@@ -126,7 +195,8 @@ class GPG(models.Model):
             finally:
                 # Re-encrypt the decrypted package at source after copy, no
                 # matter what happens.
-                _gpg_encrypt(encr_path, _encr_path2key_fingerprint(encr_path))
+                _gpg_encrypt_with_listing(
+                    encr_path, _encr_path2key_fingerprint(encr_path))
 
     def move_from_storage_service(self, src_path, dst_path, package=None):
         """Move AIP in SS at path ``src_path`` to GPG space at ``dst_path``,
@@ -147,7 +217,8 @@ class GPG(models.Model):
         self.space.create_local_directory(dst_path)
         self.space.move_rsync(src_path, dst_path, try_mv_local=True)
         try:
-            __, encr_result = _gpg_encrypt(dst_path, key_fingerprint)
+            __, encr_result = _gpg_encrypt_with_listing(
+                dst_path, key_fingerprint, per_file=self.per_file_encryption)
         except GPGException:
             # If we fail to encrypt, then we send it back to where it came from.
             self.space.move_rsync(dst_path, src_path, try_mv_local=True)
@@ -184,6 +255,11 @@ class GPG(models.Model):
         """Returns browse results for a locally accessible *encrypted*
         filesystem. Based on ``Space.browse_local`` but has to deal with paths
         within encrypted directories (which are tarfiles).
+
+        Paths are browsed from the package's ``EncryptedListing`` if it is up
+        to date. Otherwise the package is decrypted to browse it, and its
+        listing is recorded when it is re-encrypted; only the index of
+        packages encrypted file by file is decrypted.
         """
         if isinstance(path, unicode):
             path = path.encode('utf8')
@@ -191,27 +267,35 @@ class GPG(models.Model):
         path = path.rstrip('/')
         # Path may not exist if its a sub-path of an encrypted dir. Here we
         # look for a path ancestor that does exist.
-        encr_path = _get_encrypted_path(path)
+        encr_path = _get_per_file_package(path) or _get_encrypted_path(path)
         if not encr_path:
             LOGGER.warning(
                 'Unable to browse %s; this file/dir does not exist; nor is'
                 ' it in an encrypted directory.', path)
             return {'directories': [], 'entries': [], 'properties': {}}
+        listing = _get_listing(encr_path)
+        if listing is not None:
+            return _listing2browse_dict(listing, path[len(encr_path):].lstrip('/'))
         # Decrypt and de-tar
         _gpg_decrypt(encr_path)
         key_fingerprint = _encr_path2key_fingerprint(encr_path)
         # After decryption, ``path`` should exist if it is valid.
         if not os.path.exists(path):
             LOGGER.warning('Path %s in %s does not exist.', path, encr_path)
-            _gpg_encrypt(encr_path, key_fingerprint)
+            _gpg_encrypt_with_listing(encr_path, key_fingerprint)
             return {'directories': [], 'entries': [], 'properties': {}}
         try:
             ret = space.path2browse_dict(path)
         finally:
             # No matter what happens, re-encrypt the decrypted package.
-            _gpg_encrypt(encr_path, key_fingerprint)
+            _gpg_encrypt_with_listing(encr_path, key_fingerprint)
         return ret
 
+    def is_encrypted_package(self, path):
+        """Return True if ``path`` is a package encrypted in this space,
+        either as a single file or file by file."""
+        return os.path.isfile(path) or _is_encrypted_per_file(path)
+
     def verify(self):
         """Verify that the space is accessible to the storage service."""
         # QUESTION: What is the purpose of this method? Investigation
@@ -228,26 +312,330 @@ def _gpg_encrypt(path, key_fingerprint):
     encrypted file as well as a Python-GnuPG encryption result object with
     ``ok`` and ``status`` attributes, see
     https://pythonhosted.org/python-gnupg/.
+
+    A directory is encrypted as a tarfile, which is streamed into GnuPG, so
+    only the encrypted tarfile is written to disk.
     """
-    tar_created = False
+    path = path.rstrip('/')
     if os.path.isdir(path):
-        _create_tar(path)
-        tar_created = True
-    encr_path, result = gpgutils.gpg_encrypt_file(path, key_fingerprint)
+        encr_path, result = _gpg_encrypt_tar(path, key_fingerprint)
+        remove = shutil.rmtree
+    else:
+        encr_path, result = gpgutils.gpg_encrypt_file(path, key_fingerprint)
+        remove = os.remove
     if os.path.isfile(encr_path) and result.ok:
         LOGGER.info('Successfully encrypted %s at %s', path, encr_path)
-        os.remove(path)
+        remove(path)
         os.rename(encr_path, path)
         return path, result
     else:
-        if tar_created:
-            _extract_tar(path)
+        if os.path.lexists(encr_path):
+            os.remove(encr_path)
         fail_msg = _('An error occured when attempting to encrypt'
                      ' %(path)s' % {'path': path})
         LOGGER.error(fail_msg)
         raise GPGException(fail_msg)
 
 
+def _gpg_encrypt_tar(path, key_fingerprint):
+    """Encrypt a tarfile of the directory at ``path`` to ``path``.gpg,
+    piping tar's output straight into GnuPG. Returns the path to the
+    encrypted file and the encryption result, like
+    ``gpgutils.gpg_encrypt_file``; if tar fails, the encrypted file is
+    removed so that the encryption is treated as failed.
+    """
+    encr_path = path + '.gpg'
+    changedir = os.path.dirname(path)
+    source = os.path.basename(path)
+    cmd = ['tar', '-C', changedir, '-cf', '-', source]
+    LOGGER.info('encrypting archive of %s at %s, relative to %s',
+                source, encr_path, changedir)
+    try:
+        tar = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    except OSError:
+        LOGGER.error('Failed to run %s', cmd, exc_info=True)
+        return encr_path, None
+    try:
+        result = gpgutils.gpg_encrypt_stream(
+            tar.stdout, encr_path, key_fingerprint)
+    finally:
+        tar.stdout.close()
+        returncode = tar.wait()
+    if returncode != 0:
+        # GnuPG encrypted a truncated tarfile
+        LOGGER.error('%s failed with exit status %s', cmd, returncode)
+        if os.path.lexists(encr_path):
+            os.remove(encr_path)
+    return encr_path, result
+
+
+def _plaintext_listing(path):
+    """Return the listing of the directory tree at ``path`` to keep with its
+    encrypted package, or None if ``path`` is not a directory."""
+    if not os.path.isdir(path):
+        return None
+    listing = {}
+    object_counts = {}
+    # Bottom up, so subdirectories' object counts are known before their parents'
+    for dirpath, dirnames, filenames in os.walk(path, topdown=False):
+        relative = os.path.relpath(dirpath, path)
+        relative = '' if relative == '.' else relative
+        entries = {}
+        for name in filenames:
+            try:
+                size = os.path.getsize(os.path.join(dirpath, name))
+            except OSError:  # E.g. a broken symlink
+                size = None
+            entries[name] = [size, None]
+        for name in dirnames:
+            subdir = os.path.join(dirpath, name)
+            # Symlinked directories aren't walked, like when counting objects
+            entries[name] = [os.path.getsize(subdir), object_counts.get(subdir, 0)]
+        object_counts[dirpath] = len(filenames) + sum(
+            count for _, count in entries.values() if count)
+        listing[escape(relative)] = {escape(name): entry for name, entry in entries.items()}
+    return listing
+
+
+def _gpg_encrypt_with_listing(path, key_fingerprint, per_file=False):
+    """Encrypt the package at ``path`` like ``_gpg_encrypt``, or file by file
+    with ``_gpg_encrypt_files`` if ``per_file`` and it is a directory, and
+    keep the listing of its plaintext tree so it can be browsed without
+    decrypting it: in its encrypted index if it is encrypted file by file, or
+    else as an ``EncryptedListing``."""
+    listing = _plaintext_listing(path)
+    if listing is None:
+        return _gpg_encrypt(path, key_fingerprint)
+    if per_file:
+        return _gpg_encrypt_files(path, key_fingerprint, listing)
+    ret = _gpg_encrypt(path, key_fingerprint)
+    _record_listing(path, listing, key_fingerprint)
+    return ret
+
+
+def _record_listing(encr_path, listing, key_fingerprint):
+    """Record the plaintext ``listing`` of the package at ``encr_path``,
+    encrypted with the key with fingerprint ``key_fingerprint``. Nothing is
+    recorded if it can't be encrypted: the package is decrypted to browse it
+    instead."""
+    result = gpgutils.gpg_encrypt_data(json.dumps(listing), key_fingerprint)
+    if not result.ok:
+        LOGGER.warning('Unable to encrypt the listing of %s, not recording'
+                       ' it: %s', encr_path, result.status)
+        EncryptedListing.objects.filter(
+            path_hash=_path_hash(encr_path)).delete()
+        return
+    stat_result = os.stat(encr_path)
+    EncryptedListing.objects.update_or_create(
+        path_hash=_path_hash(encr_path),
+        defaults={'path': escape(encr_path), 'size': stat_result.st_size,
+                  'mtime': stat_result.st_mtime,
+                  'encrypted_entries': result.data})
+
+
+def _get_listing(encr_path):
+    """Return the listing of the encrypted package at ``encr_path`` if it is
+    up to date, or None.
+
+    The listing of a package encrypted file by file is decrypted from its
+    index; others are decrypted from their ``EncryptedListing``.
+    """
+    if _is_encrypted_per_file(encr_path):
+        return _read_index(encr_path)['listing']
+    try:
+        listing = EncryptedListing.objects.get(path_hash=_path_hash(encr_path))
+        stat_result = os.stat(encr_path)
+    except (EncryptedListing.DoesNotExist, OSError):
+        return None
+    if (listing.size, listing.mtime) != (stat_result.st_size, stat_result.st_mtime):
+        return None
+    result = gpgutils.gpg_decrypt_data(listing.encrypted_entries)
+    if not result.ok:
+        LOGGER.warning('Unable to decrypt the listing of %s: %s', encr_path,
+                       result.status)
+        return None
+    return json.loads(result.data)
+
+
+def _listing2browse_dict(listing, relative_path):
+    """Return browse results for the directory ``relative_path`` of a
+    package from its recorded ``listing``, like ``space.path2browse_dict``."""
+    entries = listing.get(escape(relative_path))
+    if entries is None:
+        LOGGER.warning('%s is not a directory in the encrypted package', relative_path)
+        return {'directories': [], 'entries': [], 'properties': {}}
+    names = []
+    directories = []
+    properties = {}
+    for name, (size, object_count) in entries.items():
+        if name[0] == '.':
+            continue
+        # Browse results use str names, like path2browse_dict's
+        name = utils.coerce_str(name)
+        names.append(name)
+        properties[name] = {'size': size}
+        if object_count is not None:
+            directories.append(name)
+            properties[name]['object count'] = object_count
+    return {
+        'entries': sorted(names, key=lambda name: name.lower()),
+        'directories': sorted(directories, key=lambda name: name.lower()),
+        'properties': properties,
+    }
+
+
+def _is_encrypted_per_file(path):
+    """Return True if ``path`` is a package encrypted file by file."""
+    return os.path.isfile(os.path.join(path, ENCRYPTED_INDEX))
+
+
+def _get_per_file_package(path):
+    """Return the package encrypted file by file that is ``path`` or contains
+    it, or None."""
+    path = path.rstrip('/')
+    while path and path != '/':
+        if _is_encrypted_per_file(path):
+            return path
+        path = os.path.dirname(path)
+    return None
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+
+
+def _gpg_encrypt_files(path, key_fingerprint, listing):
+    """Use GnuPG to encrypt each file of the directory at ``path``
+    separately, in parallel, and replace the directory with the encrypted
+    files and an encrypted index of their paths, which also holds the
+    plaintext ``listing``. Returns the path and the encryption result of the
+    index, like ``_gpg_encrypt``.
+
+    Encrypted files are named randomly and spread over subdirectories, so
+    the layout reveals nothing but the number and sizes of the files.
+    """
+    path = path.rstrip('/')
+    encr_path = path + '.gpg'
+    files = {}
+    for dirpath, __, filenames in os.walk(path):
+        for name in filenames:
+            file_path = os.path.join(dirpath, name)
+            blob = uuid4().hex
+            files[file_path] = os.path.join(blob[:2], blob + '.gpg')
+
+    def encrypt(item):
+        file_path, blob = item
+        with open(file_path, 'rb') as stream:
+            result = gpgutils.gpg_encrypt_stream(
+                stream, os.path.join(encr_path, blob), key_fingerprint)
+        return file_path, result
+
+    try:
+        for blob in files.values():
+            _makedirs(os.path.join(encr_path, os.path.dirname(blob)))
+        index = {'files': {}, 'listing': listing}
+        for file_path, result in utils.map_in_threads(
+                encrypt, files.items(), settings.GPG_THREADS):
+            if not result.ok:
+                raise GPGException(result.status)
+            relative = escape(os.path.relpath(file_path, path))
+            index['files'][relative] = [
+                files[file_path], os.path.getmtime(file_path)]
+        result = gpgutils.gpg_encrypt_stream(
+            io.BytesIO(json.dumps(index)),
+            os.path.join(encr_path, ENCRYPTED_INDEX), key_fingerprint)
+        if not result.ok:
+            raise GPGException(result.status)
+    except (EnvironmentError, GPGException):
+        LOGGER.error('Failed to encrypt %s file by file', path, exc_info=True)
+        shutil.rmtree(encr_path, ignore_errors=True)
+        fail_msg = _('An error occured when attempting to encrypt'
+                     ' %(path)s' % {'path': path})
+        raise GPGException(fail_msg)
+    LOGGER.info('Successfully encrypted %d files of %s at %s', len(files),
+                path, encr_path)
+    shutil.rmtree(path)
+    os.rename(encr_path, path)
+    return path, result
+
+
+def _read_index(path):
+    """Decrypt and return the index of the package at ``path``, encrypted
+    file by file."""
+    index_path = os.path.join(path, ENCRYPTED_INDEX)
+    data = []
+    try:
+        result = gpgutils.gpg_decrypt_file_to_consumer(
+            index_path, lambda stream: data.append(stream.read()))
+        reason = result.status
+    except EnvironmentError as err:
+        result = None
+        reason = err
+    if not (result and result.ok):
+        fail_msg = _('Failed to decrypt %(path)s. Reason: %(reason)s' %
+                     {'path': index_path, 'reason': reason})
+        LOGGER.error(fail_msg)
+        raise GPGException(fail_msg)
+    return json.loads(data[0])
+
+
+def _gpg_decrypt_files(path, relative_path, dst_path):
+    """Decrypt the file or directory ``relative_path`` of the package at
+    ``path``, encrypted file by file, to ``dst_path``, decrypting only the
+    files in it, in parallel. An empty ``relative_path`` decrypts the whole
+    package.
+    """
+    index = _read_index(path)
+    relative_path = escape(relative_path.strip('/'))
+    dst_path = dst_path.rstrip('/')
+    if relative_path in index['files']:
+        targets = {dst_path: index['files'][relative_path]}
+        directories = []
+    elif relative_path in index['listing']:
+        prefix = os.path.join(relative_path, '') if relative_path else ''
+        targets = {
+            os.path.join(dst_path, utils.coerce_str(name[len(prefix):])): entry
+            for name, entry in index['files'].items()
+            if name.startswith(prefix)}
+        # Directories are created even if they are empty
+        directories = [
+            os.path.join(dst_path, utils.coerce_str(name[len(prefix):]))
+            for name in index['listing']
+            if name == relative_path or name.startswith(prefix)]
+    else:
+        fail_msg = _('Unable to move %(src_path)s; this file/dir does not'
+                     ' exist, not even in encrypted directory'
+                     ' %(encr_path)s.' %
+                     {'src_path': os.path.join(path, relative_path),
+                      'encr_path': path})
+        LOGGER.error(fail_msg)
+        raise GPGException(fail_msg)
+    for directory in directories:
+        _makedirs(directory)
+
+    def decrypt(item):
+        decr_path, (blob, mtime) = item
+        result = gpgutils.gpg_decrypt_file(os.path.join(path, blob), decr_path)
+        if result.ok:
+            os.utime(decr_path, (mtime, mtime))
+        return decr_path, result
+
+    for decr_path, result in utils.map_in_threads(
+            decrypt, targets.items(), settings.GPG_THREADS):
+        if not result.ok:
+            fail_msg = _('Failed to decrypt %(path)s. Reason: %(reason)s' %
+                         {'path': decr_path, 'reason': result.status})
+            LOGGER.error(fail_msg)
+            raise GPGException(fail_msg)
+    LOGGER.info('Successfully decrypted %d files of %s to %s', len(targets),
+                path, dst_path)
+    return dst_path
+
+
 def _db_engine():
     if 'sqlite' in settings.DATABASES['default']['ENGINE']:
         return 'sqlite'
@@ -256,11 +644,37 @@ def _db_engine():
     return 'other'
 
 
+def _path_package_uuids(path):
+    """Return the UUIDs in the segments of ``path``, which name the packages
+    it may be in: package names end with their UUID, and packages are stored
+    under ``utils.uuid_to_path`` of their UUID."""
+    uuids = set(uuid.lower() for uuid in UUID_RE.findall(path))
+    segments = path.split('/')
+    for start in range(len(segments) - 7):
+        quads = segments[start:start + 8]
+        if all(UUID_QUAD_RE.match(quad) for quad in quads):
+            hex_uuid = ''.join(quads).lower()
+            uuids.add('-'.join((hex_uuid[:8], hex_uuid[8:12], hex_uuid[12:16],
+                                hex_uuid[16:20], hex_uuid[20:])))
+    return uuids
+
+
 def _encr_path2key_fingerprint(encr_path):
     """Given an encrypted path, return the fingerprint of the GPG key
     used to encrypt the package. Since it was already encrypted, its
     model must have a GPG fingerprint.
+
+    The package is looked up by the UUIDs in the path, which is indexed, and
+    must have a current path in ``encr_path``. Only paths without the UUID
+    of their package are matched against the current path of every package.
     """
+    uuids = _path_package_uuids(encr_path)
+    if uuids:
+        for package in Package.objects.filter(uuid__in=uuids):
+            if package.current_path in encr_path:
+                return package.encryption_key_fingerprint
+    LOGGER.info('No package UUID in %s; looking up its package by path',
+                encr_path)
     sql = ('SELECT * FROM locations_package WHERE %s LIKE CONCAT(\'%%\','
            ' current_path, \'%%\')')
     if _db_engine() == 'sqlite':
@@ -286,65 +700,6 @@ def escape(string):
     return string
 
 
-def _abort_create_tar(path, tarpath):
-    fail_msg = _(
-        'Failed to create a tarfile at %(tarpath)s for dir at %(path)s' %
-        {'tarpath': tarpath, 'path': path})
-    LOGGER.error(fail_msg)
-    raise GPGException(fail_msg)
-
-
-def _create_tar(path):
-    """Create a tarfile from the directory at ``path`` and overwrite ``path``
-    with that tarfile.
-    """
-    path = path.rstrip('/')
-    tarpath = '{}.tar'.format(path)
-    changedir = os.path.dirname(tarpath)
-    source = os.path.basename(path)
-    cmd = ['tar', '-C', changedir, '-cf', tarpath, source]
-    LOGGER.info('creating archive of %s at %s, relative to %s',
-                source, tarpath, changedir)
-    try:
-        subprocess.check_output(cmd)
-    except (OSError, subprocess.CalledProcessError):
-        _abort_create_tar(path, tarpath)
-    if os.path.isfile(tarpath) and tarfile.is_tarfile(tarpath):
-        shutil.rmtree(path)
-        os.rename(tarpath, path)
-    else:
-        _abort_create_tar(path, tarpath)
-    try:
-        assert tarfile.is_tarfile(path)
-        assert not os.path.exists(tarpath)
-    except AssertionError:
-        _abort_create_tar(path, tarpath)
-
-
-def _abort_extract_tar(tarpath, newtarpath):
-    fail_msg = _('Failed to extract %(tarpath)s to a directory at the same'
-                 ' location.' % {'tarpath': tarpath})
-    LOGGER.error(fail_msg)
-    os.rename(newtarpath, tarpath)
-    raise GPGException(fail_msg)
-
-
-def _extract_tar(tarpath):
-    """Extract tarfile at ``path`` to a directory at ``path``."""
-    newtarpath = '{}.tar'.format(tarpath)
-    os.rename(tarpath, newtarpath)
-    changedir = os.path.dirname(newtarpath)
-    cmd = ['tar', '-xf', newtarpath, '-C', changedir]
-    try:
-        subprocess.check_output(cmd)
-    except (OSError, subprocess.CalledProcessError):
-        _abort_extract_tar(tarpath, newtarpath)
-    if os.path.isdir(tarpath):
-        os.remove(newtarpath)
-    else:
-        _abort_extract_tar(tarpath, newtarpath)
-
-
 def _parse_gpg_version(raw_gpg_version):
     return raw_gpg_version.splitlines()[0].split()[-1]
 
@@ -353,7 +708,8 @@ def _get_gpg_version():
     """Return the version of GPG installed. The first line of stdout from ``gpg
     --version`` is expected to be something like 'gpg (GnuPG) 1.4.16'
     """
-    return _parse_gpg_version(subprocess.check_output(['gpg', '--version']))
+    return _parse_gpg_version(
+        utils.cached_check_output(['gpg', '--version']))
 
 
 def create_encryption_event(encr_result, key_fingerprint):
@@ -393,31 +749,80 @@ def create_encryption_event(encr_result, key_fingerprint):
 def _gpg_decrypt(path):
     """Use GnuPG to decrypt the file at ``path`` and then delete the
     encrypted file.
+
+    The decrypted data is streamed from GnuPG: a tarfile that we created
+    from a directory is extracted as it is decrypted, so it is never
+    written to disk as a tarfile.
     """
     if not os.path.isfile(path):
         fail_msg = _('Cannot decrypt file at %(path)s; no such file.' %
                      {'path': path})
         LOGGER.error(fail_msg)
         raise GPGException(fail_msg)
-    decr_path = path + '.decrypted'
-    decr_result = gpgutils.gpg_decrypt_file(path, decr_path)
-    if decr_result.ok and os.path.isfile(decr_path):
-        LOGGER.info('Successfully decrypted %s to %s.', path, decr_path)
-        os.remove(path)
-        os.rename(decr_path, path)
+    encr_path = path + '.encrypted'
+    os.rename(path, encr_path)
+    try:
+        decr_result = gpgutils.gpg_decrypt_file_to_consumer(
+            encr_path, functools.partial(_write_decrypted, path))
+        reason = decr_result.status
+    except (EnvironmentError, GPGException) as err:
+        decr_result = None
+        reason = err
+    if decr_result and decr_result.ok and os.path.exists(path):
+        LOGGER.info('Successfully decrypted %s.', path)
+        os.remove(encr_path)
     else:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.lexists(path):
+            os.remove(path)
+        os.rename(encr_path, path)
         fail_msg = _('Failed to decrypt %(path)s. Reason: %(reason)s' %
-                     {'path': path, 'reason': decr_result.status})
+                     {'path': path, 'reason': reason})
         LOGGER.info(fail_msg)
         raise GPGException(fail_msg)
-    # A tarfile without an extension is one that we created in this space
-    # using an uncompressed AIP as input. We extract those here.
-    if tarfile.is_tarfile(path) and os.path.splitext(path)[1] == '':
-        LOGGER.info('%s is a tarfile so we are extracting it', path)
-        _extract_tar(path)
     return path
 
 
+def _is_tar_header(block):
+    """Return True if ``block`` is the first block of a tarfile."""
+    try:
+        tarfile.TarInfo.frombuf(block)
+    except tarfile.HeaderError:
+        return False
+    return True
+
+
+def _write_decrypted(path, stream):
+    """Write the decrypted package read from ``stream`` to ``path``.
+
+    A tarfile without an extension is one that we created in this space
+    using an uncompressed AIP as input. Those are piped into tar to extract
+    them to the directory at ``path``; anything else is written to the file
+    at ``path``.
+    """
+    head = stream.read(tarfile.BLOCKSIZE)
+    if os.path.splitext(path)[1] == '' and _is_tar_header(head):
+        LOGGER.info('%s is a tarfile so we are extracting it', path)
+        cmd = ['tar', '-xf', '-', '-C', os.path.dirname(path)]
+        tar = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        try:
+            tar.stdin.write(head)
+            shutil.copyfileobj(stream, tar.stdin, gpgutils.DECRYPT_BUFFER_SIZE)
+        finally:
+            tar.stdin.close()
+            returncode = tar.wait()
+        if returncode != 0 or not os.path.isdir(path):
+            fail_msg = _('Failed to extract %(path)s to a directory at the'
+                         ' same location.' % {'path': path})
+            LOGGER.error(fail_msg)
+            raise GPGException(fail_msg)
+    else:
+        with open(path, 'wb') as decr_file:
+            decr_file.write(head)
+            shutil.copyfileobj(stream, decr_file, gpgutils.DECRYPT_BUFFER_SIZE)
+
+
 def _get_encrypted_path(encr_path):
     """Attempt to return the existing file path that is ``encr_path`` or
     one of its ancestor paths. This is needed when we are asked to move a
@@ -1,15 +1,17 @@
 from __future__ import absolute_import
 from __future__ import division
 # stdlib, alphabetical
+from concurrent import futures
 import errno
+import hashlib
 import logging
 from lxml import etree
 import math
 import os
 import shutil
-import subprocess
 
 # Core Django, alphabetical
+from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.db import models
 from django.utils.translation import ugettext as _, ugettext_lazy as _l
@@ -26,6 +28,9 @@ from .package import Package
 
 LOGGER = logging.getLogger(__name__)
 
+# Read size when copying a chunk out of the source package
+CHUNK_BUFFER_SIZE = 4 * 1024 * 1024
+
 
 class Lockssomatic(models.Model):
     """ Spaces that store their contents in LOCKSS, via LOCKSS-o-matic. """
@@ -123,6 +128,8 @@ class Lockssomatic(models.Model):
         LOCKSS chunk.
         """
         status = package.status
+        # The parsed pointer file may belong to a previously polled package
+        self.pointer_root = None
 
         # Need to have state and edit IRI to talk to LOM
         if 'state_iri' not in package.misc_attributes or 'edit_iri' not in package.misc_attributes:
@@ -360,36 +367,19 @@ class Lockssomatic(models.Model):
             LOGGER.info('LOCKSS: after splitting: %s', output_files)
             return output_files
 
-        # Split file
-        # Strip extension, add .tar-1 ('-1' to make rename script happy)
-        output_path = os.path.splitext(file_path)[0] + '.tar-1'
-        command = ['tar', '--create', '--multi-volume',
-            '--tape-length', str(self.au_size),
-            '--new-volume-script', 'common/tar_new_volume.sh',
-            '-f', output_path, file_path]
+        # Split file into AU sized chunks, hashing each chunk as it is written
         # TODO reserve space in quota for extra files
-        LOGGER.info('LOCKSS split command: %s', command)
-        try:
-            subprocess.check_call(command)
-        except Exception:
-            LOGGER.exception("Split of %s failed with command %s", file_path, command)
-            raise
-        output_path = output_path[:-2]  # Remove '-1'
-        dirname, basename = os.path.split(output_path)
-        output_files = sorted([os.path.join(dirname, entry) for entry in os.listdir(dirname) if entry.startswith(basename)])
+        chunks = self._write_chunks(file_path)
+        output_files = [c[0] for c in chunks]
 
         # Update pointer file
         amdsec = self.pointer_root.find('mets:amdSec', namespaces=utils.NSMAP)
 
         # Add 'division' PREMIS:EVENT
-        try:
-            event_detail = subprocess.check_output(['tar', '--version'])
-        except subprocess.CalledProcessError as e:
-            event_detail = e.output or _('Error: getting tool info; probably GNU tar')
         utils.mets_add_event(
             amdsec,
             event_type='division',
-            event_detail=event_detail,
+            event_detail=_('Split into byte ranges of %(au_size)s bytes; concatenate chunks in order to restore') % {'au_size': self.au_size},
             event_outcome_detail_note='{} LOCKSS chunks created'.format(len(output_files)),
         )
 
@@ -406,23 +396,17 @@ class Lockssomatic(models.Model):
             div.append(local_ftpr)  # This moves local_fptr
 
         # Add each split chunk to structMap & fileSec
-        for idx, out_path in enumerate(output_files):
+        for idx, (out_path, size, checksum) in enumerate(chunks):
             # Add div to structMap
             div = etree.SubElement(aip_div, utils.PREFIX_NS['mets'] + 'div', TYPE='LOCKSS chunk', ORDER=str(idx + 1))
             etree.SubElement(div, utils.PREFIX_NS['mets'] + 'fptr', FILEID=os.path.basename(out_path))
-            # Get checksum and size for fileSec
-            try:
-                checksum = utils.generate_checksum(out_path, self.checksum_type)
-            except ValueError:  # Invalid checksum type
-                checksum = utils.generate_checksum(out_path, 'md5')
             checksum_name = checksum.name.upper().replace('SHA', 'SHA-')
-            size = os.path.getsize(out_path)
             # Add file & FLocat to fileSec
             file_e = etree.SubElement(filegrp, utils.PREFIX_NS['mets'] + 'file',
                 ID=os.path.basename(out_path), SIZE=str(size),
                 CHECKSUM=checksum.hexdigest(), CHECKSUMTYPE=checksum_name)
             flocat = etree.SubElement(file_e, utils.PREFIX_NS['mets'] + 'FLocat', OTHERLOCTYPE="SYSTEM", LOCTYPE="OTHER")
-            flocat.set(utils.NSMAP['xlink'] + 'href', out_path)
+            flocat.set(utils.PREFIX_NS['xlink'] + 'href', out_path)
 
         # Write out pointer file again
         with open(package.full_pointer_file_path, 'w') as f:
@@ -430,6 +414,35 @@ class Lockssomatic(models.Model):
 
         return output_files
 
+    def _write_chunks(self, file_path):
+        """
+        Split `file_path` into chunks of at most self.au_size bytes.
+
+        Chunks are named `file_path`.001, `file_path`.002, etc, so the
+        original file is the concatenation of the chunks in order.  Each chunk
+        is copied straight from its byte range of the source and hashed while
+        it is written, using up to settings.LOCKSS_SPLIT_WORKERS threads.
+
+        :return: List of (chunk path, size, checksum object) in order
+        """
+        file_size = os.path.getsize(file_path)
+        offsets = range(0, file_size, self.au_size)
+        try:
+            hashlib.new(self.checksum_type)
+            checksum_type = self.checksum_type
+        except (TypeError, ValueError):  # Invalid checksum type
+            checksum_type = 'md5'
+        LOGGER.info('LOCKSS: splitting %s into %s chunks', file_path, len(offsets))
+        jobs = [
+            ('{}.{:03d}'.format(file_path, idx + 1), offset, min(self.au_size, file_size - offset))
+            for idx, offset in enumerate(offsets)]
+        workers = max(1, min(settings.LOCKSS_SPLIT_WORKERS, len(jobs)))
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            checksums = executor.map(
+                lambda job: _write_chunk(file_path, job[0], job[1], job[2], checksum_type),
+                jobs)
+            return [(path, length, checksum) for (path, _offset, length), checksum in zip(jobs, checksums)]
+
     def _download_url(self, uuid, index=None):
         """
         Returns externally available download URL for a file.
@@ -523,3 +536,24 @@ class Lockssomatic(models.Model):
 
         LOGGER.debug('LOCKSS atom entry: %s', entry)
         return entry, slug
+
+
+def _write_chunk(source_path, chunk_path, offset, length, checksum_type):
+    """
+    Copy `length` bytes from `offset` in `source_path` to `chunk_path`.
+
+    Returns a checksum object of `checksum_type` for the chunk, computed from
+    the data as it is copied.
+    """
+    checksum = hashlib.new(checksum_type)
+    with open(source_path, 'rb') as src, open(chunk_path, 'wb') as dst:
+        src.seek(offset)
+        remaining = length
+        while remaining > 0:
+            block = src.read(min(remaining, CHUNK_BUFFER_SIZE))
+            if not block:
+                raise IOError(errno.EIO, 'Unexpected end of file', source_path)
+            checksum.update(block)
+            dst.write(block)
+            remaining -= len(block)
+    return checksum
@@ -0,0 +1,37 @@
+# stdlib, alphabetical
+
+# Core Django, alphabetical
+from django.db import models
+from django.utils.translation import ugettext as _, ugettext_lazy as _l
+
+# Third party dependencies, alphabetical
+
+# This project, alphabetical
+
+# This module, alphabetical
+
+
+class ManifestEntry(models.Model):
+    """ One checksum of one file in a stored package, from its bag manifests """
+
+    package = models.ForeignKey('Package', to_field='uuid',
+                                related_name='manifest_entries')
+    path = models.TextField(
+        help_text=_l('Path of the file relative to the root of the bag'))
+    size = models.BigIntegerField(
+        null=True, help_text=_l('Size in bytes of the file, if known'))
+    mtime = models.BigIntegerField(
+        null=True, help_text=_l('Modification time of the file in seconds since'
+                                ' the epoch, if stored uncompressed'))
+    algorithm = models.CharField(max_length=16)
+    # Sized to fit sha512
+    checksum = models.CharField(max_length=128, db_index=True)
+
+    class Meta:
+        verbose_name = _l("Manifest entry")
+        verbose_name_plural = _l("Manifest entries")
+        app_label = 'locations'
+
+    def __unicode__(self):
+        return _('%(path)s in %(package)s') % {
+            'path': self.path, 'package': self.package_id}
@@ -2,6 +2,8 @@ from __future__ import absolute_import
 # stdlib, alphabetical
 from collections import namedtuple
 import distutils.dir_util
+import hashlib
+import io
 import json
 import logging
 from lxml import etree
@@ -14,9 +16,10 @@ from uuid import uuid4
 
 # Core Django, alphabetical
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
 from django.utils.translation import ugettext as _, ugettext_lazy as _l
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 # Third party dependencies, alphabetical
 import bagit
@@ -36,12 +39,20 @@ from .location import Location
 from .space import Space
 from .event import File
 from .fixity_log import FixityLog
+from .manifest_entry import ManifestEntry
 
 __all__ = ('Package', )
 
 
 LOGGER = logging.getLogger(__name__)
 
+# Keys in Package.misc_attributes tracking the rotation of sampled fixity checks
+FIXITY_SAMPLE_RUNS_KEY = 'fixity_sample_runs'
+FIXITY_SAMPLE_NEXT_KEY = 'fixity_sample_next'
+FIXITY_SAMPLE_COVERED_KEY = 'fixity_sample_covered'
+# Key in Package.misc_attributes holding the MD5 of a package file as uploaded
+STORED_MD5_KEY = 'stored_md5'
+
 
 class Package(models.Model):
     """ A package stored in a specific location. """
@@ -115,6 +126,17 @@ class Package(models.Model):
     misc_attributes = jsonfield.JSONField(
         blank=True, null=True, default={},
         help_text=_l('For storing flexible, often Space-specific, attributes'))
+    # Copied from the latest FixityLog by the fixity check signal handlers, so
+    # package lists and "not checked since" queries don't query FixityLog
+    latest_fixity_check_datetime = models.DateTimeField(
+        null=True, blank=True, db_index=True, editable=False,
+        verbose_name=_l('Latest fixity check'))
+    latest_fixity_check_result = models.NullBooleanField(
+        editable=False, verbose_name=_l('Latest fixity check result'))
+    # Null for packages last saved before this was recorded
+    modified = models.DateTimeField(
+        auto_now=True, null=True, db_index=True,
+        verbose_name=_l('Last modified'))
 
     # Temporary attributes to track path on locally accessible filesystem
     local_path = None
@@ -131,10 +153,27 @@ class Package(models.Model):
     FULL = 'full'               # Full re-ingest
     REINGEST_CHOICES = (METADATA_ONLY, OBJECTS, FULL)
 
+    # Only written by the fixity check signal handlers, see save
+    LATEST_FIXITY_CHECK_FIELDS = (
+        'latest_fixity_check_datetime', 'latest_fixity_check_result')
+
     class Meta:
         verbose_name = _l("Package")
         app_label = 'locations'
 
+    def save(self, *args, **kwargs):
+        # Saving an existing package leaves its latest fixity check alone, so
+        # an instance loaded before a check was logged (e.g. by a long running
+        # command or status poll) doesn't overwrite the result when saved
+        if (not args and self.pk is not None and not self._state.adding and
+                kwargs.get('update_fields') is None and
+                not kwargs.get('force_insert')):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and
+                field.name not in self.LATEST_FIXITY_CHECK_FIELDS]
+        super(Package, self).save(*args, **kwargs)
+
     def __unicode__(self):
         return u"{uuid}: {path}".format(
             uuid=self.uuid,
@@ -166,11 +205,10 @@ class Package(models.Model):
         encrypted. Note that we can't compare the type of the child space to
         GPG because that would cause a circular import.
         """
-        space_is_encr = getattr(self.current_location.space.get_child_space(),
-                                'encrypted_space',
-                                False)
-        is_file = os.path.isfile(local_path)
-        return space_is_encr and is_file
+        child_space = self.current_location.space.get_child_space()
+        if not getattr(child_space, 'encrypted_space', False):
+            return False
+        return child_space.is_encrypted_package(local_path)
 
     @property
     def is_compressed(self):
@@ -188,22 +226,6 @@ class Package(models.Model):
                 message = _('%(path)s is neither a file nor a directory') % {'path': full_path}
             raise StorageException(message)
 
-    @property
-    def latest_fixity_check_datetime(self):
-        latest_check = self._latest_fixity_check()
-        return latest_check.datetime_reported if latest_check is not None else None
-
-    @property
-    def latest_fixity_check_result(self):
-        latest_check = self._latest_fixity_check()
-        return latest_check.success if latest_check is not None else None
-
-    def _latest_fixity_check(self):
-        try:
-            return FixityLog.objects.filter(package=self).order_by('-datetime_reported')[0]  # limit 1
-        except IndexError:
-            return None
-
     def get_download_path(self, lockss_au_number=None):
         full_path = self.fetch_local_path()
         if lockss_au_number is None:
@@ -212,14 +234,29 @@ class Package(models.Model):
             path = full_path
         elif self.current_location.space.access_protocol == Space.LOM:
             # Only LOCKSS breaks files into AUs
-            # TODO Get path from pointer file
-            # self.pointer_root.find("mets:structMap/*/mets:div[@ORDER='{}']".format(lockss_au_number), namespaces=NSMAP)
-            path = os.path.splitext(full_path)[0] + '.tar-' + str(lockss_au_number)
+            path = self._lockss_chunk_path(full_path, lockss_au_number)
         else:  # LOCKSS AU number specified, but not a LOCKSS package
             LOGGER.warning('Trying to download LOCKSS chunk for a non-LOCKSS package.')
             path = full_path
         return path
 
+    def _lockss_chunk_path(self, full_path, lockss_au_number):
+        """Return the path to LOCKSS chunk `lockss_au_number` of this package.
+
+        Chunks are stored next to the package, under the name recorded for them
+        in the pointer file.
+        """
+        fptr = None
+        if self.full_pointer_file_path and os.path.isfile(self.full_pointer_file_path):
+            root = etree.parse(self.full_pointer_file_path)
+            fptr = root.find(
+                ".//mets:div[@TYPE='LOCKSS chunk'][@ORDER='{}']/mets:fptr".format(lockss_au_number),
+                namespaces=utils.NSMAP)
+        if fptr is None:
+            # Name used by tar multi-volume splitting
+            return os.path.splitext(full_path)[0] + '.tar-' + str(lockss_au_number)
+        return os.path.join(os.path.dirname(full_path), fptr.get('FILEID'))
+
     def get_local_path(self):
         """Return a locally accessible path to this Package if available.
 
@@ -517,6 +554,13 @@ class Package(models.Model):
         if dest_space.access_protocol not in (Space.LOM, Space.ARKIVUM):
             replica_package.status = Package.UPLOADED
         replica_package.save()
+        # The replica is a byte-for-byte copy, so it shares the master's
+        # manifest.
+        ManifestEntry.objects.bulk_create([
+            ManifestEntry(package=replica_package, path=entry.path,
+                          size=entry.size, algorithm=entry.algorithm,
+                          checksum=entry.checksum)
+            for entry in self.manifest_entries.all()])
         dest_space.post_move_from_storage_service(
             staging_path=replica_package.current_path,
             destination_path=replica_destination_path,
@@ -697,7 +741,10 @@ class Package(models.Model):
             destination_space=v.dest_space)
         self.status = Package.STAGING
         self.save()
+        self._index_manifest_if_possible(
+            os.path.join(v.dest_space.staging_path, self.current_path))
         v.src_space.post_move_to_storage_service()
+        self.clear_stored_md5()
         storage_effects = v.dest_space.move_from_storage_service(
             source_path=self.current_path,  # This should include Location.path
             destination_path=os.path.join(
@@ -712,6 +759,7 @@ class Package(models.Model):
             related_package = Package.objects.get(uuid=related_package_uuid)
             self.related_packages.add(related_package)
         self.save()
+        self._record_stored_mtimes()
         v.dest_space.post_move_from_storage_service(
             staging_path=self.current_path,
             destination_path=os.path.join(
@@ -1282,6 +1330,12 @@ class Package(models.Model):
         deleted.
         """
         ss_internal = Location.active.get(purpose=Location.STORAGE_SERVICE_INTERNAL)
+        local_path = self.get_local_path()
+        if (relative_path and local_path and os.path.isdir(local_path) and
+                self.is_encrypted(local_path)):
+            # Packages encrypted file by file only decrypt the file
+            return self._fetch_encrypted_file(
+                relative_path, extract_path, ss_internal)
         full_path = self.fetch_local_path()
 
         if extract_path is None:
@@ -1346,6 +1400,52 @@ class Package(models.Model):
             self.local_path = output_path
         return (output_path, extract_path)
 
+    def lists_file(self, relative_path):
+        """Return False if this package's manifest index shows that it has no
+        payload file at ``relative_path``, which starts with the package's
+        base directory, and True otherwise. Packages that have not been
+        indexed are assumed to have the file."""
+        rel_path = os.path.normpath(relative_path).split(os.sep, 1)[-1]
+        if not rel_path.startswith('data' + os.sep):
+            return True
+        entries = self.manifest_entries
+        return not entries.exists() or entries.filter(path=rel_path).exists()
+
+    def _fetch_encrypted_file(self, relative_path, extract_path, ss_internal):
+        """Fetch the file at ``relative_path`` of this package, which is
+        encrypted file by file, to ``extract_path``, like ``extract_file``,
+        decrypting only that file."""
+        if extract_path is None:
+            extract_path = tempfile.mkdtemp(dir=ss_internal.full_path)
+        output_path = os.path.join(extract_path, relative_path)
+        # Stage in a directory of its own, so that concurrent extracts of
+        # the same path don't overwrite each other's staged file
+        staging_root = ss_internal.space.staging_path
+        ss_internal.space.create_local_directory(
+            os.path.join(staging_root, ''))
+        staging_dir = tempfile.mkdtemp(dir=staging_root)
+        staged_path = os.path.join(
+            os.path.relpath(staging_dir, staging_root), relative_path)
+        try:
+            self.current_location.space.move_to_storage_service(
+                source_path=os.path.join(
+                    self.current_location.relative_path,
+                    os.path.dirname(self.current_path), relative_path),
+                destination_path=staged_path,
+                destination_space=ss_internal.space,
+            )
+            ss_internal.space.move_from_storage_service(
+                source_path=staged_path,
+                destination_path=output_path.replace(
+                    ss_internal.space.path, '', 1).lstrip('/'),
+                package=self,
+            )
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        LOGGER.info('Decrypted %s of %s to %s', relative_path, self.uuid,
+                    output_path)
+        return (output_path, extract_path)
+
     def compress_package(self, algorithm, extract_path=None):
         """
         Produces a compressed copy of the package.
@@ -1544,6 +1644,81 @@ class Package(models.Model):
                                           name=f['path'],
                                           origin=file_data['dashboard_uuid'])
 
+    def index_manifest(self, path=None):
+        """
+        Records the checksums in this package's bag manifests in the
+        ManifestEntry table, replacing any that were recorded before, so they
+        can be looked up without opening the package.
+
+        :param path: Local path of the bag, either a directory or an archive.
+            If not provided, a local copy of this package is used.
+        :returns: The number of entries recorded.
+        :raises bagit.BagError: if ``path`` is not a bag.
+        """
+        if path is None:
+            path = self.fetch_local_path()
+
+        if os.path.isdir(path):
+            entries = bagit.Bag(path).entries
+            stats = _stat_bag_files(path, entries)
+        else:
+            prefix, __, entries = _read_archived_bag_tags(path)
+            stats = _stat_archived_bag_files(path, prefix)
+        return self._record_manifest_entries(entries, stats)
+
+    def _record_manifest_entries(self, entries, stats):
+        """Replace this package's ManifestEntry rows with ``entries``
+        (rel_path -> {algorithm: digest}) and ``stats`` (rel_path -> (size,
+        mtime)) and return the number of rows recorded."""
+        rows = [ManifestEntry(package=self, path=rel_path,
+                              size=stats.get(rel_path, (None, None))[0],
+                              mtime=stats.get(rel_path, (None, None))[1],
+                              algorithm=algorithm, checksum=checksum.lower())
+                for rel_path, checksums in entries.items()
+                for algorithm, checksum in checksums.items()]
+        with transaction.atomic():
+            self.manifest_entries.all().delete()
+            ManifestEntry.objects.bulk_create(rows, batch_size=500)
+        return len(rows)
+
+    def _index_manifest_if_possible(self, path):
+        """Call ``index_manifest`` on ``path``, logging rather than raising
+        if the manifests cannot be read; the index is only an optimization.
+
+        Tar archives have no index of their members, so reading their
+        manifests means reading the whole archive. They are not indexed here
+        but by the first full fixity check, which reads them anyway.
+        """
+        if self.package_type not in (self.AIC, self.AIP):
+            return
+        if not (os.path.isdir(path) or utils.is_indexed_archive(path)):
+            LOGGER.debug('Leaving the manifest of %s at %s to be indexed by a fixity check',
+                         self.uuid, path)
+            return
+        try:
+            self.index_manifest(path)
+        except (bagit.BagError, EnvironmentError, subprocess.CalledProcessError) as err:
+            LOGGER.warning('Unable to index the manifest of package %s at %s: %s',
+                           self.uuid, path, err)
+
+    def _record_stored_mtimes(self):
+        """Replace the mtimes in this package's manifest index, which were
+        read from the copy that was indexed, with those of the stored copy
+        that ``check_fixity_quick`` stats. Spaces do not all preserve mtimes
+        when they move a package into place. If the stored copy is not a local
+        directory the mtimes are cleared, and only sizes are compared."""
+        rows = list(self.manifest_entries.all())
+        if not rows:
+            return
+        entries, stats = {}, {}
+        for row in rows:
+            entries.setdefault(row.path, {})[row.algorithm] = row.checksum
+            stats[row.path] = (row.size, None)
+        if os.path.isdir(self.full_path):
+            for rel_path, (size, mtime) in _stat_bag_files(self.full_path, entries).items():
+                stats[rel_path] = (stats[rel_path][0], mtime)
+        self._record_manifest_entries(entries, stats)
+
     def backlog_transfer(self, origin_location, origin_path):
         """
         Stores a package in backlog.
@@ -1591,7 +1766,8 @@ class Package(models.Model):
         self.status = Package.UPLOADED
         self.save()
 
-    def check_fixity(self, force_local=False, delete_after=True):
+    def check_fixity(self, force_local=False, delete_after=True,
+                     read_budget=None):
         """ Scans the package to verify its checksums.
 
         This will check if the Space can run a fixity and use that. If not, it will run fixity locally.
@@ -1620,6 +1796,7 @@ class Package(models.Model):
 
         :param bool force_local: If True, will always fetch and run fixity locally. If not, it will use a Space's fixity check if available.
         :param bool delete_after: If True and the package was copied to a local path, will delete the temporary copy once fixity is run.
+        :param read_budget: Optional ``utils.ReadBudget`` that local reads of the package's files are paced by. Copying or extracting the package first is not.
         """
 
         if self.package_type not in (self.AIC, self.AIP):
@@ -1634,6 +1811,30 @@ class Package(models.Model):
                 return (success, failures, message, timestamp)
 
         if self.is_compressed:
+            # ZIP, 7z and tar packages can be validated by streaming their
+            # members through the hashers, which avoids writing a full
+            # extracted copy to disk. Other formats still need extracting.
+            path = self.fetch_local_path()
+            if utils.is_streamable_archive(path):
+                try:
+                    scanned = _scan_archived_bag(path, read_budget)
+                except bagit.BagError as err:
+                    LOGGER.error('Unable to validate %s: %s', path, err)
+                    return (None, [], _('Unable to scan; package is not a bag (AIP or AIC)'), None)
+                success, failures, message = _validate_scanned_bag(
+                    path, *scanned, read_budget=read_budget)
+                if not success:
+                    LOGGER.error('bagit.BagValidationError on %s:\n%s', path, message)
+                elif self.package_type in (self.AIC, self.AIP) and \
+                        not self.manifest_entries.exists():
+                    # Index packages that could not be indexed when stored
+                    # from what this check has just read
+                    prefix, __, entries, members = scanned
+                    self._record_manifest_entries(entries, dict(
+                        (os.path.normpath(name[len(prefix):]), (size, None))
+                        for name, (size, __) in members.items()
+                        if name.startswith(prefix)))
+                return (success, failures, message, None)
             # bagit can't deal with compressed files, so extract before
             # starting the fixity check.
             try:
@@ -1646,7 +1847,7 @@ class Package(models.Model):
 
         bag = bagit.Bag(path)
         try:
-            success = bag.validate(processes=settings.BAG_VALIDATION_NO_PROCESSES)
+            success = _validate_bag(bag, read_budget)
             failures = []
             message = ""
         except bagit.BagValidationError as failure:
@@ -1665,16 +1866,246 @@ class Package(models.Model):
 
         return (success, failures, message, None)
 
+    def check_fixity_quick(self):
+        """ Checks that the package is complete without hashing it.
+
+        Verifies that every file in the bag's manifests is present, that there
+        are no payload files missing from the manifests, the bag's
+        Payload-Oxum, and that file sizes (and modification times, for
+        uncompressed packages) match those recorded in the ManifestEntry table
+        when the package was stored. Only the archive index is read for
+        compressed packages.
+
+        Returns a tuple like ``check_fixity``. Size and modification time
+        differences are reported as ``bagit.ChecksumMismatch`` with algorithm
+        'size' or 'mtime'. Success is None if the quick check cannot be run,
+        e.g. because the package is not available locally.
+        """
+        return self._check_fixity_quick()[0]
+
+    def _check_fixity_quick(self):
+        """Run the quick fixity check and return its result tuple, along with
+        the (path, prefix, entries) of the bag it scanned, or None if the
+        scan did not get that far. ``prefix`` is the path of the bag inside
+        the archive, or None if the package is not compressed."""
+        if self.package_type not in (self.AIC, self.AIP):
+            return (None, [], _("Unable to scan; package is not a bag (AIP or AIC)"), None), None
+
+        path = self.get_local_path()
+        if not path or not os.path.exists(path) or self.is_encrypted(path):
+            return (None, [], _('Unable to run a quick fixity check; package is not available locally'), None), None
+
+        prefix = None
+        try:
+            if os.path.isdir(path):
+                bag = bagit.Bag(path)
+                info, entries = bag.info, bag.entries
+                files = _stat_bag_files(path, bag.payload_files())
+                files.update(_stat_bag_files(path, [
+                    rel_path for rel_path in entries
+                    if not rel_path.startswith('data' + os.sep)]))
+            else:
+                prefix, info, entries = _read_archived_bag_tags(path)
+                files = _stat_archived_bag_files(path, prefix)
+        except (bagit.BagError, EnvironmentError, subprocess.CalledProcessError) as err:
+            LOGGER.error('Unable to run a quick fixity check on %s: %s', path, err)
+            return (None, [], _('Unable to scan; package is not a bag (AIP or AIC)'), None), None
+
+        recorded = dict(
+            (entry.path, (entry.size, entry.mtime))
+            for entry in self.manifest_entries.all())
+        success, failures, message = _quick_check_bag(
+            entries, info, files, recorded)
+        return (success, failures, message, None), (path, prefix, entries)
+
+    def check_fixity_sample(self, runs, read_budget=None):
+        """ Verifies the checksums of a rotating share of the package's files.
+
+        The bag's files are split into ``runs`` fixed partitions by a hash of
+        their path. Each call runs ``check_fixity_quick`` and then verifies
+        the checksums of the files in the next partition, so every file is
+        verified at least once every ``runs`` calls without any one call
+        having to read the whole package. The rotation is tracked in
+        ``misc_attributes``, which also records when the last complete
+        rotation finished; changing ``runs`` starts a new rotation.
+
+        Returns a tuple like ``check_fixity``.
+
+        :param int runs: Number of calls over which every file is verified.
+        :param read_budget: Optional ``utils.ReadBudget`` pacing the reads.
+        """
+        result, scanned = self._check_fixity_quick()
+        if result[0] is not True:
+            return result
+        path, prefix, entries = scanned
+
+        partition = 0
+        if self.misc_attributes.get(FIXITY_SAMPLE_RUNS_KEY) == runs:
+            partition = self.misc_attributes.get(FIXITY_SAMPLE_NEXT_KEY, 0) % runs
+        sample = dict((rel_path, checksums)
+                      for rel_path, checksums in entries.items()
+                      if _fixity_sample_partition(rel_path, runs) == partition)
+        if prefix is not None and not utils.is_streamable_archive(path):
+            # Escalated to a full check, which extracts the package first
+            return (None, [], _('Unable to sample files of this type of archive'), None)
+        LOGGER.info('Verifying checksums of %d of %d files in partition %d/%d of %s',
+                    len(sample), len(entries), partition + 1, runs, self.uuid)
+        try:
+            if prefix is None:
+                errors = _verify_bag_files(path, sample, read_budget)
+            else:
+                errors = _verify_archived_bag_files(path, prefix, sample,
+                                                    read_budget)
+        except (EnvironmentError, subprocess.CalledProcessError) as err:
+            LOGGER.error('Unable to verify checksums of %s: %s', path, err)
+            return (None, [], _('Error reading package'), None)
+
+        self.misc_attributes[FIXITY_SAMPLE_RUNS_KEY] = runs
+        self.misc_attributes[FIXITY_SAMPLE_NEXT_KEY] = (partition + 1) % runs
+        if partition == runs - 1 and not errors:
+            self.misc_attributes[FIXITY_SAMPLE_COVERED_KEY] = timezone.now().isoformat()
+        self.save(update_fields=['misc_attributes'])
+
+        if errors:
+            return (False, errors, 'invalid bag', None)
+        return (True, [], '', None)
+
+    def fixity_sample_covered(self):
+        """Return when ``check_fixity_sample`` last finished verifying every
+        file of this package, or None if it never has."""
+        covered = self.misc_attributes.get(FIXITY_SAMPLE_COVERED_KEY)
+        return parse_datetime(covered) if covered else None
+
+    def record_stored_md5(self, md5):
+        """Record the MD5 of this package's file as uploaded to its space, so
+        the space can later check it against the digest it reports. The
+        package is not saved."""
+        self.misc_attributes[STORED_MD5_KEY] = md5
+
+    def clear_stored_md5(self):
+        """Forget the MD5 recorded by ``record_stored_md5``. Called whenever
+        the stored copy is replaced, since the new copy may not be a single
+        file. The package is not saved."""
+        self.misc_attributes.pop(STORED_MD5_KEY, None)
+
+    @property
+    def stored_md5(self):
+        """The MD5 recorded by ``record_stored_md5``, or None. Only packages
+        uploaded as a single file (i.e. compressed) have one."""
+        return self.misc_attributes.get(STORED_MD5_KEY)
+
+    def get_recorded_md5s(self):
+        """ Returns the MD5s recorded for this package's files.
+
+        For packages uploaded as a single file this is ``stored_md5``, keyed
+        by the package's file name. Otherwise it is the bag's MD5 manifest as
+        recorded in the ManifestEntry table, keyed by path relative to the bag.
+        This does not fetch the package.
+
+        :returns: Dict of path -> (md5, size). Size may be None.
+        :raises NotImplementedError: if no MD5s were recorded for this package.
+        """
+        if self.stored_md5:
+            name = os.path.basename(self.current_path.rstrip('/'))
+            expected = {name: (self.stored_md5, None)}
+        else:
+            expected = dict(
+                (entry.path, (entry.checksum, entry.size))
+                for entry in self.manifest_entries.filter(algorithm='md5'))
+        if not expected:
+            raise NotImplementedError(
+                _('No MD5 checksums are recorded for package %(uuid)s') %
+                {'uuid': self.uuid})
+        return expected
+
+    def check_remote_md5s(self, remote, errors=None):
+        """ Compares MD5s reported by this package's space with recorded ones.
+
+        Lets spaces that keep an MD5 of every stored object check fixity
+        without downloading the package. See ``get_recorded_md5s``.
+
+        :param dict remote: Path -> (md5, size) for each stored file, keyed
+            like ``get_recorded_md5s``. Either value may be None if the space
+            does not report it.
+        :param list errors: Errors already found by the space, e.g. in chunks.
+        :returns: Tuple like ``check_fixity``.
+        :raises NotImplementedError: if no MD5s were recorded for this package.
+        """
+        expected = self.get_recorded_md5s()
+        return self.check_remote_checksums(
+            'md5', expected, remote, errors=errors,
+            check_unexpected=not self.stored_md5)
+
+    def check_remote_checksums(self, algorithm, expected, remote, errors=None,
+                               check_unexpected=True):
+        """ Compares checksums computed by this package's space with ``expected``.
+
+        :param str algorithm: Checksum algorithm, used in error reports.
+        :param dict expected: Path -> (checksum, size) recorded for the package.
+        :param dict remote: Path -> (checksum, size) for each stored file.
+            Either value may be None if the space does not report it.
+        :param list errors: Errors already found by the space, e.g. in chunks.
+        :param bool check_unexpected: If True, report files under ``data/``
+            in ``remote`` that are not in ``expected``.
+        :returns: Tuple like ``check_fixity``.
+        """
+        errors = list(errors or [])
+        for path, (checksum, size) in sorted(expected.items()):
+            if path not in remote:
+                errors.append(bagit.FileMissing(path))
+                continue
+            remote_checksum, remote_size = remote[path]
+            checksum = checksum.lower() if checksum else checksum
+            remote_checksum = remote_checksum.lower() if remote_checksum else remote_checksum
+            if remote_checksum != checksum:
+                errors.append(bagit.ChecksumMismatch(
+                    path, algorithm, checksum, remote_checksum))
+            elif None not in (size, remote_size) and size != remote_size:
+                errors.append(bagit.ChecksumMismatch(path, 'size', size, remote_size))
+        if check_unexpected:
+            for path in sorted(set(remote) - set(expected)):
+                if path.startswith('data/'):
+                    errors.append(bagit.UnexpectedFile(path))
+
+        for error in errors:
+            LOGGER.warning(str(error))
+        if errors:
+            return (False, errors, 'invalid bag', None)
+        return (True, [], '', None)
+
     def get_fixity_check_report_send_signals(self, force_local=False,
-                                             delete_after=True):
+                                             delete_after=True, quick=False,
+                                             sample_runs=None,
+                                             read_budget=None):
         """Perform a fixity check on this package by calling ``check_fixity``,
         then also send Django signals so the check is recorded in the database,
         and return a JSON report of the fixity check attempt.
+
+        If ``quick`` is True, ``check_fixity_quick`` is run instead, and if
+        ``sample_runs`` is given, ``check_fixity_sample`` is. Either is
+        escalated to a full ``check_fixity`` if it does not succeed. The
+        report's ``check_level`` says which check produced it. Local reads
+        are paced by ``read_budget``, a ``utils.ReadBudget``, if given.
         """
 
         # Do the fixity check
-        success, failures, message, timestamp = self.check_fixity(
-            force_local=force_local)
+        check_level = FixityLog.FULL
+        if sample_runs:
+            success, failures, message, timestamp = self.check_fixity_sample(
+                sample_runs, read_budget)
+            check_level = FixityLog.SAMPLE
+        elif quick:
+            success, failures, message, timestamp = self.check_fixity_quick()
+            check_level = FixityLog.QUICK
+        if check_level != FixityLog.FULL and success is not True:
+            LOGGER.info('%s fixity check of %s did not pass (%s);'
+                        ' running a full check', check_level, self.uuid,
+                        message)
+            check_level = FixityLog.FULL
+        if check_level == FixityLog.FULL:
+            success, failures, message, timestamp = self.check_fixity(
+                force_local=force_local, delete_after=delete_after,
+                read_budget=read_budget)
 
         # Build the response (to be a JSON object)
         response = {
@@ -1688,6 +2119,7 @@ class Package(models.Model):
                 }
             },
             "timestamp": timestamp,
+            "check_level": check_level,
         }
         for failure in failures:
             if isinstance(failure, bagit.FileMissing):
@@ -2022,6 +2454,7 @@ class Package(models.Model):
         # 5. Create a new bag from the AIP at ``old_aip_internal_path`` and
         #    validate it.
         _update_bag_payload_and_verify(old_aip_internal_path)
+        self._index_manifest_if_possible(old_aip_internal_path)
 
         compression = None
         if to_be_compressed:
@@ -2079,6 +2512,7 @@ class Package(models.Model):
             internal_space, internal_location,
             updated_aip_parent_path, updated_aip_path,
             reingest_space, reingest_location, old_aip_internal_path)
+        self._record_stored_mtimes()
         if storage_effects:
             pointer_file = self.get_pointer_instance()
             if pointer_file:
@@ -2243,6 +2677,7 @@ class Package(models.Model):
             source_path=updated_aip_src_path,
             destination_path=dest_path,  # This should include Location.path
             destination_space=reingest_space)
+        self.clear_stored_md5()
         storage_effects = reingest_space.move_from_storage_service(
             source_path=dest_path,  # This should include Location.path
             destination_path=os.path.join(reingest_location.relative_path,
@@ -2274,7 +2709,7 @@ class Package(models.Model):
                                utils.COMPRESSION_7Z_LZMA):
                 try:
                     version = [x for x in
-                               subprocess.check_output('7z').splitlines() if
+                               utils.cached_check_output('7z').splitlines() if
                                'Version' in x][0]
                     event_detail = 'program="7z"; version="{}"'.format(version)
                 except (subprocess.CalledProcessError, Exception):
@@ -2282,7 +2717,7 @@ class Package(models.Model):
             elif compression in (utils.COMPRESSION_TAR_BZIP2,
                                  utils.COMPRESSION_TAR):
                 try:
-                    version = subprocess.check_output(
+                    version = utils.cached_check_output(
                         ['tar', '--version']).splitlines()[0]
                     event_detail = 'program="tar"; version="{}"'.format(version)
                 except (subprocess.CalledProcessError, Exception):
@@ -2364,7 +2799,7 @@ class Package(models.Model):
                               TRANSFORMTYPE='decompression',
                               TRANSFORMALGORITHM=algo)
             )
-            version = [x for x in subprocess.check_output('7z').splitlines() if
+            version = [x for x in utils.cached_check_output('7z').splitlines() if
                        'Version' in x][0]
             format_info = {
                 'name': '7Zip format',
@@ -2391,7 +2826,7 @@ class Package(models.Model):
                               TRANSFORMTYPE='decompression',
                               TRANSFORMALGORITHM='tar')
             )
-            version = subprocess.check_output(
+            version = utils.cached_check_output(
                 ['tar', '--version']).splitlines()[0]
             format_info = {
                 'name': 'BZIP2 Compressed Archive',
@@ -2476,6 +2911,410 @@ def _get_decompr_cmd(compression, extract_path, full_path):
     return ['unar', '-force-overwrite', '-o', extract_path, full_path]
 
 
+def _is_archived_bag_tag_file(name):
+    """Return True if the archive member ``name`` may be a bag tag file."""
+    parts = name.split('/')
+    return len(parts) <= 2 and bool(
+        parts[-1] in ('bagit.txt', 'bag-info.txt', 'package-info.txt') or
+        re.match(r'(tag)?manifest-\w+\.txt$', parts[-1]))
+
+
+def _read_archived_bag_tags(path):
+    """Read the tag files of the bag inside the archive at ``path``.
+
+    Returns a tuple like `_parse_archived_bag_tags`.
+    """
+    tag_files = utils.read_archive_files(path, _is_archived_bag_tag_file)
+    return _parse_archived_bag_tags(path, tag_files)
+
+
+def _parse_archived_bag_tags(path, tag_files):
+    """Parse the tag files of the bag inside the archive at ``path``, given
+    as a dict of archive name -> contents.
+
+    Returns a tuple of (prefix, info, entries): the archive path of the bag's
+    root directory (with a trailing slash), the parsed bag-info.txt and the
+    manifest entries as a dict of relative path -> {algorithm: digest}.
+    Raises ``bagit.BagError`` if the archive does not contain a bag.
+    """
+    bagit_txt = sorted(n for n in tag_files if n.endswith('bagit.txt'))
+    if not bagit_txt:
+        raise bagit.BagError('No bagit.txt found: %s' % path)
+    root = os.path.dirname(bagit_txt[0])
+    prefix = root + '/' if root else ''
+
+    def tags(name):
+        contents = tag_files.get(prefix + name)
+        if contents is None:
+            return {}
+        return dict(bagit._parse_tags(contents.splitlines()))
+
+    if tag_files[bagit_txt[0]].startswith(bagit.BOM):
+        raise bagit.BagValidationError(
+            'bagit.txt must not contain a byte-order mark')
+    version = tags('bagit.txt').get('BagIt-Version')
+    if version not in ('0.93', '0.94', '0.95', '0.96', '0.97'):
+        raise bagit.BagError('Unsupported bag version: %s' % version)
+    info = tags('bag-info.txt' if version in ('0.96', '0.97') else 'package-info.txt')
+
+    # Manifest entries, as rel_path -> {alg: expected digest}
+    entries = {}
+    manifest_re = r'manifest-(\w+)\.txt$' if version != '0.97' else r'(?:tag)?manifest-(\w+)\.txt$'
+    for name, contents in tag_files.items():
+        match = re.match(manifest_re, name[len(prefix):])
+        if not name.startswith(prefix) or not match:
+            continue
+        alg = match.group(1)
+        try:
+            hashlib.new(alg)
+        except ValueError:
+            LOGGER.warning('Unable to validate file contents using unknown %s hash algorithm', alg)
+            continue
+        for line in contents.splitlines():
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            entry = line.split(None, 1)
+            if len(entry) != 2:
+                LOGGER.error('%s: Invalid %s manifest entry: %s', path, alg, line)
+                continue
+            entry_path = os.path.normpath(bagit._decode_filename(entry[1].lstrip('*')))
+            entries.setdefault(entry_path, {})[alg] = entry[0].lower()
+    if not any(re.match(r'manifest-\w+\.txt$', n[len(prefix):]) for n in tag_files):
+        raise bagit.BagValidationError('Missing manifest file')
+
+    return prefix, info, entries
+
+
+def _fixity_sample_partition(rel_path, runs):
+    """Return which of ``runs`` partitions the bag file ``rel_path`` is in."""
+    return int(hashlib.md5(rel_path.encode('utf-8')).hexdigest(), 16) % runs
+
+
+def _hash_stream(stream, algorithms, read_budget=None):
+    """Return a tuple of (size, {algorithm: hex digest}) of the rest of
+    ``stream``, read at the pace of ``read_budget`` if given."""
+    hashers = dict((algorithm, hashlib.new(algorithm)) for algorithm in algorithms)
+    size = 0
+    for block in iter(lambda: stream.read(utils.CHECKSUM_BLOCK_SIZE), b''):
+        size += len(block)
+        for hasher in hashers.values():
+            hasher.update(block)
+        if read_budget is not None:
+            read_budget.spend(len(block))
+    return size, dict((algorithm, hasher.hexdigest())
+                      for algorithm, hasher in hashers.items())
+
+
+def _compare_digests(rel_path, expected, found):
+    """Return a ``bagit.ChecksumMismatch`` for each digest in ``found`` that
+    differs from the one in ``expected``."""
+    return [bagit.ChecksumMismatch(rel_path, algorithm, expected[algorithm].lower(), digest)
+            for algorithm, digest in sorted(found.items())
+            if digest != expected[algorithm].lower()]
+
+
+def _supported_algorithms(checksums):
+    """Return the algorithms in ``checksums`` hashlib can compute."""
+    supported = []
+    for algorithm in checksums:
+        try:
+            hashlib.new(algorithm)
+        except ValueError:
+            continue
+        supported.append(algorithm)
+    return supported
+
+
+def _verify_bag_files(path, entries, read_budget=None):
+    """Verify the files in ``entries`` (rel_path -> {algorithm: digest})
+    of the bag directory ``path`` and return a list of bagit errors.
+
+    Files are hashed in up to settings.FIXITY_HASH_THREADS threads, which
+    share ``read_budget`` if given."""
+    def verify(item):
+        rel_path, checksums = item
+        try:
+            with open(os.path.join(path, rel_path), 'rb') as f:
+                __, found = _hash_stream(
+                    f, _supported_algorithms(checksums), read_budget)
+        except IOError:
+            return [bagit.FileMissing(rel_path)]
+        return _compare_digests(rel_path, checksums, found)
+
+    errors = []
+    for file_errors in utils.map_in_threads(
+            verify, sorted(entries.items()), settings.FIXITY_HASH_THREADS):
+        errors.extend(file_errors)
+    return errors
+
+
+def _validate_bag_metadata(bag):
+    """Run the checks ``bagit.Bag.validate`` makes before hashing: the bag's
+    structure, bagit.txt and Payload-Oxum. They are private bagit methods, so
+    this returns False instead if the installed bagit lacks them (see the
+    bagit pin in requirements/base.txt)."""
+    try:
+        checks = (bag._validate_structure, bag._validate_bagittxt,
+                  bag._validate_oxum)
+    except AttributeError:
+        return False
+    for check in checks:
+        check()
+    return True
+
+
+def _validate_bag(bag, read_budget=None):
+    """Validate ``bag`` like ``bagit.Bag.validate``, but hash its files in up
+    to settings.FIXITY_HASH_THREADS threads rather than bagit's
+    multiprocessing pool, which hangs under gevent workers, at the pace of
+    ``read_budget`` if given.
+
+    Falls back to a single process ``bag.validate`` if bagit's private checks
+    are not available.
+
+    :raises bagit.BagValidationError: if the bag is invalid.
+    """
+    if not _validate_bag_metadata(bag):
+        LOGGER.warning('This bagit version cannot be validated in threads;'
+                       ' validating %s in a single process', bag)
+        return bag.validate(processes=1)
+    errors = []
+    only_in_manifests, only_on_fs = bag.compare_manifests_with_fs()
+    errors.extend(bagit.FileMissing(rel_path) for rel_path in only_in_manifests)
+    errors.extend(bagit.UnexpectedFile(rel_path) for rel_path in only_on_fs)
+
+    available = set(_supported_algorithms(bag.algs))
+    if not available:
+        raise RuntimeError('%s: Unable to validate bag contents: none of the'
+                           ' hash algorithms in %s are supported!' % (bag, bag.algs))
+
+    def verify(item):
+        rel_path, checksums = item
+        algorithms = [alg for alg in checksums if alg in available]
+        full_path = os.path.join(bag.path, rel_path)
+        try:
+            with open(full_path, 'rb') as f:
+                __, found = _hash_stream(f, algorithms, read_budget)
+        except EnvironmentError as err:
+            # Reported as a mismatch with the reason, like bagit does
+            if os.path.exists(full_path):
+                reason = 'could not read %s: %s' % (full_path, err)
+            else:
+                reason = '%s does not exist' % full_path
+            found = dict((alg, reason) for alg in algorithms)
+        return _compare_digests(rel_path, checksums, found)
+
+    for file_errors in utils.map_in_threads(
+            verify, sorted(bag.entries.items()), settings.FIXITY_HASH_THREADS):
+        errors.extend(file_errors)
+
+    for error in errors:
+        LOGGER.warning(str(error))
+    if errors:
+        raise bagit.BagValidationError('invalid bag', errors)
+    return True
+
+
+def _verify_archived_bag_files(path, prefix, entries, read_budget=None):
+    """Verify the files in ``entries`` (rel_path -> {algorithm: digest})
+    of the bag at ``prefix`` inside the archive ``path`` and return a list of
+    bagit errors. Members that are not sampled are skipped unread."""
+    errors = []
+    seen = set()
+    for name, __, stream in utils.iter_archive_members(path):
+        if stream is None or not name.startswith(prefix):
+            continue
+        rel_path = os.path.normpath(name[len(prefix):])
+        if rel_path not in entries:
+            continue
+        seen.add(rel_path)
+        checksums = entries[rel_path]
+        __, found = _hash_stream(
+            stream, _supported_algorithms(checksums), read_budget)
+        errors.extend(_compare_digests(rel_path, checksums, found))
+    for rel_path in sorted(set(entries) - seen):
+        errors.append(bagit.FileMissing(rel_path))
+    return errors
+
+
+def _stat_bag_files(path, rel_paths):
+    """Return a dict of rel_path -> (size, mtime) for the files at
+    ``rel_paths`` inside the bag directory ``path`` that exist."""
+    stats = {}
+    for rel_path in rel_paths:
+        try:
+            stat = os.stat(os.path.join(path, rel_path))
+        except OSError:
+            continue
+        stats[rel_path] = (stat.st_size, int(stat.st_mtime))
+    return stats
+
+
+def _stat_archived_bag_files(path, prefix):
+    """Return a dict of rel_path -> (size, None) for the files in the bag at
+    ``prefix`` inside the archive ``path``. Archive member times are fixed
+    when the archive is created, so they are not recorded."""
+    return dict(
+        (os.path.normpath(name[len(prefix):]), (size, None))
+        for name, size in utils.list_archive_members(path).items()
+        if name.startswith(prefix))
+
+
+def _quick_check_bag(entries, info, files, recorded):
+    """Compare the files of a bag with its manifests and recorded metadata.
+
+    :param dict entries: Manifest entries, rel_path -> {algorithm: digest}.
+    :param dict info: The bag's bag-info.txt tags.
+    :param dict files: The bag's files, rel_path -> (size, mtime).
+    :param dict recorded: Sizes and mtimes recorded when the package was
+        stored, rel_path -> (size, mtime). Either may be None.
+    :returns: A tuple of (success, [errors], message).
+    """
+    payload = [(rel_path, size) for rel_path, (size, __) in files.items()
+               if rel_path.startswith('data' + os.sep)]
+    oxum = info.get('Payload-Oxum')
+    if isinstance(oxum, list):
+        oxum = oxum[0]
+    if oxum:
+        byte_count, __, file_count = oxum.partition('.')
+        if not byte_count.isdigit() or not file_count.isdigit():
+            return (False, [], 'Invalid oxum: %s' % oxum)
+        total_bytes = sum(size for __, size in payload)
+        if (int(file_count), int(byte_count)) != (len(payload), total_bytes):
+            return (False, [], 'Oxum error.  Found %s files and %s bytes on disk; expected %s files and %s bytes.' % (len(payload), total_bytes, file_count, byte_count))
+
+    errors = []
+    for rel_path in sorted(set(entries) - set(files)):
+        errors.append(bagit.FileMissing(rel_path))
+    for rel_path, __ in sorted(payload):
+        if rel_path not in entries:
+            errors.append(bagit.UnexpectedFile(rel_path))
+    for rel_path in sorted(set(files) & set(recorded)):
+        for index, name in enumerate(('size', 'mtime')):
+            expected, found = recorded[rel_path][index], files[rel_path][index]
+            if expected is not None and found is not None and expected != found:
+                errors.append(bagit.ChecksumMismatch(rel_path, name, expected, found))
+
+    for error in errors:
+        LOGGER.warning(str(error))
+    if errors:
+        return (False, errors, 'invalid bag')
+    return (True, [], '')
+
+
+def _validate_archived_bag(path):
+    """Validate the bag inside the ZIP, 7z or tar archive at ``path`` in place.
+
+    Returns a tuple of (success, [errors], message). Raises ``bagit.BagError``
+    if the archive does not contain a bag.
+    """
+    return _validate_scanned_bag(path, *_scan_archived_bag(path))
+
+
+def _scan_archived_bag(path, read_budget=None):
+    """Read the bag inside the ZIP, 7z or tar archive at ``path``, once.
+
+    ZIP and 7z archives have an index, so their tag files are read first and
+    every other member is hashed as it is streamed out, with just the
+    algorithms of its own manifest entry. Tar archives can only be read in
+    order: tag files are kept as they are found and every other member is
+    hashed with the algorithms of the manifests read so far or, before any
+    manifest has been read, with all of ``bagit.checksum_algos``.
+
+    Returns a tuple of (prefix, info, entries, members) where the first three
+    are as returned by `_parse_archived_bag_tags` and ``members`` is a dict of
+    archive name -> (size, {algorithm: digest}). Raises ``bagit.BagError`` if
+    the archive does not contain a bag. Reads are paced by ``read_budget`` if
+    given.
+    """
+    indexed = utils.is_indexed_archive(path)
+    if indexed:
+        tag_files = utils.read_archive_files(path, _is_archived_bag_tag_file)
+        prefix, info, entries = _parse_archived_bag_tags(path, tag_files)
+    else:
+        tag_files = {}
+    members = {}  # archive name -> (size, {algorithm: digest})
+    algorithms = set()
+    for name, __, stream in utils.iter_archive_members(path):
+        if stream is None:
+            continue
+        if indexed:
+            if name in tag_files:
+                stream = io.BytesIO(tag_files[name])
+            expected = {}
+            if name.startswith(prefix):
+                expected = entries.get(os.path.normpath(name[len(prefix):]), {})
+            member_algorithms = _supported_algorithms(expected)
+        else:
+            if _is_archived_bag_tag_file(name):
+                tag_files[name] = stream.read()
+                match = re.match(r'(?:tag)?manifest-(\w+)\.txt$', os.path.basename(name))
+                if match:
+                    algorithms.update(_supported_algorithms([match.group(1)]))
+                stream = io.BytesIO(tag_files[name])
+            member_algorithms = algorithms or bagit.checksum_algos
+        members[name] = _hash_stream(stream, member_algorithms, read_budget)
+
+    if not indexed:
+        prefix, info, entries = _parse_archived_bag_tags(path, tag_files)
+    return prefix, info, entries, members
+
+
+def _validate_scanned_bag(path, prefix, info, entries, members,
+                          read_budget=None):
+    """Validate a bag read by `_scan_archived_bag` from the archive at
+    ``path``. Members that could not be hashed with any algorithm of their
+    manifest entry are verified in a second pass over just those files.
+    Failures are reported with the same ``bagit`` error classes
+    ``Bag.validate`` uses.
+
+    Returns a tuple of (success, [errors], message).
+    """
+    errors = []
+    payload_files = payload_bytes = 0
+    seen = set()
+    unverified = {}
+    for name, (size, found) in sorted(members.items()):
+        if not name.startswith(prefix):
+            continue
+        rel_path = os.path.normpath(name[len(prefix):])
+        is_payload = rel_path.startswith('data' + os.sep)
+        expected = entries.get(rel_path, {})
+        if not is_payload and not expected:
+            continue
+        if is_payload:
+            payload_files += 1
+            payload_bytes += size
+            if not expected:
+                errors.append(bagit.UnexpectedFile(rel_path))
+        seen.add(rel_path)
+        found = dict((alg, digest) for alg, digest in found.items()
+                     if alg in expected)
+        if expected and not found:
+            unverified[rel_path] = expected
+        errors.extend(_compare_digests(rel_path, expected, found))
+    for rel_path in sorted(set(entries) - seen):
+        errors.append(bagit.FileMissing(rel_path))
+    if unverified:
+        errors.extend(_verify_archived_bag_files(path, prefix, unverified,
+                                                 read_budget))
+
+    oxum = info.get('Payload-Oxum')
+    if oxum:
+        byte_count, _sep, file_count = oxum.partition('.')
+        if not byte_count.isdigit() or not file_count.isdigit():
+            return (False, [], 'Invalid oxum: %s' % oxum)
+        if (int(file_count), int(byte_count)) != (payload_files, payload_bytes):
+            return (False, [], 'Oxum error.  Found %s files and %s bytes on disk; expected %s files and %s bytes.' % (payload_files, payload_bytes, file_count, byte_count))
+
+    for error in errors:
+        LOGGER.warning(str(error))
+    if errors:
+        return (False, errors, 'invalid bag')
+    return (True, [], '')
+
+
 def _extract_rein_aip(internal_location, rein_aip_internal_path):
     """Extract the reingested AIP (package) at ``rein_aip_internal_path`` and
     return the path to the resulting directory.
@@ -2578,7 +3417,7 @@ def _update_bag_payload_and_verify(old_aip_internal_path):
     # https://github.com/LibraryOfCongress/bagit-python/pull/63
     bag = bagit.Bag(old_aip_internal_path)
     # Raises exception in case of problem
-    bag.validate(processes=settings.BAG_VALIDATION_NO_PROCESSES)
+    _validate_bag(bag)
 
 
 def _replace_old_metdata_with_reingested(rein_aip_internal_path,
@@ -2658,6 +3497,9 @@ def _replicate_package_mdl_inst(package_mdl):
     replica_package.pk = None
     replica_package.uuid = None  # will trigger new UUID generation
     replica_package.replicated_package_id = package_uuid
+    # The replica has not been checked yet
+    replica_package.latest_fixity_check_datetime = None
+    replica_package.latest_fixity_check_result = None
     replica_package.save()
     return replica_package
 
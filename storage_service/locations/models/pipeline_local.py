@@ -1,17 +1,23 @@
 from __future__ import absolute_import
 
 # stdlib, alphabetical
+import hashlib
 import logging
 import os
+import pipes
+import re
 import shutil
 import subprocess
 import tempfile
 
 # Core Django, alphabetical
+from django.conf import settings
+from django.core.cache import cache
 from django.db import models
-from django.utils.translation import ugettext_lazy as _l
+from django.utils.translation import ugettext as _, ugettext_lazy as _l
 
 # Third party dependencies, alphabetical
+import metsrw
 
 # This project, alphabetical
 from common import utils
@@ -21,6 +27,11 @@ from .location import Location
 
 LOGGER = logging.getLogger(__name__)
 
+# Strongest first; each has a matching coreutils ``<algorithm>sum`` command
+REMOTE_FIXITY_ALGORITHMS = ('sha512', 'sha256', 'sha1', 'md5')
+# Exit status of ssh when it fails itself, rather than the remote command
+SSH_ERROR = 255
+
 
 class PipelineLocalFS(models.Model):
     """ Spaces local to the creating machine, but not to the storage service.
@@ -40,6 +51,9 @@ class PipelineLocalFS(models.Model):
         verbose_name=_l("Assume remote host serving files with rsync daemon"),
         help_text=_l("If checked, will use rsync daemon-style commands instead of the default rsync with remote shell transport"))
     rsync_password = models.CharField(max_length=64, blank=True, default="", help_text="RSYNC_PASSWORD value (rsync daemon)")
+    remote_fixity = models.BooleanField(default=False,
+        verbose_name=_l("Check fixity on remote host"),
+        help_text=_l("If checked, fixity checks hash packages on the remote machine over ssh instead of copying them to the Storage Service. Requires the sha*sum/md5sum tools on the remote machine; not available with rsync daemon."))
 
     class Meta:
         verbose_name = _l("Pipeline Local FS")
@@ -73,10 +87,139 @@ class PipelineLocalFS(models.Model):
 
         return return_str.format(user, host, utils.coerce_str(path))
 
+    def _run_remote_command(self, command):
+        """Runs the shell ``command`` on the remote host over ssh and
+        returns its output. Like the rsync moves, this uses ssh's default
+        identity for the storage service user."""
+        ssh_command = ['ssh', '-o', 'BatchMode=yes']
+        ssh_command += utils.ssh_options()
+        ssh_command += ['{}@{}'.format(self.remote_user, self.remote_name),
+                        command]
+        LOGGER.info("ssh command: %s", ssh_command)
+        return subprocess.check_output(ssh_command)
+
+    def check_package_fixity(self, package):
+        """
+        Check fixity of `package` by hashing it on the remote host, so it is
+        not copied to the storage service first. Only the digests are sent
+        back.
+
+        Uncompressed packages are checked against the checksums recorded from
+        their bag manifest (see Package.index_manifest), compressed packages
+        against the checksum in their pointer file. If ssh fails, or nothing
+        could be hashed, the check is reported as not run.
+
+        Raises NotImplementedError if remote fixity is not enabled, the space
+        is served by an rsync daemon (which cannot run commands), or no
+        checksums are recorded for the package, so fixity is checked locally
+        instead.
+        """
+        if not self.remote_fixity or self.assume_rsync_daemon:
+            raise NotImplementedError(
+                _('Remote fixity checks are not enabled for this space'))
+        path = package.full_path
+        if package.pointer_file_path:
+            algorithm, expected = self._pointer_file_checksum(package)
+            command = '{}sum -- {}'.format(algorithm, pipes.quote(utils.coerce_str(path)))
+            names = {path: os.path.basename(path)}
+        else:
+            algorithm, expected = self._manifest_checksums(package)
+            command = 'cd -- {} && find . -type f -print0 | xargs -0 -r {}sum --'.format(
+                pipes.quote(utils.coerce_str(path)), algorithm)
+            names = None
+        try:
+            output = self._run_remote_command(command)
+        except subprocess.CalledProcessError as e:
+            LOGGER.warning('Remote fixity check of %s failed: %s', package.uuid, e)
+            if e.returncode == SSH_ERROR or not e.output:
+                # ssh itself failed, or nothing could be hashed at all, which
+                # says nothing about the package
+                return (None, [], _('Unable to run the fixity check on the remote host'), None)
+            # Hashing the rest carries on if some files are unreadable or gone,
+            # and those are reported missing below
+            output = e.output
+        remote = {}
+        for name, digest in _parse_checksum_output(output):
+            if names is not None:
+                name = names.get(name, name)
+            elif name.startswith('./'):
+                name = name[2:]
+            remote[name] = (digest, None)
+        return package.check_remote_checksums(
+            algorithm, expected, remote, check_unexpected=names is None)
+
+    def _manifest_checksums(self, package):
+        """Returns the strongest algorithm recorded in ``package``'s manifest
+        entries, and its checksums keyed by path."""
+        recorded = set(package.manifest_entries.values_list('algorithm', flat=True))
+        for algorithm in REMOTE_FIXITY_ALGORITHMS:
+            if algorithm in recorded:
+                entries = package.manifest_entries.filter(algorithm=algorithm)
+                return algorithm, dict(
+                    (entry.path, (entry.checksum, entry.size)) for entry in entries)
+        raise NotImplementedError(
+            _('No checksums are recorded for package %(uuid)s') %
+            {'uuid': package.uuid})
+
+    def _pointer_file_checksum(self, package):
+        """Returns the algorithm and checksum of compressed ``package`` from
+        its pointer file, keyed by its file name."""
+        pointer_path = package.full_pointer_file_path
+        if not pointer_path or not os.path.isfile(pointer_path):
+            raise NotImplementedError(
+                _('Pointer file for package %(uuid)s not found') %
+                {'uuid': package.uuid})
+        fsentry = metsrw.METSDocument.fromfile(pointer_path).get_file(
+            file_uuid=package.uuid)
+        if fsentry is None or not fsentry.get_premis_objects():
+            raise NotImplementedError(
+                _('No checksum for package %(uuid)s in its pointer file') %
+                {'uuid': package.uuid})
+        premis_object = fsentry.get_premis_objects()[0]
+        algorithm = premis_object.message_digest_algorithm.lower().replace('-', '')
+        if algorithm not in REMOTE_FIXITY_ALGORITHMS:
+            raise NotImplementedError(
+                _('Cannot check %(algorithm)s checksums on remote host') %
+                {'algorithm': algorithm})
+        name = os.path.basename(package.full_path)
+        return algorithm, {name: (premis_object.message_digest, None)}
+
+    def _browse_cache_key(self, path):
+        """Return the cache key of the listing of directory ``path``."""
+        path = os.path.join(path, '')
+        digest = hashlib.md5(utils.coerce_str(path)).hexdigest()
+        return 'pipeline_local:{}:browse:{}'.format(self.space_id, digest)
+
+    def _forget_listings(self, path):
+        """Drop the cached listings of ``path`` and all its ancestors, after
+        it changed."""
+        keys = []
+        path = path.rstrip('/')
+        while path not in ('', '/'):
+            keys.append(self._browse_cache_key(path))
+            path = os.path.dirname(path)
+        keys.append(self._browse_cache_key(path))
+        cache.delete_many(keys)
+
     def browse(self, path):
+        """
+        Lists ``path`` on the remote host with rsync.
+
+        Listings are cached for settings.RSYNC_BROWSE_CACHE_TTL seconds, so
+        clicking around a directory tree doesn't list it again each time.
+        """
         path = os.path.join(path, '')
+        cache_key = self._browse_cache_key(path)
+        objects = cache.get(cache_key)
+        if objects is not None:
+            return objects
         ssh_path = self._format_host_path(path)
-        return self.space.browse_rsync(ssh_path, assume_rsync_daemon=self.assume_rsync_daemon, rsync_password=self.rsync_password)
+        objects = self.space.browse_rsync(ssh_path, assume_rsync_daemon=self.assume_rsync_daemon, rsync_password=self.rsync_password)
+        # browse_rsync returns an empty listing if rsync failed, which may
+        # only be temporary
+        if objects['entries']:
+            cache.set(cache_key, objects, settings.RSYNC_BROWSE_CACHE_TTL)
+        return objects
 
     def delete_path(self, delete_path):
         # Sync from an empty directory to delete the contents of delete_path;
@@ -97,6 +240,7 @@ class PipelineLocalFS(models.Model):
             raise
         finally:
             shutil.rmtree(temp_dir)
+            self._forget_listings(delete_path)
 
     def move_to_storage_service(self, src_path, dest_path, dest_space):
         """ Moves src_path to dest_space.staging_path/dest_path. """
@@ -129,10 +273,33 @@ class PipelineLocalFS(models.Model):
     def move_from_storage_service(self, source_path, destination_path, package=None):
         """ Moves self.staging_path/src_path to dest_path. """
 
-        self.space.create_rsync_directory(destination_path, self.remote_user, self.remote_name)
+        try:
+            self.space.create_rsync_directory(destination_path, self.remote_user, self.remote_name)
+
+            # Prepend user and host to destination
+            host_path = self._format_host_path(destination_path)
+
+            # Move file
+            return self.space.move_rsync(source_path, host_path, assume_rsync_daemon=self.assume_rsync_daemon, rsync_password=self.rsync_password)
+        finally:
+            self._forget_listings(destination_path)
+
 
-        # Prepend user and host to destination
-        destination_path = self._format_host_path(destination_path)
+def _parse_checksum_output(output):
+    """Yields (path, digest) from the output of a coreutils ``*sum`` command.
 
-        # Move file
-        return self.space.move_rsync(source_path, destination_path, assume_rsync_daemon=self.assume_rsync_daemon, rsync_password=self.rsync_password)
+    Lines for paths containing a backslash or newline start with a backslash,
+    and those characters are escaped in the path."""
+    for line in output.split('\n'):
+        if not line:
+            continue
+        escaped = line.startswith('\\')
+        if escaped:
+            line = line[1:]
+        digest, _sep, path = line.partition('  ')
+        if not path:
+            # Binary mode lines are "digest *path"
+            digest, _sep, path = line.partition(' *')
+        if escaped:
+            path = re.sub(r'\\(.)', lambda m: '\n' if m.group(1) == 'n' else m.group(1), path)
+        yield path.decode('utf-8'), digest.lower()
@@ -1,6 +1,7 @@
 # stdlib, alphabetical
 import datetime
 import errno
+import fnmatch
 import logging
 import os
 import re
@@ -8,6 +9,7 @@ import shutil
 import stat
 import subprocess
 import tempfile
+import time
 
 # Core Django, alphabetical
 from django.core.exceptions import ValidationError
@@ -16,6 +18,10 @@ from django.utils.translation import ugettext as _, ugettext_lazy as _l
 
 # Third party dependencies, alphabetical
 from django_extensions.db.fields import UUIDField
+try:
+    from os import scandir, walk  # Python 3.5+, where walk uses scandir
+except ImportError:
+    from scandir import scandir, walk
 
 # This project, alphabetical
 from common import utils
@@ -23,9 +29,15 @@ LOGGER = logging.getLogger(__name__)
 
 # This module, alphabetical
 from . import StorageException  # noqa: E402
+from .directory_stats import DirectoryStats  # noqa: E402
 
 __all__ = ('Space', )
 
+# Properties browse results can be sorted by, besides the entries' names
+BROWSE_SORT_KEYS = ('name', 'size', 'timestamp')
+# Keyword arguments of Space.browse handled by filter_browse_dict
+BROWSE_OPTIONS = ('prefix', 'glob', 'sort', 'reverse', 'offset', 'limit')
+
 
 def validate_space_path(path):
     """ Validation for path in Space.  Must be absolute. """
@@ -233,15 +245,22 @@ class Space(models.Model):
         'verbose name': Verbose name of the object
         See each Space's browse for details.
 
+        The entries can be filtered, sorted and paginated the same way in
+        every Space with the keyword arguments of ``filter_browse_dict``, and
+        the result then also has a 'meta' dictionary with the 'offset',
+        'limit' and 'total_count' (the number of matching entries).
+
         :param str path: Full path to return info for
         :return: Dictionary of object information detailed above.
         """
         LOGGER.info('path: %s', path)
+        options = {key: kwargs.pop(key) for key in BROWSE_OPTIONS if key in kwargs}
         try:
-            return self.get_child_space().browse(path, *args, **kwargs)
+            objects = self.get_child_space().browse(path, *args, **kwargs)
         except AttributeError:
             LOGGER.debug('Falling back to default browse local', exc_info=False)
-            return self.browse_local(path)
+            return self.browse_local(path, **options)
+        return filter_browse_dict(objects, **options)
 
     def delete_path(self, delete_path, *args, **kwargs):
         """
@@ -463,8 +482,11 @@ class Space(models.Model):
         # Rsync file over
         # TODO Do this asyncronously, with restarting failed attempts
         command = ['rsync', '-t', '-O', '--protect-args', '-vv',
-                   '--chmod=Fug+rw,o-rwx,Dug+rwx,o-rwx',
-                   '-r', source, destination]
+                   '--chmod=Fug+rw,o-rwx,Dug+rwx,o-rwx', '-r']
+        if not assume_rsync_daemon:
+            # Share ssh connections to remote hosts
+            command += ['--rsh', utils.rsync_rsh()]
+        command += [source, destination]
         LOGGER.info("rsync command: %s", command)
         kwargs = {'stdout': subprocess.PIPE, 'stderr': subprocess.STDOUT}
         if assume_rsync_daemon:
@@ -518,47 +540,47 @@ class Space(models.Model):
         :param user: Username on remote host
         :param host: Hostname of remote host
         """
-        # Assemble a set of directories to create on the remote server;
-        # these will be created one at a time
-        directories = []
-        path = destination_path
-        while path != '' and path != '/':
-            directories.insert(0, path)
-            path = os.path.dirname(path)
-
-        # Syncing an empty directory will ensure no files get transferred
-        temp_dir = os.path.join(tempfile.mkdtemp(), '')
-
-        # Creates the destination_path directory without copying any files
-        # Dir must end in a / for rsync to create it
-        for directory in directories:
-            path = os.path.join(os.path.dirname(directory), '')
-            path = "{}@{}:{}".format(user, host, utils.coerce_str(path))
-            cmd = ['rsync', '-vv', '--protect-args', '--chmod=ug=rwx,o=rx', '--recursive', temp_dir, path]
+        directory = os.path.dirname(destination_path)
+        if directory in ('', '/'):
+            return
+
+        # Build the directory structure in an empty temporary directory and
+        # sync it to the remote root, so every missing directory is created
+        # in one round trip without copying any files.
+        temp_dir = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(temp_dir, utils.coerce_str(directory).lstrip('/')))
+            root = '/' if directory.startswith('/') else ''
+            path = "{}@{}:{}".format(user, host, root)
+            cmd = ['rsync', '-vv', '--protect-args', '--chmod=ug=rwx,o=rx',
+                   '--recursive', '--rsh', utils.rsync_rsh(),
+                   os.path.join(temp_dir, ''), path]
             LOGGER.info("rsync path creation command: %s", cmd)
             try:
                 subprocess.check_call(cmd)
             except subprocess.CalledProcessError as e:
-                shutil.rmtree(temp_dir)
                 LOGGER.warning("rsync path creation failed: %s", e)
                 raise
+        finally:
+            shutil.rmtree(temp_dir)
 
-        shutil.rmtree(temp_dir)
-
-    def browse_local(self, path):
+    def browse_local(self, path, **options):
         """
         Returns browse results for a locally accessible filesystem.
 
         Properties provided:
         'size': Size of the object, as determined by os.path.getsize. May be misleading for directories, suggest use 'object count'
         'object count': Number of objects in the directory, including children
+
+        :param options: Filters, sort order and page, see filter_browse_dict.
         """
         if isinstance(path, unicode):
             path = str(path)
         if not os.path.exists(path):
             LOGGER.info('%s in %s does not exist', path, self)
-            return {'directories': [], 'entries': [], 'properties': {}}
-        return path2browse_dict(path)
+            return filter_browse_dict(
+                {'directories': [], 'entries': [], 'properties': {}}, **options)
+        return path2browse_dict(path, **options)
 
     def browse_rsync(self, path, ssh_key=None, assume_rsync_daemon=False, rsync_password=None):
         """
@@ -586,8 +608,8 @@ class Space(models.Model):
                    '--exclude', '.*',  # Ignore hidden files
                    ]
         if not assume_rsync_daemon:
-            # Specify identity file
-            command += ['--rsh', 'ssh -i ' + ssh_key]
+            # Specify identity file, and share the connection
+            command += ['--rsh', utils.rsync_rsh(ssh_key)]
         command += [path]
 
         LOGGER.info('rsync list command: %s', command)
@@ -601,6 +623,7 @@ class Space(models.Model):
             LOGGER.warning("rsync list failed: %s", e, exc_info=True)
             entries = []
             directories = []
+            properties = {}
         else:
             output = output.splitlines()
             # Output is lines in format:
@@ -633,7 +656,8 @@ class Space(models.Model):
         entries = sorted(entries, key=lambda s: s.lower())
         LOGGER.debug('entries: %s', entries)
         LOGGER.debug('directories: %s', directories)
-        return {'directories': directories, 'entries': entries}
+        return {'directories': directories, 'entries': entries,
+                'properties': properties}
 
     def _delete_path_local(self, delete_path):
         """
@@ -649,35 +673,153 @@ class Space(models.Model):
             raise
 
 
-def path2browse_dict(path):
+def path2browse_dict(path, object_counting_disabled=None, **options):
     """Given a path on disk, return a dict with keys for directories, entries
     and properties.
+
+    Entries are read from the browse index (see DirectoryStats) if it is up to
+    date for ``path``, and otherwise listed with scandir, so whether they are
+    directories comes from the directory listing instead of a stat call, where
+    the filesystem allows. Sizes aren't indexed: with the index, only the
+    entries of the requested page are statted, unless sorting by size. Objects
+    are only counted in the directories of the requested page, from the index
+    where possible.
+
+    :param bool object_counting_disabled: Whether to skip counting objects in
+        directories. If None, looked up in the 'object_counting_disabled'
+        setting.
+    :param options: Filters, sort order and page, see filter_browse_dict.
     """
+    start = time.time()
+    if object_counting_disabled is None:
+        object_counting_disabled = utils.get_setting('object_counting_disabled', False)
     properties = {}
-    # Sorted list of all entries in directory, excluding hidden files
-    entries = [name for name in os.listdir(path) if name[0] != '.']
-    entries = sorted(entries, key=lambda s: s.lower())
     directories = []
-    for name in entries:
-        full_path = os.path.join(path, name)
-        properties[name] = {'size': os.path.getsize(full_path)}
-        if utils.get_setting('object_counting_disabled', False):
-            properties[name]['object count'] = '0+'
-        elif os.path.isdir(full_path) and os.access(full_path, os.R_OK):
-            directories.append(name)
-            properties[name]['object count'] = count_objects_in_directory(
-                full_path)
-    return {'directories': directories,
-            'entries': entries,
-            'properties': properties}
+    indexed = DirectoryStats.get_listing(path)
+    stat_page = indexed is not None and options.get('sort') != 'size'
+    if indexed is not None:
+        names = []
+        for name, is_browsable_dir in indexed.items():
+            if name[0] == '.':
+                continue
+            # The index is keyed by unicode names, browse results use str
+            name = utils.coerce_str(name)
+            names.append(name)
+            properties[name] = {}
+            if is_browsable_dir:
+                directories.append(name)
+        if not stat_page:
+            _add_sizes(path, properties, names)
+    else:
+        # All entries in directory, excluding hidden files
+        dir_entries = [entry for entry in scandir(path) if entry.name[0] != '.']
+        names = [entry.name for entry in dir_entries]
+        for entry in dir_entries:
+            properties[entry.name] = {'size': entry.stat().st_size}
+            if entry.is_dir() and os.access(entry.path, os.R_OK):
+                directories.append(entry.name)
+    objects = filter_browse_dict(
+        {'directories': directories, 'entries': names, 'properties': properties},
+        **options)
+    if stat_page:
+        _add_sizes(path, objects['properties'], objects['entries'])
+    if object_counting_disabled:
+        for name in objects['directories']:
+            objects['properties'][name]['object count'] = '0+'
+    else:
+        paths = {name: os.path.join(path, name) for name in objects['directories']}
+        counts = DirectoryStats.get_indexed_file_counts(paths.values())
+        for name, dir_path in paths.items():
+            count = counts.get(dir_path)
+            if count is None:
+                count = count_objects_in_directory(dir_path)
+            objects['properties'][name]['object count'] = count
+    LOGGER.info('Browsed %s: %d entries in %.3fs%s', path, len(names),
+                time.time() - start, ' (indexed)' if indexed is not None else '')
+    return objects
+
+
+def _add_sizes(path, properties, names):
+    """Set the 'size' property of each of ``names`` in directory ``path``."""
+    for name in names:
+        try:
+            properties[name]['size'] = os.stat(os.path.join(path, name)).st_size
+        except OSError:  # E.g. removed since indexed, or a broken symlink
+            pass
+
+
+def filter_browse_dict(objects, prefix=None, glob=None, sort='name',
+                       reverse=False, offset=0, limit=None):
+    """
+    Filter, sort and paginate the browse results ``objects`` of any Space.
+
+    Returns a new browse dict with only the page of matching entries, their
+    directories and properties, and a 'meta' dict with the 'offset', 'limit'
+    and 'total_count' of matching entries, so that clients can page lazily
+    through huge directories.
+
+    :param str prefix: Only entries whose names start with this.
+    :param str glob: Only entries whose names match this shell-style pattern.
+    :param str sort: 'name' to sort case-insensitively by name, or a property
+        in BROWSE_SORT_KEYS. Entries without that property are sorted last,
+        by name.
+    :param bool reverse: Whether to sort in descending order.
+    :param int offset: Number of matching entries to skip.
+    :param int limit: Maximum number of entries to return. None for all.
+    """
+    if sort not in BROWSE_SORT_KEYS:
+        raise ValueError(_('Cannot sort by %(sort)s') % {'sort': sort})
+    properties = objects.get('properties', {})
+    entries = objects['entries']
+    # Names may be str or unicode, depending on the space; compare as str
+    if prefix:
+        prefix = utils.coerce_str(prefix)
+        entries = [name for name in entries
+                   if utils.coerce_str(name).startswith(prefix)]
+    if glob:
+        glob = utils.coerce_str(glob)
+        entries = [name for name in entries
+                   if fnmatch.fnmatchcase(utils.coerce_str(name), glob)]
+
+    if sort == 'name':
+        entries = sorted(entries, key=lambda name: name.lower(), reverse=reverse)
+    else:
+        with_key = [name for name in entries
+                    if properties.get(name, {}).get(sort) is not None]
+        without_key = [name for name in entries
+                       if properties.get(name, {}).get(sort) is None]
+        entries = sorted(
+            with_key, key=lambda name: (properties[name][sort], name.lower()),
+            reverse=reverse)
+        entries += sorted(without_key, key=lambda name: name.lower())
+
+    total_count = len(entries)
+    end = None if limit is None else offset + limit
+    entries = entries[offset:end]
+    directories = set(objects['directories'])
+    return {
+        'entries': entries,
+        'directories': [name for name in entries if name in directories],
+        'properties': {name: dict(properties[name]) for name in entries
+                       if name in properties},
+        'meta': {'offset': offset, 'limit': limit, 'total_count': total_count},
+    }
 
 
 def count_objects_in_directory(path):
     """
-    Returns all the files in a directory, including children.
+    Returns the number of files in a directory, including children.
+
+    The exact count is served from the DirectoryStats cache when it is up to
+    date. Otherwise the cache is refreshed in the background, and a quick count
+    capped at 5000 is returned meanwhile.
     """
+    file_count = DirectoryStats.get_file_count(path)
+    if file_count is not None:
+        return file_count
+    DirectoryStats.refresh_in_background(path)
     total_files = 0
-    for root, dirs, files in os.walk(path):
+    for root, dirs, files in walk(path):
         total_files += len(files)
         # Limit the number of files counted to keep it from being too slow
         if total_files > 5000:
@@ -111,6 +111,34 @@ class Swift(models.Model):
             'properties': properties,
         }
 
+    def check_package_fixity(self, package):
+        """
+        Check fixity of `package` against the MD5 ETags Swift keeps for every
+        object, without downloading it. See Package.check_remote_md5s.
+
+        Raises NotImplementedError if no MD5s were recorded for the package,
+        so fixity is checked locally instead.
+        """
+        package.get_recorded_md5s()  # Fall back before listing anything
+        path = package.full_path
+        if package.stored_md5:
+            try:
+                headers = self.connection.head_object(self.container, path)
+            except swiftclient.exceptions.ClientException:
+                LOGGER.warning('Package %s not found in Swift at %s', package.uuid, path)
+                remote = {}
+            else:
+                remote = {os.path.basename(path): (
+                    headers.get('etag'), int(headers['content-length']))}
+        else:
+            prefix = os.path.join(path, '')
+            _, content = self.connection.get_container(
+                self.container, prefix=prefix, full_listing=True)
+            remote = dict(
+                (entry['name'][len(prefix):], (entry.get('hash'), entry.get('bytes')))
+                for entry in content if entry.get('name'))
+        return package.check_remote_md5s(remote)
+
     def delete_path(self, delete_path):
         # Try to delete object
         try:
@@ -172,35 +200,52 @@ class Swift(models.Model):
                 dest = entry.replace(src_path, dest_path, 1)
                 self._download_file(entry, dest)
 
+    def _upload_file(self, source_path, destination_path):
+        """
+        Upload the file source_path to destination_path in Swift and return
+        its MD5.
+
+        The file is read only once: it is hashed while it is sent, and the
+        ETag Swift computed for the new object is compared with the hash
+        afterwards instead of being sent with the upload. An object that does
+        not match is deleted.
+
+        :raises: StorageException if the ETag does not match
+        """
+        with open(source_path, 'rb') as f:
+            contents = swiftclient.utils.LengthWrapper(
+                f, os.path.getsize(source_path), md5=True)
+            etag = self.connection.put_object(
+                self.container,
+                obj=destination_path,
+                contents=contents,
+                content_length=len(contents),
+            )
+        md5 = contents.get_md5sum()
+        if etag != md5:
+            message = _('ETag %(remote_path)s for %(etag)s does not match %(checksum)s') % {'remote_path': destination_path, 'etag': etag, 'checksum': md5}
+            LOGGER.warning(message)
+            self.connection.delete_object(self.container, destination_path)
+            raise StorageException(message)
+        return md5
+
     def move_from_storage_service(self, source_path, destination_path, package=None):
         """ Moves self.staging_path/src_path to dest_path. """
         if os.path.isdir(source_path):
             # Both source and destination paths should end with /
             destination_path = os.path.join(destination_path, '')
+            if package is not None:
+                package.clear_stored_md5()
             # Swift does not accept folders, so upload each file individually
             for path, dirs, files in os.walk(source_path):
                 for basename in files:
                     entry = os.path.join(path, basename)
                     dest = entry.replace(source_path, destination_path, 1)
-                    checksum = utils.generate_checksum(entry)
-                    with open(entry, 'rb') as f:
-                        self.connection.put_object(
-                            self.container,
-                            obj=dest,
-                            contents=f,
-                            etag=checksum.hexdigest(),
-                            content_length=os.path.getsize(entry)
-                        )
+                    self._upload_file(entry, dest)
         elif os.path.isfile(source_path):
-            checksum = utils.generate_checksum(source_path)
-            with open(source_path, 'rb') as f:
-                self.connection.put_object(
-                    self.container,
-                    obj=destination_path,
-                    contents=f,
-                    etag=checksum.hexdigest(),
-                    content_length=os.path.getsize(source_path),
-                )
+            md5 = self._upload_file(source_path, destination_path)
+            if package is not None:
+                package.record_stored_md5(md5)
         else:
             raise StorageException(
                 _('%(path)s is neither a file nor a directory, may not exist') %
@@ -44,18 +44,31 @@ Package location: %(location)s""") % {'pipeline': kwargs['pipeline'], 'uuid': kw
     _notify_administrators(subject, message)
 
 
-def _log_report(uuid, success, message=None):
+def _log_report(uuid, success, message=None, check_level=None, sender=None):
     # NOTE Importing this at the top of the module fails because this file is
     # imported in models.__init__.py and seems to cause a circular import error
     from . import models
     package = models.Package.objects.get(uuid=uuid)
-    models.FixityLog.objects.create(package=package, success=success, error_details=message)
+    log = models.FixityLog.objects.create(
+        package=package, success=success, error_details=message,
+        check_level=check_level or models.FixityLog.FULL)
+    # Keep the package's copy of its latest result up to date, including on
+    # the instance that sent the signal in case it is saved again later
+    latest = {
+        'latest_fixity_check_datetime': log.datetime_reported,
+        'latest_fixity_check_result': success,
+    }
+    models.Package.objects.filter(uuid=uuid).update(**latest)
+    if isinstance(sender, models.Package) and sender.uuid == uuid:
+        for attr, value in latest.items():
+            setattr(sender, attr, value)
 
 
 @receiver(failed_fixity_check, dispatch_uid="fixity_check")
 def report_failed_fixity_check(sender, **kwargs):
     report_data = json.loads(kwargs['report'])
-    _log_report(kwargs['uuid'], False, report_data['message'])
+    _log_report(kwargs['uuid'], False, report_data['message'],
+                report_data.get('check_level'), sender=sender)
 
     subject = _('Fixity check failed for package %(uuid)s') % {'uuid': kwargs['uuid']}
     message = _("""
@@ -70,14 +83,17 @@ Full failure report (in JSON format):
 
 @receiver(successful_fixity_check, dispatch_uid="fixity_check")
 def report_successful_fixity_check(sender, **kwargs):
-    _log_report(kwargs['uuid'], True)
+    report_data = json.loads(kwargs['report'])
+    _log_report(kwargs['uuid'], True,
+                check_level=report_data.get('check_level'), sender=sender)
 
 
 @receiver(fixity_check_not_run, dispatch_uid="fixity_check")
 def report_not_run_fixity_check(sender, **kwargs):
     """Handle a fixity not run signal."""
     report_data = json.loads(kwargs['report'])
-    _log_report(uuid=kwargs['uuid'], success=None, message=report_data['message'])
+    _log_report(uuid=kwargs['uuid'], success=None, message=report_data['message'],
+                check_level=report_data.get('check_level'), sender=sender)
 
 
 # Create an API key for every user, for TastyPie
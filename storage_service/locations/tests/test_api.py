@@ -2,9 +2,12 @@ import base64
 import json
 import os
 import shutil
+
+import mock
 import vcr
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
 from django.utils.six.moves.urllib.parse import urlparse
 
@@ -77,12 +80,40 @@ class TestLocationAPI(TestCase):
         # Verify error
         assert response.status_code == 404
 
+    @mock.patch('locations.models.DirectoryStats.refresh_in_background')
+    def test_browse_paginated(self, mock_refresh):
+        models.Location.objects.filter(uuid='615103f0-0ee0-4a12-ba17-43192d1143ea').update(relative_path=FIXTURES_DIR[1:])
+        url = '/api/v2/location/615103f0-0ee0-4a12-ba17-43192d1143ea/browse/'
+        params = {'prefix': base64.b64encode('working_bag'), 'order_by': '-name', 'limit': 2}
+        response = self.client.get(url, params)
+        assert response.status_code == 200
+        body = json.loads(response.content)
+        assert map(base64.b64decode, body['entries']) == ['working_bag.zip', 'working_bag.7z']
+        assert body['directories'] == []
+        assert body['meta'] == {'offset': 0, 'limit': 2, 'total_count': 3}
+
+        params['offset'] = 2
+        body = json.loads(self.client.get(url, params).content)
+        assert map(base64.b64decode, body['directories']) == ['working_bag']
+        assert body['properties'][base64.b64encode('working_bag')]['object count'] == 5
+
+        glob = base64.b64encode('*.z?p')
+        body = json.loads(self.client.get(url, {'glob': glob, 'order_by': 'size'}).content)
+        assert map(base64.b64decode, body['entries']) == ['working_bag.zip', 'small_compressed_bag.zip']
+
+        response = self.client.get(url, {'order_by': 'color'})
+        assert response.status_code == 400
+        response = self.client.get(url, {'limit': -1})
+        assert response.status_code == 400
+
 
 class TestPackageAPI(TestCase):
 
     fixtures = ['base.json', 'package.json', 'arkivum.json']
 
     def setUp(self):
+        # Arkivum responses are cached between requests
+        cache.clear()
         self.test_location = models.Location.objects.get(uuid='615103f0-0ee0-4a12-ba17-43192d1143ea')
         # Set up locations to point to fixtures directory
         self.test_location.relative_path = FIXTURES_DIR[1:]
@@ -279,6 +310,15 @@ class TestPackageAPI(TestCase):
         content = ''.join(response.streaming_content)  # Convert to one string
         assert content == 'test'
 
+    def test_download_file_not_in_manifest(self):
+        """ It should not extract files the manifest index doesn't list. """
+        package = models.Package.objects.get(uuid='6aebdb24-1b6b-41ab-b4a3-df9a73726a34')
+        package.index_manifest()
+        with mock.patch.object(models.Package, 'extract_file') as extract_file:
+            response = self.client.get('/api/v2/file/6aebdb24-1b6b-41ab-b4a3-df9a73726a34/extract_file/', data={'relative_path_to_file': 'working_bag/data/dne.txt'})
+        assert response.status_code == 404
+        assert not extract_file.called
+
     def test_download_file_from_uncompressed(self):
         """ It should return the file. """
         response = self.client.get('/api/v2/file/0d4e739b-bf60-4b87-bc20-67a379b28cea/extract_file/', data={'relative_path_to_file': 'working_bag/data/test.txt'})
@@ -306,6 +346,34 @@ class TestPackageAPI(TestCase):
         assert j['error'] is True
         assert 'Error' in j['message'] and 'Arkivum' in j['message']
 
+    def test_bulk_check_fixity(self):
+        """ It should check every package matching the filters and stream a report. """
+        models.Package.objects.exclude(
+            uuid__in=('0d4e739b-bf60-4b87-bc20-67a379b28cea', '9f260047-a9b7-4a75-bb6a-e8d94c83edd2'),
+        ).filter(current_location_id='615103f0-0ee0-4a12-ba17-43192d1143ea').update(status=models.Package.DELETED)
+        response = self.client.get('/api/v2/file/check_fixity/', {
+            'location': '615103f0-0ee0-4a12-ba17-43192d1143ea'})
+        assert response.status_code == 200
+        assert response.streaming
+        report = json.loads(b''.join(response.streaming_content))
+        results = dict((row['uuid'], row) for row in report['packages'])
+        assert results['0d4e739b-bf60-4b87-bc20-67a379b28cea']['success'] is True
+        assert results['9f260047-a9b7-4a75-bb6a-e8d94c83edd2']['success'] is False
+        assert results['9f260047-a9b7-4a75-bb6a-e8d94c83edd2']['missing'] == 1
+        assert report['summary'] == {'total': 2, 'passed': 1, 'failed': 1, 'not_checked': 0}
+        assert models.FixityLog.objects.filter(
+            package_id='9f260047-a9b7-4a75-bb6a-e8d94c83edd2', success=False).exists()
+
+        # Recently checked packages are skipped with min_age, and CSV is supported
+        response = self.client.get('/api/v2/file/check_fixity/', {
+            'location': '615103f0-0ee0-4a12-ba17-43192d1143ea', 'min_age': 1, 'format': 'csv'})
+        assert response.status_code == 200
+        assert b''.join(response.streaming_content).splitlines() == [
+            'uuid,location,path,check_level,success,message,missing,changed,untracked,error']
+
+        response = self.client.get('/api/v2/file/check_fixity/', {'format': 'xml'})
+        assert response.status_code == 400
+
 
 class TestSwordAPI(TestCase):
 
@@ -3,7 +3,9 @@ import requests
 import shutil
 import vcr
 
+from django.core.cache import cache
 from django.test import TestCase
+import mock
 
 from locations import models
 
@@ -22,6 +24,7 @@ class TestArkivum(TestCase):
     fixtures = ['base.json', 'arkivum.json']
 
     def setUp(self):
+        cache.clear()
         self.arkivum_object = models.Arkivum.objects.all()[0]
         self.arkivum_object.space.path = FIXTURES_DIR
         self.arkivum_object.space.staging_path = FIXTURES_DIR
@@ -178,3 +181,18 @@ class TestArkivum(TestCase):
         self.arkivum_object.update_package_status(self.uncompressed_package)
         # Verify UPLOADED
         assert self.uncompressed_package.status == models.Package.UPLOADED
+
+    def test_is_file_local_cached(self):
+        """It should only ask Arkivum once per cache period."""
+        self.package.misc_attributes.update({'arkivum_identifier': '2e75c8ad-cded-4f7e-8ac7-85627a116e39'})
+        response = mock.Mock(status_code=200, text='')
+        response.json.return_value = {'fileInformation': {'local': True}}
+        session = mock.Mock()
+        session.get.return_value = response
+        with mock.patch.object(models.Arkivum, '_get_session', return_value=session):
+            assert self.arkivum_object.is_file_local(self.package) is True
+            assert self.arkivum_object.is_file_local(self.package) is True
+            assert session.get.call_count == 1
+            # Status updates always ask Arkivum
+            self.arkivum_object.update_package_status(self.package)
+            assert session.get.call_count == 2
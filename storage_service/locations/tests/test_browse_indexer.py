@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+import mock
+import pytest
+
+from locations import models
+from locations.models import space
+
+TRANSFER_SOURCE = '4056b25d-6a85-4557-b9a5-9c85565fd892'
+AIP_STORAGE = '99536e72-97af-4f0c-811e-06160a995c36'
+
+
+class TestBrowseIndexer(TestCase):
+
+    fixtures = ['base.json']
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        for directory in ('transfer/objects/sub', 'empty'):
+            os.makedirs(os.path.join(self.tmp_dir, directory))
+        for path in ('transfer/a.txt', 'transfer/objects/b.txt', 'transfer/objects/sub/c.txt', '.hidden.txt'):
+            with open(os.path.join(self.tmp_dir, path), 'w') as f:
+                f.write('abc')
+        # Indexed listings of just changed directories aren't trusted
+        past = time.time() - 60
+        for root, __, __ in os.walk(self.tmp_dir):
+            os.utime(root, (past, past))
+        models.Location.objects.filter(uuid=TRANSFER_SOURCE).update(relative_path=self.tmp_dir[1:])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_browse_from_index(self):
+        """It should index the location so browsing doesn't list or count live."""
+        call_command('browse_indexer', locations=[TRANSFER_SOURCE], once=True)
+        transfer = os.path.join(self.tmp_dir, 'transfer')
+        stats = models.DirectoryStats.objects.get(path=transfer)
+        assert stats.total_file_count == 3
+        assert stats.entries == {'a.txt': False, 'objects': True}
+
+        with mock.patch('locations.models.space.scandir') as mock_scandir, \
+                mock.patch('locations.models.space.count_objects_in_directory') as mock_count:
+            ret = space.path2browse_dict(self.tmp_dir, object_counting_disabled=False)
+            assert space.path2browse_dict(transfer, object_counting_disabled=False)['properties']['objects'] == {
+                'size': os.stat(os.path.join(transfer, 'objects')).st_size, 'object count': 2}
+        assert not mock_scandir.called
+        assert not mock_count.called
+        assert ret['entries'] == ['empty', 'transfer']
+        assert ret['directories'] == ['empty', 'transfer']
+        assert ret['properties']['transfer']['object count'] == 3
+
+        # Changed directories are listed live until indexed again
+        with open(os.path.join(transfer, 'new.txt'), 'w') as f:
+            f.write('new')
+        with mock.patch('locations.models.DirectoryStats.refresh_in_background'):
+            ret = space.path2browse_dict(transfer, object_counting_disabled=False)
+        assert ret['entries'] == ['a.txt', 'new.txt', 'objects']
+        call_command('browse_indexer', locations=[TRANSFER_SOURCE], once=True)
+        assert models.DirectoryStats.objects.get(path=transfer).total_file_count == 4
+
+        # Counts aren't taken from the index once anything below has changed
+        with open(os.path.join(transfer, 'objects/sub/d.txt'), 'w') as f:
+            f.write('new')
+        with mock.patch('locations.models.DirectoryStats.refresh_in_background'):
+            ret = space.path2browse_dict(self.tmp_dir, object_counting_disabled=False)
+        assert ret['properties']['transfer']['object count'] == 5
+
+    def test_only_local_transfer_sources(self):
+        """It should only index local transfer source and backlog locations."""
+        with pytest.raises(CommandError):
+            call_command('browse_indexer', locations=[AIP_STORAGE], once=True)
+        models.Space.objects.update(access_protocol=models.Space.DURACLOUD)
+        with pytest.raises(CommandError):
+            call_command('browse_indexer', locations=[TRANSFER_SOURCE], once=True)
+        assert not models.DirectoryStats.objects.exists()
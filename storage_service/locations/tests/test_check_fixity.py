@@ -0,0 +1,43 @@
+import csv
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from locations import models
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.abspath(os.path.join(THIS_DIR, '..', 'fixtures', ''))
+
+WORKING_BAG = '0d4e739b-bf60-4b87-bc20-67a379b28cea'
+BROKEN_BAG = '9f260047-a9b7-4a75-bb6a-e8d94c83edd2'
+
+
+class TestCheckFixity(TestCase):
+
+    fixtures = ['base.json', 'package.json']
+
+    def setUp(self):
+        models.Location.objects.filter(uuid='615103f0-0ee0-4a12-ba17-43192d1143ea').update(relative_path=FIXTURES_DIR[1:])
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_check_fixity_csv_report(self):
+        """It should check the packages matching the filters and write a report."""
+        models.Package.objects.filter(uuid=BROKEN_BAG).update(status=models.Package.DEL_REQ)
+        output = os.path.join(self.tmp_dir, 'report.csv')
+        stderr = StringIO()
+        call_command('check_fixity', location='615103f0-0ee0-4a12-ba17-43192d1143ea',
+                     statuses=[models.Package.DEL_REQ], format='csv', output=output,
+                     stderr=stderr)
+        with open(output) as f:
+            rows = list(csv.DictReader(f))
+        assert [(row['uuid'], row['check_level'], row['success'], row['missing']) for row in rows] == [
+            (BROKEN_BAG, 'full', 'False', '1')]
+        assert stderr.getvalue().startswith('[1/1] ' + BROKEN_BAG)
+        assert not models.FixityLog.objects.filter(package_id=WORKING_BAG).exists()
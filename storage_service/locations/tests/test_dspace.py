@@ -1,6 +1,13 @@
+import io
 import os
+import shutil
+import stat
+import tarfile
+import tempfile
+import zipfile
 
 from django.test import TestCase
+import pytest
 import vcr
 
 from locations import models
@@ -78,7 +85,19 @@ class TestDSpace(TestCase):
         assert len(split_paths) == 2
         assert os.path.join(FIXTURES_DIR, 'objects.zip') in split_paths
         assert os.path.join(FIXTURES_DIR, 'metadata.zip') in split_paths
-        # TODO verify contents
+        with zipfile.ZipFile(os.path.join(FIXTURES_DIR, 'objects.zip')) as objects_zip:
+            assert sorted(objects_zip.namelist()) == [
+                'objects/',
+                'objects/Landing_zone-23d63923-82f7-412f-b308-389077aeb3a7.tif',
+                'objects/Landing_zone.jpg',
+            ]
+        with zipfile.ZipFile(os.path.join(FIXTURES_DIR, 'metadata.zip')) as metadata_zip:
+            names = metadata_zip.namelist()
+            assert 'small_compressed_bag/bagit.txt' in names
+            assert 'small_compressed_bag/data/objects/submissionDocumentation/transfer-cv-cfa43ba8-aa1d-4fb2-8569-1413262dce0f/METS.xml' in names
+            assert 'small_compressed_bag/data/objects/metadata/transfers/cv-cfa43ba8-aa1d-4fb2-8569-1413262dce0f/metadata.csv' in names
+            assert 'small_compressed_bag/data/objects/Landing_zone.jpg' not in names
+            assert metadata_zip.testzip() is None
 
     def test_split_package_7z(self):
         """It should split a package into objects and metadata using 7Z."""
@@ -92,6 +111,51 @@ class TestDSpace(TestCase):
         assert os.path.join(FIXTURES_DIR, 'metadata.7z') in split_paths
         # TODO verify contents
 
+    def test_split_package_links(self):
+        """It should keep symlinks and refuse to drop hard links."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'bag.tar')
+
+        def add_members(tar, link_type):
+            info = tarfile.TarInfo('bag/data/objects/a.txt')
+            info.size = 1
+            tar.addfile(info, io.BytesIO(b'a'))
+            info = tarfile.TarInfo('bag/data/objects/link.txt')
+            info.type = link_type
+            info.linkname = 'a.txt' if link_type == tarfile.SYMTYPE else 'bag/data/objects/a.txt'
+            tar.addfile(info)
+            info = tarfile.TarInfo('bag/bagit.txt')
+            info.size = 1
+            tar.addfile(info, io.BytesIO(b'b'))
+
+        with tarfile.open(path, 'w') as tar:
+            add_members(tar, tarfile.SYMTYPE)
+        split_paths = self.dspace_object._split_package(path)
+        assert split_paths == [os.path.join(tmp_dir, 'objects.zip'),
+                               os.path.join(tmp_dir, 'metadata.zip')]
+        with zipfile.ZipFile(split_paths[0]) as objects_zip:
+            info = objects_zip.getinfo('objects/link.txt')
+            assert stat.S_ISLNK(info.external_attr >> 16)
+            assert objects_zip.read(info) == 'a.txt'
+            assert objects_zip.read('objects/a.txt') == 'a'
+
+        with tarfile.open(path, 'w') as tar:
+            add_members(tar, tarfile.LNKTYPE)
+        with pytest.raises(models.StorageException) as excinfo:
+            self.dspace_object._split_package(path)
+        assert 'bag/data/objects/link.txt is a hardlink' in str(excinfo.value)
+
+    def test_split_member_name(self):
+        """It should route payload to objects and everything else to metadata."""
+        split = self.dspace_object._split_member_name
+        assert split('bag/data/objects/a/b.txt') == ('objects', 'objects/a/b.txt')
+        assert split('bag/data/objects/metadata/m.csv') == ('metadata', 'bag/data/objects/metadata/m.csv')
+        assert split('bag/data/objects/') == ('metadata', 'bag/data/objects')
+        assert split('bag/bagit.txt') == ('metadata', 'bag/bagit.txt')
+        with pytest.raises(ValueError):
+            split('bag/../../etc/passwd')
+
     @dspace_vcr.use_cassette(os.path.join(FIXTURES_DIR, 'vcr_cassettes', 'dspace_move_from_ss.yaml'))
     def test_move_from_ss(self):
         # Create test.txt
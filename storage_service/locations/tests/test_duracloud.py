@@ -4,6 +4,8 @@ import os
 import requests
 
 from django.test import TestCase
+import bagit
+import mock
 import vcr
 
 from locations import models
@@ -201,6 +203,25 @@ class TestDuracloud(TestCase):
         requests.delete('https://' + self.ds_object.host + '/durastore/' + self.ds_object.duraspace + '/chunked/chunked%20%23image.txt.dura-chunk-0000', auth=self.auth)
         requests.delete('https://' + self.ds_object.host + '/durastore/' + self.ds_object.duraspace + '/chunked/chunked%20%23image.txt.dura-chunk-0001', auth=self.auth)
 
+    def test_upload_file_chunked_checksums(self):
+        """It should checksum the file and its chunks while splitting it."""
+        file_path = os.path.join(FIXTURES_DIR, 'chunk_file.txt')
+        self.ds_object.CHUNK_SIZE = 10 * 1024  # Set testing chunk size
+        manifests = []
+
+        def upload_chunk(url, upload_file):
+            if upload_file.endswith(self.ds_object.MANIFEST_SUFFIX):
+                with open(upload_file) as f:
+                    manifests.append(etree.fromstring(f.read()))
+
+        with mock.patch.object(self.ds_object, '_upload_chunk', side_effect=upload_chunk):
+            md5 = self.ds_object._upload_file('https://example.org/chunked.txt', file_path)
+        assert md5 == 'e7aba5d09b490b9f91c65867754ae190'
+        root = manifests[0]
+        assert root.find('header/sourceContent/md5').text == md5
+        assert [chunk.find('md5').text for chunk in root.find('chunks')] == [
+            '2147aa269812cac6204ad66ec953ccfe', 'aa9d2932a31f4b81cbfd1bcdb2c75020']
+
     @vcr.use_cassette(os.path.join(FIXTURES_DIR, 'vcr_cassettes', 'duracloud_move_from_ss_chunked_resume.yaml'))
     def test_move_from_ss_chunked_resume(self):
         # Setup
@@ -314,3 +335,32 @@ class TestDuracloud(TestCase):
         # Cleanup
         os.remove('move_to_ss_chunked/chunked #image.jpg')
         os.removedirs('move_to_ss_chunked')
+
+    def test_check_package_fixity_chunked(self):
+        """It should check a chunked package from its manifest and chunk MD5s."""
+        package = models.Package.objects.create(
+            current_location_id='d9d7db26-f7a1-40aa-9db1-806b4d3a61cd',
+            current_path='a/pkg.7z', package_type=models.Package.AIP,
+            misc_attributes={'stored_md5': 'f' * 32})
+        manifest = (
+            '<dur:chunksManifest xmlns:dur="duracloud.org"><header schemaVersion="0.2">'
+            '<sourceContent contentId="aips/a/pkg.7z"><byteSize>3</byteSize><md5>' + 'f' * 32 + '</md5></sourceContent></header>'
+            '<chunks><chunk chunkId="aips/a/pkg.7z.dura-chunk-0000"><byteSize>2</byteSize><md5>' + 'a' * 32 + '</md5></chunk>'
+            '<chunk chunkId="aips/a/pkg.7z.dura-chunk-0001"><byteSize>1</byteSize><md5>' + 'b' * 32 + '</md5></chunk></chunks>'
+            '</dur:chunksManifest>')
+        heads = {
+            'aips/a/pkg.7z.dura-chunk-0000': mock.Mock(status_code=200, headers={'Content-MD5': 'a' * 32, 'Content-Length': '2'}),
+            'aips/a/pkg.7z.dura-chunk-0001': mock.Mock(status_code=200, headers={'Content-MD5': 'c' * 32, 'Content-Length': '1'}),
+        }
+        session = mock.Mock()
+        session.head.side_effect = lambda url: heads.get(
+            url.replace(self.ds_object.duraspace_url, ''), mock.Mock(status_code=404))
+        session.get.return_value = mock.Mock(ok=True, content=manifest)
+        self.ds_object._session = session
+
+        success, failures, message, _ = self.ds_object.check_package_fixity(package)
+
+        assert success is False
+        assert [(type(f), f.path) for f in failures] == [
+            (bagit.ChecksumMismatch, 'aips/a/pkg.7z.dura-chunk-0001')]
+        session.get.assert_called_once_with(self.ds_object.duraspace_url + 'aips/a/pkg.7z.dura-manifest')
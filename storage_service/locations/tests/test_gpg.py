@@ -7,9 +7,12 @@ import os
 import shutil
 import subprocess
 import tarfile
+import tempfile
 import unicodedata
 
 from django.test import TestCase
+import gnupg
+import mock
 from metsrw.plugins import premisrw
 import pytest
 
@@ -44,8 +47,7 @@ BROWSE_FAIL_DICT = {'directories': [], 'entries': [], 'properties': {}}
 
 
 FakeGPGRet = namedtuple('FakeGPGRet', 'ok status stderr')
-ExTarCase = namedtuple('ExTarCase', 'path isdir raises expected')
-CrTarCase = namedtuple('CrTarCase', 'path isfile istar raises expected')
+FakeGPGData = namedtuple('FakeGPGData', 'ok status data')
 DecryptCase = namedtuple('DecryptCase',
                          'path isfile createsdecryptfile decryptret expected')
 EncryptCase = namedtuple('EncryptCase',
@@ -214,6 +216,7 @@ def test_move_from_storage_service(mocker, src_path, dst_path, package, encrypt_
 )
 def test_browse(mocker, path, encr_path, exists_after_decrypt, expect):
     mocker.patch.object(gpg, '_get_encrypted_path', return_value=encr_path)
+    mocker.patch.object(gpg, '_get_listing', return_value=None)
     mocker.patch.object(gpg, '_gpg_decrypt')
     mocker.patch.object(gpg, '_gpg_encrypt')
     mocker.patch.object(gpg, '_encr_path2key_fingerprint',
@@ -233,6 +236,26 @@ def test_browse(mocker, path, encr_path, exists_after_decrypt, expect):
         gpg._gpg_encrypt.assert_called_once_with(encr_path, SOME_FINGERPRINT)
 
 
+def test_browse_from_listing(mocker):
+    listing = {
+        '': {'data': [4096, 2], 'bagit.txt': [55, None], '.hidden': [1, None]},
+        'data': {'a.jpg': [10, None], 'B': [4096, 1]},
+    }
+    mocker.patch.object(gpg, '_get_encrypted_path', return_value='/a/b/c')
+    mocker.patch.object(gpg, '_get_listing', return_value=listing)
+    mocker.patch.object(gpg, '_gpg_decrypt')
+    assert gpg.GPG().browse('/a/b/c/data/') == {
+        'entries': ['a.jpg', 'B'],
+        'directories': ['B'],
+        'properties': {'a.jpg': {'size': 10},
+                       'B': {'size': 4096, 'object count': 1}},
+    }
+    assert gpg.GPG().browse('/a/b/c')['entries'] == ['bagit.txt', 'data']
+    assert gpg.GPG().browse('/a/b/c/bagit.txt') == BROWSE_FAIL_DICT
+    gpg._get_listing.assert_called_with('/a/b/c')
+    assert not gpg._gpg_decrypt.called
+
+
 @pytest.mark.parametrize(
     'path, isdir, encr_path_is_file, encrypt_ret, expected', [
         EncryptCase(path='/a/b/c', isdir=True, encrpathisfile=True,
@@ -249,30 +272,270 @@ def test__gpg_encrypt(mocker, path, isdir, encr_path_is_file, encrypt_ret,
                       expected):
     encr_path = '{}.gpg'.format(path)
     mocker.patch.object(os.path, 'isdir', return_value=isdir)
+    mocker.patch.object(os.path, 'lexists', return_value=True)
     mocker.patch.object(os, 'remove')
     mocker.patch.object(os, 'rename')
-    mocker.patch.object(gpg, '_create_tar')
-    mocker.patch.object(gpg, '_extract_tar')
+    mocker.patch.object(shutil, 'rmtree')
+    mocker.patch.object(gpg, '_gpg_encrypt_tar',
+                        return_value=(encr_path, encrypt_ret))
     mocker.patch.object(gpgutils, 'gpg_encrypt_file',
                         return_value=(encr_path, encrypt_ret))
     mocker.patch.object(os.path, 'isfile', return_value=encr_path_is_file)
     if expected == 'success':
         ret = gpg._gpg_encrypt(path, SOME_FINGERPRINT)
-        os.remove.assert_called_once_with(path)
+        if isdir:
+            shutil.rmtree.assert_called_once_with(path)
+            assert not os.remove.called
+        else:
+            os.remove.assert_called_once_with(path)
+            assert not shutil.rmtree.called
         os.rename.assert_called_once_with(encr_path, path)
         assert ret == (path, encrypt_ret)
-        assert not gpg._extract_tar.called
     else:
         with pytest.raises(gpg.GPGException) as excinfo:
             gpg._gpg_encrypt(path, SOME_FINGERPRINT)
         assert 'An error occured when attempting to encrypt {}'.format(
             path) == str(excinfo.value)
-        if isdir:
-            gpg._extract_tar.assert_called_once_with(path)
+        # The package is left as it was
+        os.remove.assert_called_once_with(encr_path)
+        assert not shutil.rmtree.called
+        assert not os.rename.called
     os.path.isdir.assert_called_once_with(path)
     os.path.isfile.assert_called_once_with(encr_path)
     if isdir:
-        gpg._create_tar.assert_called_once_with(path)
+        gpg._gpg_encrypt_tar.assert_called_once_with(path, SOME_FINGERPRINT)
+        assert not gpgutils.gpg_encrypt_file.called
+    else:
+        gpgutils.gpg_encrypt_file.assert_called_once_with(
+            path, SOME_FINGERPRINT)
+        assert not gpg._gpg_encrypt_tar.called
+
+
+def _copy_encrypt_stream(stream, encr_path, recipient_fingerprint):
+    """Stand-in for ``gpgutils.gpg_encrypt_stream`` that doesn't encrypt."""
+    with open(encr_path, 'wb') as encr_file:
+        shutil.copyfileobj(stream, encr_file)
+    return ENCRYPT_RET_SUCCESS
+
+
+def _copy_decrypt_file_to_consumer(path, consume):
+    """Stand-in for ``gpgutils.gpg_decrypt_file_to_consumer`` that doesn't
+    decrypt."""
+    with open(path, 'rb') as stream:
+        consume(stream)
+    return DECRYPT_RET_SUCCESS
+
+
+def _reverse_encrypt_data(data, recipient_fingerprint):
+    """Stand-in for ``gpgutils.gpg_encrypt_data`` that only reverses."""
+    return FakeGPGData(ok=True, status=SUCCESS_STATUS, data=data[::-1])
+
+
+def _reverse_decrypt_data(data):
+    """Stand-in for ``gpgutils.gpg_decrypt_data`` that only reverses."""
+    return FakeGPGData(ok=True, status=SUCCESS_STATUS, data=data[::-1])
+
+
+def test_encrypt_decrypt_directory_streaming(mocker, tmpdir):
+    """Directories are piped through tar into GPG and from GPG into tar,
+    without writing a plaintext tarfile to disk."""
+    mocker.patch.object(gpgutils, 'gpg_encrypt_stream',
+                        side_effect=_copy_encrypt_stream)
+    mocker.patch.object(gpgutils, 'gpg_decrypt_file_to_consumer',
+                        side_effect=_copy_decrypt_file_to_consumer)
+    aip = tmpdir.mkdir('aip')
+    aip.mkdir('data').join('file.txt').write('data')
+    path = str(aip)
+
+    assert gpg._gpg_encrypt(path, SOME_FINGERPRINT) == (
+        path, ENCRYPT_RET_SUCCESS)
+    assert os.path.isfile(path)
+    assert tarfile.is_tarfile(path)
+    assert tmpdir.listdir() == [aip]
+    gpgutils.gpg_encrypt_stream.assert_called_once_with(
+        mock.ANY, path + '.gpg', SOME_FINGERPRINT)
+
+    assert gpg._gpg_decrypt(path) == path
+    assert aip.join('data', 'file.txt').read() == 'data'
+    assert tmpdir.listdir() == [aip]
+
+
+def test_decrypt_streaming_failures(mocker, tmpdir):
+    """Files that aren't tarfiles are decrypted to a file, and the encrypted
+    file is restored if extracting a tarfile fails."""
+    mocker.patch.object(gpgutils, 'gpg_decrypt_file_to_consumer',
+                        side_effect=_copy_decrypt_file_to_consumer)
+    compressed = tmpdir.join('aip.7z')
+    compressed.write('not a tarfile')
+    assert gpg._gpg_decrypt(str(compressed)) == str(compressed)
+    assert compressed.read() == 'not a tarfile'
+
+    aip = tmpdir.mkdir('aip')
+    aip.join('file.txt').write('data' * 1000)
+    with tarfile.open(str(tmpdir.join('aip.tar')), 'w') as tar:
+        tar.add(str(aip), arcname='aip')
+    truncated = tmpdir.join('aip.tar').read('rb')[:2048]
+    aip.remove()
+    tmpdir.join('aip.tar').remove()
+    aip.write(truncated, 'wb')
+    with pytest.raises(gpg.GPGException) as excinfo:
+        gpg._gpg_decrypt(str(aip))
+    assert 'Failed to extract {} to a directory'.format(aip) in str(
+        excinfo.value)
+    assert aip.read('rb') == truncated
+    assert sorted(tmpdir.listdir()) == [aip, compressed]
+
+
+def test__gpg_encrypt_tar_fails(mocker, tmpdir):
+    """The encrypted output of a tar that failed is removed."""
+    mocker.patch.object(gpgutils, 'gpg_encrypt_stream',
+                        side_effect=_copy_encrypt_stream)
+    path = str(tmpdir.join('missing'))
+    encr_path, _ = gpg._gpg_encrypt_tar(path, SOME_FINGERPRINT)
+    assert encr_path == path + '.gpg'
+    assert gpgutils.gpg_encrypt_stream.called
+    assert tmpdir.listdir() == []
+
+
+def _copy_decrypt_file(path, decr_path):
+    """Stand-in for ``gpgutils.gpg_decrypt_file`` that doesn't decrypt."""
+    shutil.copyfile(path, decr_path)
+    return DECRYPT_RET_SUCCESS
+
+
+@pytest.fixture
+def per_file_package(mocker, tmpdir):
+    """A package encrypted file by file, with stand-ins for GPG."""
+    mocker.patch.object(gpgutils, 'gpg_encrypt_stream',
+                        side_effect=_copy_encrypt_stream)
+    mocker.patch.object(gpgutils, 'gpg_decrypt_file',
+                        side_effect=_copy_decrypt_file)
+    mocker.patch.object(gpgutils, 'gpg_decrypt_file_to_consumer',
+                        side_effect=_copy_decrypt_file_to_consumer)
+    aip = tmpdir.mkdir('aip')
+    aip.join('bagit.txt').write('bagit')
+    aip.mkdir('data').mkdir('objects').join('a.txt').write('a')
+    aip.join('data').mkdir('empty')
+    os.utime(str(aip.join('bagit.txt')), (1000000000, 1000000000))
+    path = str(aip)
+    listing = gpg._plaintext_listing(path)
+    assert gpg._gpg_encrypt_files(path, SOME_FINGERPRINT, listing) == (
+        path, ENCRYPT_RET_SUCCESS)
+    return path
+
+
+def test__gpg_encrypt_files(per_file_package, tmpdir):
+    """Each file is encrypted separately under a random name, with an
+    encrypted index."""
+    path = per_file_package
+    assert tmpdir.listdir() == [tmpdir.join('aip')]
+    blobs = [os.path.join(dirpath, name)
+             for dirpath, __, filenames in os.walk(path)
+             for name in filenames]
+    assert len(blobs) == 3
+    assert os.path.join(path, gpg.ENCRYPTED_INDEX) in blobs
+    assert not any(name in blob for blob in blobs
+                   for name in ('bagit', 'data', 'a.txt'))
+    assert gpg.GPG().is_encrypted_package(path)
+    assert gpg._get_per_file_package(
+        os.path.join(path, 'data', 'objects', 'a.txt')) == path
+    assert gpg._get_per_file_package(str(tmpdir)) is None
+    index = gpg._read_index(path)
+    assert sorted(index['files']) == ['bagit.txt', 'data/objects/a.txt']
+    assert index['listing']['data']['empty'][1] == 0
+
+
+def test__gpg_encrypt_files_fails(mocker, tmpdir):
+    """The package is left as it was if any file fails to encrypt."""
+    mocker.patch.object(gpgutils, 'gpg_encrypt_stream',
+                        return_value=ENCRYPT_RET_FAIL)
+    aip = tmpdir.mkdir('aip')
+    aip.join('bagit.txt').write('bagit')
+    path = str(aip)
+    with pytest.raises(gpg.GPGException) as excinfo:
+        gpg._gpg_encrypt_files(path, SOME_FINGERPRINT, {})
+    assert 'An error occured when attempting to encrypt {}'.format(
+        path) == str(excinfo.value)
+    assert tmpdir.listdir() == [aip]
+    assert aip.join('bagit.txt').read() == 'bagit'
+
+
+def test__gpg_decrypt_files(per_file_package, tmpdir):
+    """Only the files of the path moved out of the package are decrypted."""
+    path = per_file_package
+    dst = tmpdir.mkdir('dst')
+    gpg._gpg_decrypt_files(
+        path, '/data/objects/a.txt', str(dst.join('a.txt')))
+    assert dst.join('a.txt').read() == 'a'
+    assert gpgutils.gpg_decrypt_file.call_count == 1
+
+    gpg._gpg_decrypt_files(path, '/data/', str(dst.join('data')))
+    assert dst.join('data', 'objects', 'a.txt').read() == 'a'
+    assert dst.join('data', 'empty').isdir()
+    assert gpgutils.gpg_decrypt_file.call_count == 2
+
+    gpg._gpg_decrypt_files(path, '', str(dst.join('aip')))
+    assert dst.join('aip', 'bagit.txt').read() == 'bagit'
+    assert dst.join('aip', 'bagit.txt').mtime() == 1000000000
+    assert dst.join('aip', 'data', 'objects', 'a.txt').read() == 'a'
+
+    with pytest.raises(gpg.GPGException) as excinfo:
+        gpg._gpg_decrypt_files(path, 'data/missing.txt', str(dst.join('x')))
+    assert 'Unable to move {}/data/missing.txt;'.format(path) in str(
+        excinfo.value)
+
+
+def test_move_to_storage_service_per_file(per_file_package, tmpdir):
+    gpg_space = gpg.GPG(key=SOME_FINGERPRINT, space=space.Space())
+    dst_path = str(tmpdir.join('dst', 'aip', 'data', 'objects', 'a.txt'))
+    gpg_space.move_to_storage_service(
+        os.path.join(per_file_package, 'data', 'objects', 'a.txt'),
+        dst_path, None)
+    with open(dst_path) as f:
+        assert f.read() == 'a'
+    assert gpgutils.gpg_decrypt_file.call_count == 1
+    assert gpg_space.is_encrypted_package(per_file_package)
+
+
+def test_gpg_decrypt_file_to_consumer(mocker, tmpdir):
+    """Decrypted data is passed to the consumer through GPG's output pipe,
+    even if GPG fails without writing any, and errors consuming it are
+    raised."""
+    gnupg_gpg = gnupg.GPG(gnupghome=str(tmpdir.mkdir('gnupg')))
+    mocker.patch.object(gpgutils, 'gpg', return_value=gnupg_gpg)
+    # Stand-in for GPG that "decrypts" by upper-casing
+    decrypt_cmd = 'tr a-z A-Z < "$1" && echo "[GNUPG:] DECRYPTION_OKAY" >&2'
+
+    def make_args(args, passphrase):
+        assert args[:2] == ['--decrypt', '--']
+        return ['sh', '-c', decrypt_cmd, 'sh', args[2]]
+    mocker.patch.object(gnupg_gpg, 'make_args', side_effect=make_args)
+    path = str(tmpdir.join('encrypted'))
+    with open(path, 'w') as encr_file:
+        encr_file.write('ciphertext' * 100000)
+    consumed = []
+    ret = gpgutils.gpg_decrypt_file_to_consumer(
+        path, lambda stream: consumed.append(stream.read()))
+    assert ret.ok
+    assert ret.status == 'decryption ok'
+    assert consumed == ['CIPHERTEXT' * 100000]
+
+    decrypt_cmd = 'echo "[GNUPG:] DECRYPTION_FAILED" >&2; exit 2'
+    consumed = []
+    ret = gpgutils.gpg_decrypt_file_to_consumer(
+        path, lambda stream: consumed.append(stream.read()))
+    assert not ret.ok
+    assert ret.status == 'decryption failed'
+    assert consumed == ['']
+
+    def consume(stream):
+        stream.read(1)
+        raise IOError('gotcha!')
+    decrypt_cmd = 'tr a-z A-Z < "$1" && echo "[GNUPG:] DECRYPTION_OKAY" >&2'
+    with pytest.raises(IOError):
+        gpgutils.gpg_decrypt_file_to_consumer(path, consume)
+    assert sorted(tmpdir.listdir()) == [
+        tmpdir.join('encrypted'), tmpdir.join('gnupg')]
 
 
 def test__get_encrypted_path(monkeypatch):
@@ -314,24 +577,20 @@ def test__gpg_decrypt(mocker, path, isfile, will_create_decrypt_file,
                       decrypt_ret, expected):
     mocker.patch('os.remove')
     mocker.patch('os.rename')
-    mocker.patch.object(tarfile, 'is_tarfile', return_value=True)
-    mocker.patch.object(gpgutils, 'gpg_decrypt_file', return_value=decrypt_ret)
-    mocker.patch.object(gpg, '_extract_tar')
-
-    def isfilemock(path_):
-        if path_ == path:
-            return isfile
-        return will_create_decrypt_file
-
-    mocker.patch.object(os.path, 'isfile', side_effect=isfilemock)
-    assert not gpgutils.gpg_decrypt_file.called
-    decr_path = '{}.decrypted'.format(path)
+    mocker.patch.object(shutil, 'rmtree')
+    mocker.patch.object(gpgutils, 'gpg_decrypt_file_to_consumer',
+                        return_value=decrypt_ret)
+    mocker.patch.object(os.path, 'isfile', return_value=isfile)
+    mocker.patch.object(os.path, 'exists',
+                        return_value=will_create_decrypt_file)
+    mocker.patch.object(os.path, 'isdir', return_value=False)
+    mocker.patch.object(os.path, 'lexists',
+                        return_value=will_create_decrypt_file)
+    encr_path = '{}.encrypted'.format(path)
     if expected == 'success':
         ret = gpg._gpg_decrypt(path)
-        os.remove.assert_called_once_with(path)
-        os.rename.assert_called_once_with(decr_path, path)
-        tarfile.is_tarfile.assert_called_once_with(path)
-        gpg._extract_tar.assert_called_once_with(path)
+        os.rename.assert_called_once_with(path, encr_path)
+        os.remove.assert_called_once_with(encr_path)
         assert ret == path
     else:
         with pytest.raises(gpg.GPGException) as excinfo:
@@ -339,18 +598,20 @@ def test__gpg_decrypt(mocker, path, isfile, will_create_decrypt_file,
         if isfile:
             assert 'Failed to decrypt {}. Reason: {}'.format(
                 path, DECRYPT_RET_FAIL_STATUS) == str(excinfo.value)
+            # The encrypted file is restored
+            assert os.rename.call_args_list == [
+                mock.call(path, encr_path), mock.call(encr_path, path)]
         else:
             assert 'Cannot decrypt file at {}; no such file.'.format(
                 path) == str(excinfo.value)
+            assert not os.rename.called
         assert not os.remove.called
-        assert not os.rename.called
-        assert not tarfile.is_tarfile.called
-        assert not gpg._extract_tar.called
+        assert not shutil.rmtree.called
     if isfile:
-        gpgutils.gpg_decrypt_file.assert_called_once_with(
-            path, decr_path)
+        gpgutils.gpg_decrypt_file_to_consumer.assert_called_once_with(
+            encr_path, mock.ANY)
     else:
-        assert not gpgutils.gpg_decrypt_file.called
+        assert not gpgutils.gpg_decrypt_file_to_consumer.called
 
 
 def test__parse_gpg_version():
@@ -358,6 +619,7 @@ def test__parse_gpg_version():
 
 
 def test_create_encryption_event(mocker):
+    utils.clear_cached_check_output()
     mocker.patch.object(subprocess, 'check_output',
                         return_value=RAW_GPG_VERSION)
     mocker.patch.object(utils, 'get_ss_premis_agents', return_value=TEST_AGENTS)
@@ -380,90 +642,38 @@ def test_create_encryption_event(mocker):
     utils.get_ss_premis_agents.assert_called_once()
     subprocess.check_output.assert_called_once_with(['gpg', '--version'])
 
-
-@pytest.mark.parametrize(
-    'path, will_be_dir, sp_raises, expected',
-    [
-        ExTarCase(path='/a/b/c', isdir=True, raises=False, expected='success'),
-        ExTarCase(path='/a/b/d', isdir=False, raises=False, expected='fail'),
-        ExTarCase(path='/a/b/c', isdir=True, raises=True, expected='fail')
-    ]
-)
-def test__extract_tar(mocker, path, will_be_dir, sp_raises, expected):
-    if sp_raises:
-        mocker.patch.object(subprocess, 'check_output',
-                            side_effect=OSError('gotcha!'))
-    else:
-        mocker.patch.object(subprocess, 'check_output')
-    mocker.patch.object(os, 'rename')
-    mocker.patch.object(os, 'remove')
-    if will_be_dir:
-        mocker.patch.object(os.path, 'isdir', return_value=True)
-    else:
-        mocker.patch.object(os.path, 'isdir', return_value=False)
-    tarpath_ext = '{}.tar'.format(path)
-    dirname = os.path.dirname(tarpath_ext)
-    if expected == 'success':
-        ret = gpg._extract_tar(path)
-        assert ret is None
-        os.remove.assert_called_once_with(tarpath_ext)
-    else:
-        with pytest.raises(gpg.GPGException) as excinfo:
-            ret = gpg._extract_tar(path)
-        assert ('Failed to extract {} to a directory at the same'
-                ' location.'.format(path) == str(excinfo.value))
-        os.rename.assert_any_call(tarpath_ext, path)
-        assert not os.remove.called
-    os.rename.assert_any_call(path, tarpath_ext)
-    subprocess.check_output.assert_called_once_with(
-        ['tar', '-xf', tarpath_ext, '-C', dirname])
-
-
-@pytest.mark.parametrize(
-    'path, will_be_file, will_be_tar, sp_raises, expected',
-    [
-        CrTarCase(path='/a/b/c', isfile=True, istar=True, raises=False,
-                  expected='success'),
-        CrTarCase(path='/a/b/c/', isfile=True, istar=True, raises=False,
-                  expected='success'),
-        CrTarCase(path='/a/b/c', isfile=True, istar=False, raises=False,
-                  expected='fail'),
-        CrTarCase(path='/a/b/c', isfile=False, istar=True, raises=False,
-                  expected='fail'),
-        CrTarCase(path='/a/b/c', isfile=False, istar=False, raises=True,
-                  expected='fail')
-    ]
-)
-def test__create_tar(mocker, path, will_be_file, will_be_tar, sp_raises,
-                     expected):
-    if sp_raises:
-        mocker.patch.object(subprocess, 'check_output',
-                            side_effect=OSError('gotcha!'))
-    else:
-        mocker.patch.object(subprocess, 'check_output')
-    mocker.patch.object(os.path, 'isfile', return_value=will_be_file)
-    mocker.patch.object(tarfile, 'is_tarfile', return_value=will_be_tar)
-    mocker.patch.object(os, 'rename')
-    mocker.patch.object(shutil, 'rmtree')
-    fixed_path = path.rstrip('/')
-    tarpath = '{}.tar'.format(fixed_path)
-    if expected == 'success':
-        ret = gpg._create_tar(path)
-        shutil.rmtree.assert_called_once_with(fixed_path)
-        os.rename.assert_called_once_with(tarpath, fixed_path)
-        tarfile.is_tarfile.assert_any_call(fixed_path)
-        assert ret is None
-    else:
-        with pytest.raises(gpg.GPGException) as excinfo:
-            ret = gpg._create_tar(path)
-        assert 'Failed to create a tarfile at {} for dir at {}'.format(
-            tarpath, fixed_path) == str(excinfo.value)
-        assert not shutil.rmtree.called
-        assert not os.rename.called
-    if not sp_raises:
-        os.path.isfile.assert_called_once_with(tarpath)
-        if will_be_file:
-            tarfile.is_tarfile.assert_any_call(tarpath)
+    # The version of GPG is only asked once
+    event = gpg.create_encryption_event(encr_result, SOME_FINGERPRINT).data
+    assert [x for x in event[2:] if x[0] == 'event_detail'][0][1] == (
+        'program=GPG; version={}; key={}'.format(GPG_VERSION, SOME_FINGERPRINT))
+    subprocess.check_output.assert_called_once_with(['gpg', '--version'])
+    utils.clear_cached_check_output()
+
+
+def test_list_private_keys(mocker, tmpdir):
+    """Keys are listed again only once the keyring changes."""
+    mock_gpg = mocker.Mock(gnupghome=str(tmpdir))
+    mock_gpg.list_keys.side_effect = lambda secret: mocker.Mock(
+        key_map={SOME_FINGERPRINT: {'fingerprint': SOME_FINGERPRINT}})
+    mock_gpg.import_keys.return_value = mocker.Mock(count=0)
+    mocker.patch.object(gpgutils, 'gpg', gpgutils.GPG())
+    gpgutils.gpg._gpg = mock_gpg
+    keyring = tmpdir.join('pubring.kbx')
+    keyring.write('key')
+
+    assert gpgutils.get_gpg_key(SOME_FINGERPRINT)
+    assert gpgutils.get_gpg_key(SOME_OTHER_FINGERPRINT) is None
+    assert mock_gpg.list_keys.call_count == 1
+    # Imports and deletions here forget the keys
+    assert gpgutils.import_gpg_key('armor') == gpgutils.IMPORT_ERROR
+    assert gpgutils.get_gpg_key(SOME_FINGERPRINT)
+    assert mock_gpg.list_keys.call_count == 2
+    # Changes to the keyring by other processes are noticed
+    keyring.write('keys')
+    assert gpgutils.get_gpg_key(SOME_FINGERPRINT)
+    assert gpgutils.get_gpg_key(SOME_FINGERPRINT)
+    assert mock_gpg.list_keys.call_count == 3
+    mock_gpg.list_keys.assert_called_with(True)
 
 
 class TestGPG(TestCase):
@@ -496,3 +706,98 @@ class TestGPG(TestCase):
             gpg._encr_path2key_fingerprint(encr_path)
         assert 'Unable to find package matching encrypted path {}'.format(
             encr_path) in str(excinfo.value)
+
+    def test__encr_path2key_fingerprint_by_uuid(self):
+        """Paths with the UUID of their package are looked up by UUID."""
+        package = Package.objects.get(pk=8)
+        uuid_path = utils.uuid_to_path(package.uuid)
+        paths = (
+            '/abs/{}/images-{}/data/objects/somefile.jpg'.format(
+                uuid_path, package.uuid),
+            '/abs/{}/images-{}.7z'.format(uuid_path, package.uuid.upper()),
+            '/abs/{}/images'.format(uuid_path),
+        )
+        for path in paths:
+            Package.objects.filter(pk=8).update(
+                current_path=path[len('/abs/'):].split('/data/')[0])
+            with mock.patch.object(Package.objects, 'raw') as mock_raw:
+                assert gpg._encr_path2key_fingerprint(path) == EXP_FINGERPRINT
+            assert not mock_raw.called
+        assert gpg._path_package_uuids(paths[0]) == {package.uuid}
+        assert gpg._path_package_uuids('/a/b/data/beef') == set()
+
+        # A package whose UUID is in the path, but not its current path
+        with pytest.raises(gpg.GPGException):
+            gpg._encr_path2key_fingerprint(
+                '/abs/{}/other'.format(uuid_path))
+
+    def test__gpg_encrypt_with_listing(self):
+        """It should record the listing of encrypted directories, encrypted."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'package')
+        os.makedirs(os.path.join(path, 'data', 'sub'))
+        for name in ('bagit.txt', 'data/a.jpg', 'data/sub/b.jpg'):
+            with open(os.path.join(path, name), 'w') as f:
+                f.write('abc')
+
+        def fake_encrypt(path, key_fingerprint):
+            shutil.rmtree(path)
+            with open(path, 'w') as f:
+                f.write('encrypted')
+            return path, ENCRYPT_RET_SUCCESS
+
+        with mock.patch.object(gpg, '_gpg_encrypt', side_effect=fake_encrypt), \
+                mock.patch.object(gpgutils, 'gpg_encrypt_data',
+                                  side_effect=_reverse_encrypt_data), \
+                mock.patch.object(gpgutils, 'gpg_decrypt_data',
+                                  side_effect=_reverse_decrypt_data):
+            assert gpg._gpg_encrypt_with_listing(path, SOME_FINGERPRINT) == (
+                path, ENCRYPT_RET_SUCCESS)
+            gpgutils.gpg_encrypt_data.assert_called_once_with(
+                mock.ANY, SOME_FINGERPRINT)
+            recorded = gpg.EncryptedListing.objects.get(path=path)
+            assert 'bagit.txt' not in recorded.encrypted_entries
+            listing = gpg._get_listing(path)
+            assert listing['']['bagit.txt'] == [3, None]
+            assert listing['']['data'][1] == 2
+            assert listing['data/sub'] == {'b.jpg': [3, None]}
+
+            # Changing the encrypted file invalidates the listing
+            with open(path, 'a') as f:
+                f.write('more')
+            assert gpg._get_listing(path) is None
+
+            # A listing that can't be decrypted isn't used
+            gpg._record_listing(path, listing, SOME_FINGERPRINT)
+            gpgutils.gpg_decrypt_data.side_effect = None
+            gpgutils.gpg_decrypt_data.return_value = DECRYPT_RET_FAIL
+            assert gpg._get_listing(path) is None
+
+        # Nor is a listing that can't be encrypted recorded
+        with mock.patch.object(gpgutils, 'gpg_encrypt_data',
+                               return_value=ENCRYPT_RET_FAIL):
+            gpg._record_listing(path, listing, SOME_FINGERPRINT)
+        assert not gpg.EncryptedListing.objects.filter(path=path).exists()
+
+    def test__get_listing_per_file(self):
+        """The listing of a package encrypted file by file is read from its
+        encrypted index, not recorded."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'package')
+        os.makedirs(os.path.join(path, 'data'))
+        with open(os.path.join(path, 'data', 'a.jpg'), 'w') as f:
+            f.write('abc')
+
+        with mock.patch.object(gpgutils, 'gpg_encrypt_stream',
+                               side_effect=_copy_encrypt_stream), \
+                mock.patch.object(gpgutils, 'gpg_decrypt_file_to_consumer',
+                                  side_effect=_copy_decrypt_file_to_consumer):
+            gpg._gpg_encrypt_with_listing(
+                path, SOME_FINGERPRINT, per_file=True)
+            assert gpg._is_encrypted_per_file(path)
+            assert not gpg.EncryptedListing.objects.filter(path=path).exists()
+            assert gpg._get_listing(path)['data'] == {'a.jpg': [3, None]}
+            assert gpg.GPG().browse(path)['entries'] == ['data']
+            assert gpgutils.gpg_decrypt_file_to_consumer.call_count == 2
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
+import hashlib
 import os
+import shutil
+import tempfile
 
 from django.test import TestCase
 import vcr
@@ -24,3 +27,41 @@ class TestLockssomatic(TestCase):
         assert self.lom_object.au_size == 0
         assert self.lom_object.collection_iri is None
         assert self.lom_object.checksum_type is None
+
+    def test_write_chunks(self):
+        """It should split a file into AU sized chunks with their checksums."""
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'aip.7z')
+        content = os.urandom(2500)
+        with open(path, 'wb') as f:
+            f.write(content)
+        self.lom_object.au_size = 1000
+        self.lom_object.checksum_type = 'sha1'
+
+        chunks = self.lom_object._write_chunks(path)
+
+        assert [c[0] for c in chunks] == [path + '.001', path + '.002', path + '.003']
+        assert [c[1] for c in chunks] == [1000, 1000, 500]
+        joined = b''
+        for chunk_path, size, checksum in chunks:
+            with open(chunk_path, 'rb') as f:
+                data = f.read()
+            assert len(data) == size
+            assert checksum.name.lower() == 'sha1'
+            assert checksum.hexdigest() == hashlib.sha1(data).hexdigest()
+            joined += data
+        assert joined == content
+
+    def test_write_chunks_invalid_checksum_type(self):
+        """It should fall back to md5 if the checksum type is not valid."""
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'aip.7z')
+        with open(path, 'wb') as f:
+            f.write(b'a' * 15)
+        self.lom_object.au_size = 10
+
+        chunks = self.lom_object._write_chunks(path)
+
+        assert [c[2].name.lower() for c in chunks] == ['md5', 'md5']
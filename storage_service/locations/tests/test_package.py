@@ -1,12 +1,20 @@
 import os
 import pytest
 import shutil
+import tarfile
 import tempfile
 import vcr
+import zipfile
+
+import bagit
+import mock
 
 from django.test import TestCase
 
+from common import utils
+
 from locations import models
+from locations.models import package as package_module
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 FIXTURES_DIR = os.path.abspath(os.path.join(THIS_DIR, '..', 'fixtures', ''))
@@ -75,6 +83,224 @@ class TestPackage(TestCase):
         assert message == 'invalid bag'
         assert timestamp is None
 
+    def test_fixity_compressed_without_extracting(self):
+        """ It should validate ZIP packages without extracting them. """
+        package = models.Package.objects.get(uuid='6aebdb24-1b6b-41ab-b4a3-df9a73726a34')
+        with mock.patch.object(models.Package, 'extract_file') as extract_file:
+            success, failures, message, timestamp = package.check_fixity()
+        assert not extract_file.called
+        assert success is True
+        assert failures == []
+        assert message == ''
+        assert timestamp is None
+
+    def test_fixity_compressed_indexes_manifest(self):
+        """ It should index the manifest of packages not indexed when stored. """
+        package = models.Package.objects.get(uuid='6aebdb24-1b6b-41ab-b4a3-df9a73726a34')
+        assert not package.manifest_entries.exists()
+        success = package.check_fixity()[0]
+        assert success is True
+        entry = package.manifest_entries.get(path='data/test.txt')
+        assert entry.size == 4
+        assert entry.checksum == package_module.hashlib.md5('test').hexdigest()
+
+    def test_validate_archived_bag_failure(self):
+        """ It should report the same failures as bagit for an archived bag. """
+        path = os.path.join(self.tmp_dir, 'broken_bag.tar.gz')
+        with tarfile.open(path, 'w:gz') as archive:
+            archive.add(os.path.join(FIXTURES_DIR, 'broken_bag'), 'broken_bag')
+        success, failures, message = package_module._validate_archived_bag(path)
+        assert success is False
+        assert message == 'invalid bag'
+        mismatched = sorted(f.path for f in failures if isinstance(f, bagit.ChecksumMismatch))
+        assert mismatched == ['data/test.txt', 'manifest-md5.txt']
+        missing = [f.path for f in failures if isinstance(f, bagit.FileMissing)]
+        assert missing == ['data/dne.txt']
+
+    def test_validate_archived_bag_one_pass(self):
+        """ It should read a tar once, even with the payload before the tags. """
+        path = os.path.join(self.tmp_dir, 'working_bag.tar')
+        bag_dir = os.path.join(FIXTURES_DIR, 'working_bag')
+        with tarfile.open(path, 'w') as archive:
+            archive.add(os.path.join(bag_dir, 'data'), 'working_bag/data')
+            for name in sorted(os.listdir(bag_dir)):
+                if name != 'data':
+                    archive.add(os.path.join(bag_dir, name), 'working_bag/' + name)
+        with mock.patch('common.utils.iter_archive_members',
+                        wraps=package_module.utils.iter_archive_members) as members:
+            success, failures, message = package_module._validate_archived_bag(path)
+        assert members.call_count == 1
+        assert success is True
+        assert failures == []
+        assert message == ''
+
+    def test_validate_archived_bag_indexed_one_algorithm(self):
+        """ It should hash ZIP members with their manifest's algorithm only,
+        even with the payload before the manifests. """
+        path = os.path.join(self.tmp_dir, 'working_bag.zip')
+        bag_dir = os.path.join(FIXTURES_DIR, 'working_bag')
+        with zipfile.ZipFile(path, 'w') as archive:
+            archive.write(os.path.join(bag_dir, 'data', 'test.txt'), 'working_bag/data/test.txt')
+            for name in sorted(os.listdir(bag_dir)):
+                if name != 'data':
+                    archive.write(os.path.join(bag_dir, name), 'working_bag/' + name)
+        with mock.patch.object(package_module.hashlib, 'new',
+                               wraps=package_module.hashlib.new) as new:
+            success, failures, message = package_module._validate_archived_bag(path)
+        assert success is True
+        assert set(call[0][0] for call in new.call_args_list) == {'md5'}
+
+    def test_validate_archived_bag_unexpected_file(self):
+        """ It should flag payload files missing from the manifest. """
+        path = os.path.join(self.tmp_dir, 'working_bag.zip')
+        shutil.copy(os.path.join(FIXTURES_DIR, 'working_bag.zip'), path)
+        with zipfile.ZipFile(path, 'a') as archive:
+            archive.writestr('working_bag/data/extra.txt', 'extra')
+        success, failures, message = package_module._validate_archived_bag(path)
+        assert success is False
+        assert message.startswith('Oxum error.')
+
+    def test_validate_archived_bag_not_a_bag(self):
+        """ It should refuse archives without a bagit.txt. """
+        path = os.path.join(self.tmp_dir, 'not_a_bag.zip')
+        with zipfile.ZipFile(path, 'w') as archive:
+            archive.writestr('not_a_bag/data/test.txt', 'test')
+        with pytest.raises(bagit.BagError):
+            package_module._validate_archived_bag(path)
+
+    def test_validate_bag_threads(self):
+        """ It should report the same errors as bagit when hashing in threads. """
+        path = os.path.join(FIXTURES_DIR, 'broken_bag')
+        with pytest.raises(bagit.BagValidationError) as expected:
+            bagit.Bag(path).validate()
+        with self.settings(FIXITY_HASH_THREADS=4):
+            with pytest.raises(bagit.BagValidationError) as found:
+                package_module._validate_bag(bagit.Bag(path))
+        assert sorted(str(e) for e in found.value.details) == sorted(
+            str(e) for e in expected.value.details)
+        with self.settings(FIXITY_HASH_THREADS=4):
+            assert package_module._validate_bag(
+                bagit.Bag(os.path.join(FIXTURES_DIR, 'working_bag'))) is True
+
+    def test_validate_bag_gevent(self):
+        """ It should hash in gevent's native threadpool under gevent. """
+        from gevent import threadpool
+        path = os.path.join(FIXTURES_DIR, 'working_bag')
+        with self.settings(FIXITY_HASH_THREADS=2), \
+                mock.patch('common.utils._gevent_patched_threading', return_value=True), \
+                mock.patch.object(threadpool, 'ThreadPool', wraps=threadpool.ThreadPool) as pool:
+            assert package_module._validate_bag(bagit.Bag(path)) is True
+        pool.assert_called_once_with(2)
+
+    def test_validate_bag_fallback(self):
+        """ It should fall back to bagit's own validation if its private
+        checks are missing. """
+        bag = mock.Mock(spec=['validate'])
+        bag.validate.return_value = True
+        assert package_module._validate_bag(bag) is True
+        bag.validate.assert_called_once_with(processes=1)
+
+    def test_index_manifest_uncompressed(self):
+        """ It should record the manifest checksums and sizes of a bag. """
+        package = models.Package.objects.get(uuid='0d4e739b-bf60-4b87-bc20-67a379b28cea')
+        assert package.index_manifest() == 4
+        entry = package.manifest_entries.get(path='data/test.txt')
+        assert entry.algorithm == 'md5'
+        assert entry.checksum == '098f6bcd4621d373cade4e832627b4f6'
+        assert entry.size == 4
+        # Indexing again replaces the previous entries
+        assert package.index_manifest() == 4
+        assert package.manifest_entries.count() == 4
+
+    def test_index_manifest_compressed(self):
+        """ It should read the manifest of a compressed bag in place. """
+        package = models.Package.objects.get(uuid='6aebdb24-1b6b-41ab-b4a3-df9a73726a34')
+        with mock.patch.object(models.Package, 'extract_file') as extract_file:
+            assert package.index_manifest() == 4
+        assert not extract_file.called
+        entry = package.manifest_entries.get(path='data/test.txt')
+        assert entry.checksum == '098f6bcd4621d373cade4e832627b4f6'
+        assert entry.size == 4
+        assert package.manifest_entries.get(path='bagit.txt').size == 55
+
+    def test_fixity_quick_success(self):
+        """ It should check completeness and recorded sizes of a bag. """
+        package = models.Package.objects.get(uuid='0d4e739b-bf60-4b87-bc20-67a379b28cea')
+        package.index_manifest()
+        success, failures, message, timestamp = package.check_fixity_quick()
+        assert success is True
+        assert failures == []
+        assert message == ''
+
+    def test_fixity_quick_stored_mtimes(self):
+        """ It should compare mtimes with the stored copy, not the staged one. """
+        package = models.Package.objects.get(uuid='0d4e739b-bf60-4b87-bc20-67a379b28cea')
+        staged = os.path.join(self.tmp_dir, 'working_bag')
+        shutil.copytree(os.path.join(FIXTURES_DIR, 'working_bag'), staged)
+        os.utime(os.path.join(staged, 'data', 'test.txt'), (0, 0))
+        package.index_manifest(staged)
+        assert package.check_fixity_quick()[0] is False
+        package._record_stored_mtimes()
+        assert package.check_fixity_quick()[0] is True
+
+    def test_fixity_quick_compressed(self):
+        """ It should check a compressed bag from the archive index. """
+        package = models.Package.objects.get(uuid='6aebdb24-1b6b-41ab-b4a3-df9a73726a34')
+        package.index_manifest()
+        package.manifest_entries.filter(path='data/test.txt').update(size=5)
+        success, failures, message, timestamp = package.check_fixity_quick()
+        assert success is False
+        assert [(f.path, f.algorithm, f.expected, f.found) for f in failures] == [
+            ('data/test.txt', 'size', 5, 4)]
+
+    def test_fixity_quick_escalates(self):
+        """ It should run a full check when the quick check fails. """
+        package = models.Package.objects.get(uuid='9f260047-a9b7-4a75-bb6a-e8d94c83edd2')
+        success, failures, message, timestamp = package.check_fixity_quick()
+        assert success is False
+        assert [f.path for f in failures] == ['data/dne.txt']
+        __, report = package.get_fixity_check_report_send_signals(quick=True)
+        assert report['success'] is False
+        assert report['check_level'] == 'full'
+        assert report['message'] == 'invalid bag'
+        log = models.FixityLog.objects.get(package=package)
+        assert log.check_level == models.FixityLog.FULL
+
+    def test_fixity_sample_rotation(self):
+        """ It should verify every file once per rotation of sampled checks. """
+        package = models.Package.objects.get(uuid='0d4e739b-bf60-4b87-bc20-67a379b28cea')
+        verified = []
+
+        def verify(path, entries, read_budget=None):
+            verified.extend(entries)
+            return []
+
+        with mock.patch.object(package_module, '_verify_bag_files', side_effect=verify):
+            for run in range(3):
+                success, failures, message, timestamp = package.check_fixity_sample(3)
+                assert success is True
+                assert package.misc_attributes['fixity_sample_next'] == (run + 1) % 3
+        assert sorted(verified) == ['bag-info.txt', 'bagit.txt', 'data/test.txt', 'manifest-md5.txt']
+        assert 'fixity_sample_covered' in package.misc_attributes
+
+    def test_fixity_sample_failure_compressed(self):
+        """ It should report checksum failures in the sampled files. """
+        package = models.Package.objects.get(uuid='6aebdb24-1b6b-41ab-b4a3-df9a73726a34')
+        path = os.path.join(self.tmp_dir, 'working_bag.zip')
+        with zipfile.ZipFile(os.path.join(FIXTURES_DIR, 'working_bag.zip')) as src:
+            with zipfile.ZipFile(path, 'w') as dst:
+                for info in src.infolist():
+                    data = src.read(info)
+                    if info.filename == 'working_bag/data/test.txt':
+                        data = 'TEST'
+                    dst.writestr(info, data)
+        package.current_location.relative_path = self.tmp_dir[1:]
+        package.current_location.save()
+        success, failures, message, timestamp = package.check_fixity_sample(1)
+        assert success is False
+        assert [(f.path, f.algorithm) for f in failures] == [('data/test.txt', 'md5')]
+        assert 'fixity_sample_covered' not in package.misc_attributes
+
     def test_fixity_package_type(self):
         """ It should only fixity bags. """
         package = models.Package.objects.get(uuid='79245866-ca80-4f84-b904-a02b3e0ab621')
@@ -134,6 +360,59 @@ class TestPackage(TestCase):
         assert {"reason": "Initial verification failed", "filepath": "manifest-md5.txt"} in failures
         assert timestamp is None
 
+    def test_fixity_report_records_latest_check(self):
+        """ It should store the latest fixity check result on the package. """
+        package = models.Package.objects.get(uuid='9f260047-a9b7-4a75-bb6a-e8d94c83edd2')
+        assert package.latest_fixity_check_datetime is None
+        package.get_fixity_check_report_send_signals()
+        log = models.FixityLog.objects.get(package=package)
+        assert package.latest_fixity_check_result is False
+        stored = models.Package.objects.get(uuid=package.uuid)
+        assert stored.latest_fixity_check_result is False
+        assert stored.latest_fixity_check_datetime == log.datetime_reported
+
+    def test_reingest_clears_stored_md5(self):
+        """ It should forget the uploaded file's MD5 when reingest replaces it,
+        e.g. with an uncompressed AIP. """
+        package = self.package
+        package.misc_attributes = {'stored_md5': 'f' * 32}
+        package.current_path = os.path.join(
+            utils.uuid_to_path(package.uuid), 'pkg')
+        package.save()
+        models.ManifestEntry.objects.create(
+            package=package, path='data/a.txt', algorithm='md5',
+            checksum='a' * 32, size=1)
+        internal_location = mock.Mock()
+        internal_location.space.path = '/internal'
+        reingest_space = mock.Mock()
+        reingest_space.move_from_storage_service.side_effect = (
+            lambda *args, **kwargs: kwargs['package'].stored_md5)
+
+        stored_md5 = package._move_rein_updated_to_final_dest(
+            False, [], mock.Mock(), internal_location,
+            '/internal/tmp', '/internal/tmp/pkg', reingest_space,
+            package.current_location, '/internal/tmp/pkg')
+        package.save()
+
+        assert stored_md5 is None
+        package = models.Package.objects.get(uuid=package.uuid)
+        assert package.stored_md5 is None
+        assert package.get_recorded_md5s() == {'data/a.txt': ('a' * 32, 1)}
+
+    def test_fixity_report_survives_stale_save(self):
+        """ Saving an instance loaded before a check was logged should not
+        overwrite the latest fixity check. """
+        stale = models.Package.objects.get(uuid='9f260047-a9b7-4a75-bb6a-e8d94c83edd2')
+        checked = models.Package.objects.get(uuid=stale.uuid)
+        checked.get_fixity_check_report_send_signals()
+        stale.status = models.Package.UPLOADED
+        stale.save()
+        stored = models.Package.objects.get(uuid=stale.uuid)
+        assert stored.status == models.Package.UPLOADED
+        assert stored.latest_fixity_check_result is False
+        assert stored.latest_fixity_check_datetime == (
+            models.FixityLog.objects.get(package=stored).datetime_reported)
+
     def test_fixity_force_local(self):
         """ It should do checksum locally if required. """
         package = models.Package.objects.get(uuid='e52c518d-fcf4-46cc-8581-bbc01aff7af3')
@@ -159,6 +438,31 @@ class TestPackage(TestCase):
         assert output_path == os.path.join(self.tmp_dir, basedir, 'manifest-md5.txt')
         assert os.path.isfile(output_path)
 
+    def test_fetch_encrypted_file_unique_staging(self):
+        """ Each fetch of a file encrypted file by file is staged apart """
+        package = models.Package.objects.get(uuid='0d4e739b-bf60-4b87-bc20-67a379b28cea')
+        ss_internal = models.Location.objects.get(purpose='SS')
+        ss_internal.space.staging_path = os.path.join(self.tmp_dir, 'staging')
+        staged = []
+
+        def move_to(source_path, destination_path, destination_space):
+            staged.append(destination_path)
+            path = os.path.join(destination_space.staging_path, destination_path)
+            destination_space.create_local_directory(path)
+            with open(path, 'w') as f:
+                f.write('decrypted')
+
+        with mock.patch.object(models.Space, 'move_to_storage_service', side_effect=move_to), \
+                mock.patch.object(models.Space, 'move_from_storage_service') as move_from:
+            for _ in range(2):
+                output_path, extract_path = package._fetch_encrypted_file(
+                    'data/a.txt', self.tmp_dir, ss_internal)
+                assert output_path == os.path.join(self.tmp_dir, 'data/a.txt')
+                assert move_from.call_args[1]['source_path'] == staged[-1]
+        assert len(set(staged)) == 2
+        assert all(path.endswith('/data/a.txt') for path in staged)
+        assert os.listdir(ss_internal.space.staging_path) == []
+
     def test_extract_file_file_from_compressed_aip(self):
         """ It should return a single file from a 7zip compressed aip """
         package = models.Package.objects.get(uuid='88deec53-c7dc-4828-865c-7356386e9399')
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+
+from django.core.cache import cache
+from django.test import TestCase
+import bagit
+import mock
+import pytest
+
+from locations import models
+from locations.models import pipeline_local
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.abspath(os.path.join(THIS_DIR, '..', 'fixtures'))
+
+POINTER_UUID = 'd580a1c3-afb1-41ce-b715-22bce38e2c86'
+POINTER_SHA256 = 'da327de1fd6e7a5ec3a69a282a01d0e08deb9ee3ccc3d00984e31d013d135f6c'
+
+
+class TestPipelineLocalFS(TestCase):
+
+    fixtures = ['base.json', 'package.json', 'pipeline_local.json']
+
+    def setUp(self):
+        self.pipeline_local = models.PipelineLocalFS.objects.get(pk=1)
+        models.Location.objects.filter(uuid='615103f0-0ee0-4a12-ba17-43192d1143ea').update(relative_path=FIXTURES_DIR[1:])
+        cache.clear()
+
+    def _package(self, current_path, **kwargs):
+        return models.Package.objects.create(
+            current_location_id='f1c3a1e2-9b7d-4a55-8a39-2d4c5e6f7a8b',
+            current_path=current_path, package_type=models.Package.AIP,
+            **kwargs)
+
+    @mock.patch('subprocess.check_output')
+    def test_check_package_fixity_uncompressed(self, mock_check_output):
+        """It should hash the bag on the remote host and compare the manifest."""
+        package = self._package('a/b/pkg')
+        for path, sha256 in (('data/a.txt', 'a' * 64), ('data/b.txt', 'b' * 64), ('bagit.txt', 'c' * 64)):
+            models.ManifestEntry.objects.create(
+                package=package, path=path, algorithm='sha256', checksum=sha256, size=1)
+        models.ManifestEntry.objects.create(
+            package=package, path='data/a.txt', algorithm='md5', checksum='a' * 32, size=1)
+        mock_check_output.return_value = (
+            'a' * 64 + '  ./data/a.txt\n' +
+            'e' * 64 + '  ./data/b.txt\n' +
+            'd' * 64 + '  ./data/extra.txt\n')
+
+        success, failures, message, _ = self.pipeline_local.check_package_fixity(package)
+
+        assert success is False
+        assert [(type(f), f.path) for f in failures] == [
+            (bagit.FileMissing, 'bagit.txt'),
+            (bagit.ChecksumMismatch, 'data/b.txt'),
+            (bagit.UnexpectedFile, 'data/extra.txt'),
+        ]
+        assert failures[1].algorithm == 'sha256'
+        command = mock_check_output.call_args[0][0]
+        assert command[:3] == ['ssh', '-o', 'BatchMode=yes']
+        assert '-i' not in command
+        assert command[-2] == 'archivematica@pipeline.example.com'
+        assert command[-1] == (
+            'cd -- /var/archivematica/sharedDirectory/aips/a/b/pkg && '
+            'find . -type f -print0 | xargs -0 -r sha256sum --')
+
+    @mock.patch('metsrw.METSDocument.fromfile')
+    @mock.patch('subprocess.check_output')
+    def test_check_package_fixity_compressed(self, mock_check_output, mock_fromfile):
+        """It should compare the remote file's hash with its pointer file."""
+        premis_object = mock.Mock(message_digest_algorithm='SHA-256',
+                                  message_digest=POINTER_SHA256)
+        mock_fromfile.return_value.get_file.return_value.get_premis_objects.return_value = [premis_object]
+        package = self._package(
+            'a/b/pkg.7z',
+            pointer_file_location_id='615103f0-0ee0-4a12-ba17-43192d1143ea',
+            pointer_file_path='pointer.c0f8498f-b92e-4a8b-8941-1b34ba062ed8.xml',
+            uuid=POINTER_UUID)
+        mock_check_output.return_value = (
+            POINTER_SHA256 + '  /var/archivematica/sharedDirectory/aips/a/b/pkg.7z\n')
+
+        assert self.pipeline_local.check_package_fixity(package) == (True, [], '', None)
+        mock_fromfile.return_value.get_file.assert_called_once_with(file_uuid=POINTER_UUID)
+        assert mock_check_output.call_args[0][0][-1] == (
+            'sha256sum -- /var/archivematica/sharedDirectory/aips/a/b/pkg.7z')
+
+        # Failing to run the check says nothing about the package
+        for returncode, output in ((255, ''), (1, '')):
+            mock_check_output.side_effect = subprocess.CalledProcessError(
+                returncode, 'ssh', output=output)
+            success, failures, _, _ = self.pipeline_local.check_package_fixity(package)
+            assert success is None
+            assert failures == []
+
+    @mock.patch('subprocess.check_output')
+    def test_check_package_fixity_partly_unreadable(self, mock_check_output):
+        """It should report files the remote host could not hash missing."""
+        package = self._package('a/b/pkg')
+        for path in ('data/a.txt', 'data/b.txt'):
+            models.ManifestEntry.objects.create(
+                package=package, path=path, algorithm='md5', checksum='a' * 32, size=1)
+        mock_check_output.side_effect = subprocess.CalledProcessError(
+            123, 'ssh', output='a' * 32 + '  ./data/a.txt\n')
+
+        success, failures, _, _ = self.pipeline_local.check_package_fixity(package)
+
+        assert success is False
+        assert [(type(f), f.path) for f in failures] == [(bagit.FileMissing, 'data/b.txt')]
+
+    @mock.patch('subprocess.check_output')
+    def test_check_package_fixity_falls_back(self, mock_check_output):
+        """It should fall back to a local check if it can't check remotely."""
+        package = self._package('a/b/pkg')
+        # Nothing recorded to compare with
+        with pytest.raises(NotImplementedError):
+            self.pipeline_local.check_package_fixity(package)
+        models.ManifestEntry.objects.create(
+            package=package, path='data/a.txt', algorithm='md5', checksum='a' * 32, size=1)
+        # rsync daemons can't run commands
+        self.pipeline_local.assume_rsync_daemon = True
+        with pytest.raises(NotImplementedError):
+            self.pipeline_local.check_package_fixity(package)
+        # Not enabled
+        self.pipeline_local.assume_rsync_daemon = False
+        self.pipeline_local.remote_fixity = False
+        with pytest.raises(NotImplementedError):
+            self.pipeline_local.check_package_fixity(package)
+        assert not mock_check_output.called
+
+    def test_parse_checksum_output(self):
+        """It should unescape paths with backslashes or newlines."""
+        output = (
+            'a' * 32 + '  ./data/a.txt\n' +
+            '\\' + 'b' * 32 + '  ./data/new\\nline\\\\n.txt\n' +
+            'c' * 32 + ' *./data/binary.txt\n' +
+            'd' * 32 + '  ./data/caf\xc3\xa9.txt\n')
+        assert list(pipeline_local._parse_checksum_output(output)) == [
+            (u'./data/a.txt', 'a' * 32),
+            (u'./data/new\nline\\n.txt', 'b' * 32),
+            (u'./data/binary.txt', 'c' * 32),
+            (u'./data/caf\xe9.txt', 'd' * 32),
+        ]
+
+    @mock.patch('subprocess.check_call')
+    @mock.patch('locations.models.Space.browse_rsync')
+    def test_browse_cached(self, mock_browse_rsync, mock_check_call):
+        """It should cache listings until something changes in them."""
+        listing = {'entries': ['a.txt', 'dir'], 'directories': ['dir'], 'properties': {}}
+        mock_browse_rsync.return_value = listing
+        path = '/var/archivematica/sharedDirectory/transfers'
+        assert self.pipeline_local.browse(path) == listing
+        assert self.pipeline_local.browse(path + '/') == listing
+        mock_browse_rsync.assert_called_once_with(
+            'archivematica@pipeline.example.com:' + path + '/',
+            assume_rsync_daemon=False, rsync_password='')
+
+        self.pipeline_local.delete_path(path + '/dir/sub')
+        self.pipeline_local.browse(path)
+        assert mock_browse_rsync.call_count == 2
+
+        # Failed (empty) listings are not cached
+        mock_browse_rsync.return_value = {'entries': [], 'directories': [], 'properties': {}}
+        self.pipeline_local.browse(path + '/empty')
+        self.pipeline_local.browse(path + '/empty')
+        assert mock_browse_rsync.call_count == 4
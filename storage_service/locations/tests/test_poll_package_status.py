@@ -0,0 +1,62 @@
+import time
+
+from django.test import TestCase
+import mock
+
+from locations import models
+from locations.management.commands import poll_package_status
+
+PACKAGE_DONE = 'c0f8498f-b92e-4a8b-8941-1b34ba062ed8'
+PACKAGE_PENDING = 'e52c518d-fcf4-46cc-8581-bbc01aff7af3'
+
+
+def fake_update_package_status(self, package):
+    if package.uuid == PACKAGE_DONE:
+        package.status = models.Package.UPLOADED
+        package.save()
+    return (package.status, 'Replication status: ')
+
+
+class TestPollPackageStatus(TestCase):
+
+    fixtures = ['base.json', 'arkivum.json']
+
+    def setUp(self):
+        self.command = poll_package_status.Command()
+
+    @mock.patch.object(models.Arkivum, 'update_package_status', autospec=True, side_effect=fake_update_package_status)
+    def test_poll_updates_status_and_backoff(self, update_package_status):
+        counts = self.command.poll(concurrency=1, backoff=60)
+
+        assert update_package_status.call_count == 2
+        assert counts['polled'] == 2
+        assert counts['stored'] == 1
+        assert counts['pending'] == 1
+        done = models.Package.objects.get(uuid=PACKAGE_DONE)
+        assert done.status == models.Package.UPLOADED
+        assert poll_package_status.ATTEMPTS_KEY not in done.misc_attributes
+        pending = models.Package.objects.get(uuid=PACKAGE_PENDING)
+        assert pending.status == models.Package.STAGING
+        assert pending.misc_attributes[poll_package_status.ATTEMPTS_KEY] == 1
+        assert pending.misc_attributes[poll_package_status.NEXT_POLL_KEY] > time.time() + 50
+
+    @mock.patch.object(models.Arkivum, 'update_package_status', autospec=True, side_effect=fake_update_package_status)
+    def test_poll_skips_packages_backing_off(self, update_package_status):
+        self.command.poll(concurrency=1)
+        update_package_status.reset_mock()
+
+        counts = self.command.poll(concurrency=1)
+        assert update_package_status.call_count == 0
+        assert counts['skipped'] == 1
+
+        counts = self.command.poll(concurrency=1, force=True, backoff=10)
+        assert update_package_status.call_count == 1
+        pending = models.Package.objects.get(uuid=PACKAGE_PENDING)
+        assert pending.misc_attributes[poll_package_status.ATTEMPTS_KEY] == 2
+
+    @mock.patch.object(models.Arkivum, 'update_package_status', autospec=True, side_effect=Exception('Arkivum down'))
+    def test_poll_records_errors(self, update_package_status):
+        counts = self.command.poll(concurrency=1)
+
+        assert counts['errors'] == 2
+        assert models.Package.objects.filter(status=models.Package.STAGING).count() == 2
@@ -0,0 +1,158 @@
+import datetime
+import os
+
+import bagit
+from django.test import TestCase
+from django.utils import timezone
+import mock
+
+from locations import models
+from locations.management.commands import schedule_fixity
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.abspath(os.path.join(THIS_DIR, '..', 'fixtures', ''))
+
+WORKING_BAG = '0d4e739b-bf60-4b87-bc20-67a379b28cea'
+BROKEN_BAG = '9f260047-a9b7-4a75-bb6a-e8d94c83edd2'
+ZIPPED_BAG = '6aebdb24-1b6b-41ab-b4a3-df9a73726a34'
+
+
+class TestScheduleFixity(TestCase):
+
+    fixtures = ['base.json', 'package.json']
+
+    def setUp(self):
+        models.Location.objects.filter(uuid='615103f0-0ee0-4a12-ba17-43192d1143ea').update(relative_path=FIXTURES_DIR[1:])
+
+    def _log_fixity(self, uuid, days_ago):
+        reported = timezone.now() - datetime.timedelta(days=days_ago)
+        log = models.FixityLog.objects.create(package_id=uuid, success=True)
+        models.FixityLog.objects.filter(pk=log.pk).update(datetime_reported=reported)
+        models.Package.objects.filter(uuid=uuid).update(
+            latest_fixity_check_datetime=reported, latest_fixity_check_result=True)
+
+    def test_due_packages_oldest_first(self):
+        """It should list never checked packages first, then the oldest checks."""
+        self._log_fixity(WORKING_BAG, days_ago=40)
+        self._log_fixity(BROKEN_BAG, days_ago=60)
+        self._log_fixity(ZIPPED_BAG, days_ago=1)
+
+        due = [p.uuid for p in schedule_fixity.due_packages(datetime.timedelta(days=30))]
+
+        # Only AIPs, and ZIPPED_BAG was checked recently
+        assert due == ['88deec53-c7dc-4828-865c-7356386e9399', BROKEN_BAG, WORKING_BAG]
+
+    def test_in_hours(self):
+        def at(hour):
+            return datetime.datetime(2017, 1, 1, hour)
+
+        assert schedule_fixity.in_hours(None, at(12))
+        assert schedule_fixity.in_hours((9, 17), at(9))
+        assert not schedule_fixity.in_hours((9, 17), at(17))
+        assert schedule_fixity.in_hours((22, 6), at(23))
+        assert schedule_fixity.in_hours((22, 6), at(3))
+        assert not schedule_fixity.in_hours((22, 6), at(12))
+
+    def test_paused_for_ingests(self):
+        """It should pause for packages being stored, but not stale ones."""
+        package = models.Package.objects.get(uuid=WORKING_BAG)
+        package.status = models.Package.STAGING
+        package.save()
+        # Left STAGING by a failed ingest long ago
+        models.Package.objects.filter(uuid=BROKEN_BAG).update(
+            status=models.Package.PENDING,
+            modified=timezone.now() - datetime.timedelta(days=2))
+        command = schedule_fixity.Command()
+        command.options = {'hours': None, 'max_ingests': None}
+        assert command.paused() is None
+        command.options['max_ingests'] = 0
+        assert command.paused() == '1 packages being stored'
+        command.options['max_ingests'] = 1
+        assert command.paused() is None
+        command.options.update(max_ingests=0, ingest_timeout=72)
+        assert command.paused() == '2 packages being stored'
+
+    def test_read_budget(self):
+        """It should space out reads to stay under the rate."""
+        budget = schedule_fixity.ReadBudget(rate=1000)
+        assert budget.reserve(2000) < 0.1
+        assert 1.9 < budget.reserve(1000) <= 2
+        assert 2.9 < budget.reserve(0) <= 3
+        assert schedule_fixity.ReadBudget(rate=0).reserve(10 ** 12) == 0
+
+    def test_check_paces_reads(self):
+        """It should pace every block read while hashing, not only the start."""
+        command = schedule_fixity.Command()
+        command.options = {'force_local': True}
+        package = models.Package.objects.get(uuid=WORKING_BAG)
+        budget = schedule_fixity.ReadBudget(rate=0)
+        spent = []
+        with mock.patch.object(budget, 'spend', side_effect=spent.append):
+            assert command.check(package, budget)['success'] is True
+        # Every file in the manifests is paced as it is read
+        listed = bagit.Bag(package.full_path).entries
+        assert len(spent) == len(listed)
+        assert sum(spent) == sum(
+            os.path.getsize(os.path.join(package.full_path, rel_path))
+            for rel_path in listed)
+
+    def test_read_budget_spend(self):
+        """It should sleep off reads beyond the rate."""
+        budget = schedule_fixity.ReadBudget(rate=1000)
+        with mock.patch('time.sleep') as sleep:
+            budget.spend(1000)
+            budget.spend(500)
+        assert len(sleep.call_args_list) == 1
+        assert 0.9 < sleep.call_args[0][0] <= 1
+
+    def test_check_records_fixity(self):
+        """It should record the result like an API fixity check."""
+        command = schedule_fixity.Command()
+        command.options = {'force_local': True}
+        package = models.Package.objects.get(uuid=WORKING_BAG)
+
+        report = command.check(package, schedule_fixity.ReadBudget(rate=0))
+
+        assert report['success'] is True
+        assert package.latest_fixity_check_result is True
+
+    def test_check_quick_between_full_checks(self):
+        """It should run quick checks until a full check is due."""
+        command = schedule_fixity.Command()
+        command.options = {'force_local': True, 'full_every': 7}
+        package = models.Package.objects.get(uuid=WORKING_BAG)
+        budget = schedule_fixity.ReadBudget(rate=0)
+
+        assert command.check(package, budget)['check_level'] == 'full'
+        assert command.check(package, budget)['check_level'] == 'quick'
+        models.FixityLog.objects.filter(package=package).update(
+            datetime_reported=timezone.now() - datetime.timedelta(days=8))
+        assert command.check(package, budget)['check_level'] == 'full'
+        levels = models.FixityLog.objects.filter(package=package).values_list(
+            'check_level', flat=True)
+        assert sorted(levels) == ['full', 'full', 'quick']
+
+    def test_check_sampled(self):
+        """It should verify a share of the files when sampling is enabled."""
+        command = schedule_fixity.Command()
+        command.options = {'force_local': True, 'sample_runs': 2}
+        package = models.Package.objects.get(uuid=WORKING_BAG)
+
+        report = command.check(package, schedule_fixity.ReadBudget(rate=0))
+
+        assert report['success'] is True
+        assert report['check_level'] == 'sample'
+        assert models.Package.objects.get(uuid=WORKING_BAG).misc_attributes['fixity_sample_next'] == 1
+
+    def test_check_sampled_full_every(self):
+        """It should count a complete rotation of samples as a full check."""
+        command = schedule_fixity.Command()
+        command.options = {'force_local': True, 'sample_runs': 2, 'full_every': 30}
+
+        levels = []
+        for _ in range(3):
+            package = models.Package.objects.get(uuid=WORKING_BAG)
+            report = command.check(package, schedule_fixity.ReadBudget(rate=0))
+            levels.append(report['check_level'])
+
+        assert levels == ['sample', 'sample', 'quick']
@@ -0,0 +1,166 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.test import TestCase
+import mock
+
+from locations import models
+from locations.models import space, DirectoryStats
+
+
+class TestSpace(TestCase):
+
+    fixtures = ['base.json']
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        for directory in ('Images/sub', 'empty', '.hidden'):
+            os.makedirs(os.path.join(self.tmp_dir, directory))
+        for path, content in (('b.txt', 'bb'), ('Images/a.jpg', 'a'), ('Images/sub/c.jpg', 'cc')):
+            with open(os.path.join(self.tmp_dir, path), 'w') as f:
+                f.write(content)
+        # Indexed listings of just changed directories aren't trusted
+        self.past = time.time() - 60
+        for root, __, __ in os.walk(self.tmp_dir):
+            os.utime(root, (self.past, self.past))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @mock.patch('locations.models.DirectoryStats.refresh_in_background')
+    def test_path2browse_dict(self, mock_refresh):
+        """It should list entries, directories and their properties."""
+        with mock.patch('common.utils.get_setting', return_value=False) as get_setting:
+            ret = space.path2browse_dict(self.tmp_dir)
+        assert get_setting.call_count == 1
+        assert ret['entries'] == ['b.txt', 'empty', 'Images']
+        assert ret['directories'] == ['empty', 'Images']
+        assert ret['properties']['b.txt'] == {'size': 2}
+        assert ret['properties']['Images']['object count'] == 2
+        assert ret['properties']['empty']['object count'] == 0
+
+    def test_path2browse_dict_object_counting_disabled(self):
+        """It should still list directories when object counting is disabled."""
+        ret = space.path2browse_dict(self.tmp_dir, object_counting_disabled=True)
+        assert ret['directories'] == ['empty', 'Images']
+        assert ret['properties']['Images']['object count'] == '0+'
+        assert 'object count' not in ret['properties']['b.txt']
+
+    def test_filter_browse_dict(self):
+        """It should filter, sort and paginate entries."""
+        objects = {
+            'entries': ['b.txt', 'C.txt', 'a.jpg', 'Images', 'nosize.txt'],
+            'directories': ['Images'],
+            'properties': {'b.txt': {'size': 2}, 'C.txt': {'size': 2},
+                           'a.jpg': {'size': 5}, 'Images': {'size': 1}},
+        }
+        ret = space.filter_browse_dict(objects)
+        assert ret['entries'] == ['a.jpg', 'b.txt', 'C.txt', 'Images', 'nosize.txt']
+        assert ret['meta'] == {'offset': 0, 'limit': None, 'total_count': 5}
+
+        ret = space.filter_browse_dict(objects, glob='*.txt', sort='size', reverse=True)
+        assert ret['entries'] == ['C.txt', 'b.txt', 'nosize.txt']
+
+        ret = space.filter_browse_dict(objects, sort='size', offset=1, limit=2)
+        assert ret['entries'] == ['b.txt', 'C.txt']
+        assert ret['directories'] == []
+        assert ret['properties'] == {'b.txt': {'size': 2}, 'C.txt': {'size': 2}}
+        assert ret['meta'] == {'offset': 1, 'limit': 2, 'total_count': 5}
+
+        # Non-ASCII str names can be filtered with unicode, as from a request
+        objects['entries'] += ['\xc3\xa9t\xc3\xa9 2.txt', '\xc3\xa9t\xc3\xa9.txt']
+        ret = space.filter_browse_dict(objects, prefix=u'\xe9t\xe9', glob=u'\xe9*.txt')
+        assert ret['entries'] == ['\xc3\xa9t\xc3\xa9 2.txt', '\xc3\xa9t\xc3\xa9.txt']
+
+        ret = space.filter_browse_dict(objects, prefix='I')
+        assert ret['entries'] == ret['directories'] == ['Images']
+
+    @mock.patch('locations.models.space.count_objects_in_directory', return_value=2)
+    def test_path2browse_dict_counts_page_only(self, mock_count):
+        """It should only count objects in the directories of the page."""
+        ret = space.path2browse_dict(self.tmp_dir, object_counting_disabled=False, limit=2)
+        assert ret['entries'] == ['b.txt', 'empty']
+        mock_count.assert_called_once_with(os.path.join(self.tmp_dir, 'empty'))
+
+    def test_directory_stats(self):
+        """It should cache recursive counts until a directory changes."""
+        assert DirectoryStats.get_file_count(self.tmp_dir) is None
+        assert DirectoryStats.refresh(self.tmp_dir) == 3
+        assert DirectoryStats.objects.count() == 5
+        assert DirectoryStats.get_file_count(self.tmp_dir) == 3
+        assert DirectoryStats.get_file_count(os.path.join(self.tmp_dir, 'Images')) == 2
+        # Trees with too many directories to check aren't served from the cache
+        assert DirectoryStats.get_file_count(self.tmp_dir, max_directories=4) is None
+
+        # Changing a deep directory invalidates its ancestors' totals
+        with open(os.path.join(self.tmp_dir, 'Images/sub/d.jpg'), 'w') as f:
+            f.write('dddd')
+        assert DirectoryStats.get_file_count(self.tmp_dir) is None
+        with mock.patch.object(DirectoryStats, '_scan', wraps=DirectoryStats._scan) as scan:
+            assert DirectoryStats.refresh(self.tmp_dir) == 4
+        assert [call[0][0] for call in scan.call_args_list] == [
+            os.path.join(self.tmp_dir, 'Images/sub')]
+
+        # Entries of removed directories are deleted
+        shutil.rmtree(os.path.join(self.tmp_dir, 'Images'))
+        assert DirectoryStats.refresh(self.tmp_dir) == 1
+        assert DirectoryStats.objects.count() == 3
+
+    def test_directory_stats_recent_change(self):
+        """It should not trust listings of directories changed just before
+        they were listed, whose mtime might not change again."""
+        images = os.path.join(self.tmp_dir, 'Images')
+        os.utime(images, None)
+        assert DirectoryStats.refresh(self.tmp_dir) == 3
+        assert DirectoryStats.get_listing(images) is None
+        assert DirectoryStats.get_file_count(self.tmp_dir) is None
+        assert DirectoryStats.get_listing(self.tmp_dir) is not None
+
+    @mock.patch('locations.models.DirectoryStats.refresh_in_background')
+    def test_path2browse_dict_indexed_sizes(self, mock_refresh):
+        """It should stat the sizes of indexed entries, which can change
+        without their directory changing."""
+        DirectoryStats.refresh(self.tmp_dir)
+        with open(os.path.join(self.tmp_dir, 'b.txt'), 'a') as f:
+            f.write('bbb')
+        assert DirectoryStats.get_listing(self.tmp_dir) is not None
+        with mock.patch('locations.models.space.scandir') as mock_scandir:
+            ret = space.path2browse_dict(self.tmp_dir, object_counting_disabled=True, limit=1)
+            assert ret['properties']['b.txt'] == {'size': 5}
+            ret = space.path2browse_dict(self.tmp_dir, object_counting_disabled=True, sort='size', offset=1)
+            assert ret['properties']['Images']['size'] == os.stat(os.path.join(self.tmp_dir, 'Images')).st_size
+            assert 'b.txt' not in ret['entries']
+        assert not mock_scandir.called
+
+    @mock.patch('locations.models.DirectoryStats.refresh_in_background')
+    def test_count_objects_in_directory_cached(self, mock_refresh):
+        """It should serve cached counts, and refresh them in the background otherwise."""
+        images = os.path.join(self.tmp_dir, 'Images')
+        assert space.count_objects_in_directory(images) == 2
+        mock_refresh.assert_called_once_with(images)
+
+        DirectoryStats.refresh(images)
+        mock_refresh.reset_mock()
+        with mock.patch('locations.models.space.walk') as mock_walk:
+            assert space.count_objects_in_directory(images) == 2
+        assert not mock_walk.called
+        assert not mock_refresh.called
+
+    @mock.patch('subprocess.check_call')
+    def test_create_rsync_directory(self, mock_check_call):
+        """It should create all missing remote directories in one rsync."""
+        def check_call(cmd):
+            # The whole structure is synced from the temporary directory
+            assert os.path.isdir(os.path.join(cmd[-2], 'var/aips/a/b'))
+            assert cmd[-1] == 'user@host:/'
+        mock_check_call.side_effect = check_call
+        space_obj = models.Space.objects.get(pk=1)
+        space_obj.create_rsync_directory('/var/aips/a/b/pkg.7z', 'user', 'host')
+        assert mock_check_call.call_count == 1
+        # The temporary directory is removed
+        assert not os.path.exists(mock_check_call.call_args[0][0][-2])
+
+        space_obj.create_rsync_directory('pkg.7z', 'user', 'host')
+        assert mock_check_call.call_count == 1
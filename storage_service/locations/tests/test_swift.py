@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
+import hashlib
 import os
 import shutil
 
 from django.test import TestCase
+import bagit
+import mock
 import pytest
 import vcr
 
@@ -118,6 +121,29 @@ class TestSwift(TestCase):
         # Cleanup
         self.swift_object.delete_path('transfers/SampleTransfers/test.txt')
 
+    def test_move_from_ss_reads_once(self):
+        """It should hash the file while uploading it and check Swift's ETag."""
+        path = 'test.txt'
+        with open(path, 'wb') as f:
+            f.write(b'package')
+        md5 = hashlib.md5(b'package').hexdigest()
+        package = self._package('a/b/pkg.7z')
+        self.swift_object._connection = mock.Mock()
+        self.swift_object._connection.put_object.side_effect = (
+            lambda *args, **kwargs: hashlib.md5(kwargs['contents'].read()).hexdigest())
+        with mock.patch('common.utils.generate_checksum') as generate_checksum:
+            self.swift_object.move_from_storage_service(path, 'aips/pkg.7z', package=package)
+        assert not generate_checksum.called
+        assert package.stored_md5 == md5
+        assert 'etag' not in self.swift_object._connection.put_object.call_args[1]
+
+        self.swift_object._connection.put_object.side_effect = None
+        self.swift_object._connection.put_object.return_value = 'e' * 32
+        with pytest.raises(models.StorageException):
+            self.swift_object.move_from_storage_service(path, 'aips/pkg.7z')
+        self.swift_object._connection.delete_object.assert_called_once_with(
+            'artefactual', 'aips/pkg.7z')
+
     @vcr.use_cassette(os.path.join(FIXTURES_DIR, 'vcr_cassettes', 'swift_delete.yaml'))
     def test_delete_path(self):
         # Setup
@@ -141,3 +167,53 @@ class TestSwift(TestCase):
         # Verify deleted
         resp = self.swift_object.browse('transfers/SampleTransfers/')
         assert 'test' not in resp['directories']
+
+    def _package(self, current_path, **kwargs):
+        return models.Package.objects.create(
+            current_location_id='d9d7db26-f7a1-40aa-9db1-806b4d3a61cd',
+            current_path=current_path, package_type=models.Package.AIP,
+            **kwargs)
+
+    def test_check_package_fixity_compressed(self):
+        """It should compare the object's ETag with the MD5 recorded at upload."""
+        package = self._package('a/b/pkg.7z', misc_attributes={'stored_md5': 'f' * 32})
+        self.swift_object._connection = mock.Mock()
+        self.swift_object._connection.head_object.return_value = {
+            'etag': 'f' * 32, 'content-length': '100'}
+        assert self.swift_object.check_package_fixity(package) == (True, [], '', None)
+        self.swift_object._connection.head_object.assert_called_once_with(
+            'artefactual', '/aips/a/b/pkg.7z')
+
+        self.swift_object._connection.head_object.return_value['etag'] = 'e' * 32
+        success, failures, message, _ = self.swift_object.check_package_fixity(package)
+        assert success is False
+        assert [(f.path, f.expected, f.found) for f in failures] == [('pkg.7z', 'f' * 32, 'e' * 32)]
+
+    def test_check_package_fixity_uncompressed(self):
+        """It should compare a container listing with the bag's MD5 manifest."""
+        package = self._package('a/b/pkg')
+        for path, md5 in (('data/a.txt', 'a' * 32), ('data/b.txt', 'b' * 32), ('bagit.txt', 'c' * 32)):
+            models.ManifestEntry.objects.create(
+                package=package, path=path, algorithm='md5', checksum=md5, size=1)
+        self.swift_object._connection = mock.Mock()
+        self.swift_object._connection.get_container.return_value = ({}, [
+            {'name': '/aips/a/b/pkg/data/a.txt', 'hash': 'a' * 32, 'bytes': 1},
+            {'name': '/aips/a/b/pkg/data/b.txt', 'hash': 'b' * 32, 'bytes': 2},
+            {'name': '/aips/a/b/pkg/data/extra.txt', 'hash': 'd' * 32, 'bytes': 1},
+        ])
+        success, failures, message, _ = self.swift_object.check_package_fixity(package)
+        assert success is False
+        assert [(type(f), f.path) for f in failures] == [
+            (bagit.FileMissing, 'bagit.txt'),
+            (bagit.ChecksumMismatch, 'data/b.txt'),
+            (bagit.UnexpectedFile, 'data/extra.txt'),
+        ]
+        assert failures[1].algorithm == 'size'
+
+    def test_check_package_fixity_not_recorded(self):
+        """It should fall back to a local check if no MD5s were recorded."""
+        package = self._package('a/b/pkg')
+        self.swift_object._connection = mock.Mock()
+        with pytest.raises(NotImplementedError):
+            self.swift_object.check_package_fixity(package)
+        assert not self.swift_object._connection.get_container.called
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from django.test import TestCase, override_settings
+import mock
+
+from common import utils
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.abspath(os.path.join(THIS_DIR, '..', 'fixtures'))
+
+
+class TestUtils(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_generate_checksums(self):
+        """It should compute several checksums in one read."""
+        path = os.path.join(self.tmp_dir, 'large.bin')
+        content = os.urandom(utils.CHECKSUM_BLOCK_SIZE) * 2 + b'tail'
+        with open(path, 'wb') as f:
+            f.write(content)
+        expected = {
+            'md5': hashlib.md5(content).hexdigest(),
+            'sha512': hashlib.sha512(content).hexdigest(),
+        }
+        checksums = utils.generate_checksums(path, ('md5', 'sha512'))
+        assert dict((k, v.hexdigest()) for k, v in checksums.items()) == expected
+        assert utils.generate_checksum(path, 'sha512').hexdigest() == expected['sha512']
+
+    def test_map_in_threads(self):
+        """It should return results in order."""
+        assert list(utils.map_in_threads(lambda x: x * 2, range(20), 4)) == list(range(0, 40, 2))
+        assert list(utils.map_in_threads(lambda x: x * 2, range(3), 1)) == [0, 2, 4]
+
+    def test_map_in_threads_lazy(self):
+        """It should only take items from the iterable a few at a time."""
+        taken = []
+
+        def items():
+            for item in range(100):
+                taken.append(item)
+                yield item
+
+        results = utils.map_in_threads(lambda x: x * 2, items(), 4)
+        assert next(results) == 0
+        assert len(taken) <= 8
+        assert list(results) == list(range(2, 200, 2))
+
+    def test_start_native_thread(self):
+        """It should call the target in another thread."""
+        done = threading.Event()
+        utils.start_native_thread(done.set)
+        assert done.wait(5)
+
+    def test_ssh_options(self):
+        """It should share ssh connections unless disabled."""
+        control_dir = os.path.join(self.tmp_dir, 'ssh')
+        with override_settings(SSH_CONTROL_PERSIST=60, SSH_CONTROL_DIR=control_dir):
+            assert utils.ssh_options() == [
+                '-o', 'ControlMaster=auto',
+                '-o', 'ControlPath=' + os.path.join(control_dir, '%C'),
+                '-o', 'ControlPersist=60']
+            assert os.path.isdir(control_dir)
+            assert utils.rsync_rsh('/key').startswith('ssh -i /key -o ControlMaster=auto ')
+        with override_settings(SSH_CONTROL_PERSIST=0):
+            assert utils.ssh_options() == []
+            assert utils.rsync_rsh() == 'ssh'
+
+    def test_ssh_options_private_dir(self):
+        """It should not share ssh connections through a directory others can use."""
+        control_dir = os.path.join(self.tmp_dir, 'ssh')
+        os.mkdir(control_dir)
+        os.chmod(control_dir, 0o777)
+        with override_settings(SSH_CONTROL_PERSIST=60, SSH_CONTROL_DIR=control_dir):
+            assert utils.ssh_options() == []
+            os.chmod(control_dir, 0o700)
+            assert utils.ssh_options() != []
+            os.rmdir(control_dir)
+            os.symlink(self.tmp_dir, control_dir)
+            assert utils.ssh_options() == []
+
+    def test_cached_check_output(self):
+        """It should run each command once, unless it fails."""
+        utils.clear_cached_check_output()
+        with mock.patch.object(subprocess, 'check_output',
+                               side_effect=[subprocess.CalledProcessError(1, 'tar'),
+                                            'tar 1.29', '7-Zip 16.02']) as mock_check_output:
+            with self.assertRaises(subprocess.CalledProcessError):
+                utils.cached_check_output(['tar', '--version'])
+            for __ in range(2):
+                assert utils.cached_check_output(['tar', '--version']) == 'tar 1.29'
+                assert utils.cached_check_output('7z') == '7-Zip 16.02'
+            assert mock_check_output.call_count == 3
+            utils.clear_cached_check_output()
+            with self.assertRaises(StopIteration):
+                utils.cached_check_output('7z')
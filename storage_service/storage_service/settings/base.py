@@ -5,8 +5,9 @@
 import json
 import logging
 import logging.config
+import multiprocessing
 from os import environ
-from os.path import abspath, basename, dirname, isfile, join, normpath
+from os.path import abspath, basename, dirname, expanduser, isfile, join, normpath
 from sys import path
 
 from django.core.exceptions import ImproperlyConfigured
@@ -395,16 +396,83 @@ if SHIBBOLETH_AUTHENTICATION:
 
     ALLOW_USER_EDITS = False
 
-# WARNING: if Gunicorn is being used to serve the Storage Service and its
-# worker class is set to `gevent`, then BagIt validation must use 1 process.
-# Otherwise, calls to `validate` will hang because of the incompatibility
-# between gevent and multiprocessing (BagIt) concurrency strategies. See
-# https://github.com/artefactual/archivematica/issues/708
+# Number of native threads used to hash files when validating bags, e.g. for
+# fixity checks. Hashing releases the GIL, so this scales with CPU cores; the
+# threads come from gevent's threadpool under gevent workers. 0 means one per
+# CPU core. SS_BAG_VALIDATION_NO_PROCESSES, which it replaces, is still read
+# if it is not set.
+fixity_hash_threads = environ.get('SS_FIXITY_HASH_THREADS')
+if (fixity_hash_threads is None and
+        'SS_BAG_VALIDATION_NO_PROCESSES' in environ):
+    logging.getLogger(__name__).warning(
+        'SS_BAG_VALIDATION_NO_PROCESSES is deprecated, use'
+        ' SS_FIXITY_HASH_THREADS instead')
+    fixity_hash_threads = environ['SS_BAG_VALIDATION_NO_PROCESSES']
 try:
-    BAG_VALIDATION_NO_PROCESSES = int(
-        environ.get('SS_BAG_VALIDATION_NO_PROCESSES', 1))
+    FIXITY_HASH_THREADS = int(fixity_hash_threads or 0)
 except ValueError:
-    BAG_VALIDATION_NO_PROCESSES = 1
+    FIXITY_HASH_THREADS = 0
+if FIXITY_HASH_THREADS < 1:
+    try:
+        FIXITY_HASH_THREADS = multiprocessing.cpu_count()
+    except NotImplementedError:
+        FIXITY_HASH_THREADS = 1
+
+# Number of files encrypted or decrypted at once in GPG spaces that encrypt
+# each file of a package separately. Each runs its own gpg process. 0 means
+# one per CPU core.
+try:
+    GPG_THREADS = int(environ.get('SS_GPG_THREADS', 0))
+except ValueError:
+    GPG_THREADS = 0
+if GPG_THREADS < 1:
+    try:
+        GPG_THREADS = multiprocessing.cpu_count()
+    except NotImplementedError:
+        GPG_THREADS = 1
+
+# Maximum number of packages checked at once by a bulk fixity check requested
+# through the API.
+try:
+    FIXITY_BULK_MAX_WORKERS = int(
+        environ.get('SS_FIXITY_BULK_MAX_WORKERS', 4))
+except ValueError:
+    FIXITY_BULK_MAX_WORKERS = 4
+
+# Number of LOCKSS chunks written concurrently when splitting a package.
+# Raise it on storage that handles parallel writes well.
+try:
+    LOCKSS_SPLIT_WORKERS = int(
+        environ.get('SS_LOCKSS_SPLIT_WORKERS', 1))
+except ValueError:
+    LOCKSS_SPLIT_WORKERS = 1
+
+# Seconds to cache Arkivum replication, locality and fixity information for
+# a package or file. Download requests check locality on every request.
+try:
+    ARKIVUM_CACHE_TTL = int(
+        environ.get('SS_ARKIVUM_CACHE_TTL', 60))
+except ValueError:
+    ARKIVUM_CACHE_TTL = 60
+
+# Remote hosts reached over ssh (e.g. pipelines' local filesystems) share one
+# master connection per user and host, kept open for this many seconds after
+# its last use. Set to 0 to open a new connection for every command.
+try:
+    SSH_CONTROL_PERSIST = int(
+        environ.get('SS_SSH_CONTROL_PERSIST', 300))
+except ValueError:
+    SSH_CONTROL_PERSIST = 300
+# Must be private to the storage service user, so it is kept in its home
+SSH_CONTROL_DIR = environ.get(
+    'SS_SSH_CONTROL_DIR', join(expanduser('~'), '.ssh', 'storage-service'))
+
+# Seconds to cache directory listings of remote pipeline filesystems
+try:
+    RSYNC_BROWSE_CACHE_TTL = int(
+        environ.get('SS_RSYNC_BROWSE_CACHE_TTL', 10))
+except ValueError:
+    RSYNC_BROWSE_CACHE_TTL = 10
 
 GNUPG_HOME_PATH = environ.get('SS_GNUPG_HOME_PATH', None)
 